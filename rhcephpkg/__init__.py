@@ -1,6 +1,8 @@
 import os
 from .log import log
 from .build import Build
+from .build_stats import BuildStats
+from .cache import Cache
 from .checkout_from_patches import CheckoutFromPatches
 from .clone import Clone
 from .download import Download
@@ -9,14 +11,16 @@ from .hello import Hello
 from .list_builds import ListBuilds
 from .localbuild import Localbuild
 from .merge_patches import MergePatches
+from .mirror import Mirror
 from .new_version import NewVersion
 from .patch import Patch
 from .source import Source
 from .watch_build import WatchBuild
 
-__all__ = ['log', 'Build', 'CheckoutFromPatches', 'Clone', 'Download',
-           'Gitbz', 'Hello', 'ListBuilds', 'Localbuild', 'MergePatches',
-           'NewVersion', 'Patch', 'Source', 'WatchBuild']
+__all__ = ['log', 'Build', 'BuildStats', 'Cache', 'CheckoutFromPatches',
+           'Clone', 'Download', 'Gitbz', 'Hello', 'ListBuilds', 'Localbuild',
+           'MergePatches', 'Mirror', 'NewVersion', 'Patch', 'Source',
+           'WatchBuild']
 
 __version__ = '1.13.0'
 
@@ -1,32 +1,163 @@
+import os
+import subprocess
 from time import sleep
 from tambo import Transport
 import posixpath
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.download import read_manifest
+from rhcephpkg.history import record_build
+from rhcephpkg.jenkins_api import OUTAGE_ERRORS
+from rhcephpkg import preflight
 import rhcephpkg.log as log
 import rhcephpkg.util as util
+from rhcephpkg.poll import CircuitBreaker, PollScheduler
 from rhcephpkg.watch_build import WatchBuild
 
+# How many jobs of a batch may be queued or building at once.
+DEFAULT_IN_FLIGHT = 4
+
+
+def read_batch(path):
+    """
+    Find the packages and branches to build in a manifest file or a
+    workspace directory.
+
+    A manifest has one "package branch" pair per line, optionally followed
+    by the debian/changelog version that the branch will build. For a
+    workspace directory, we build the current branch of each dist-git clone
+    in it.
+
+    :returns: ``list`` of ``BatchJob``s
+    """
+    jobs = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            clone = os.path.join(path, name)
+            if os.path.isdir(os.path.join(clone, '.git')):
+                jobs.append(BatchJob(name, util.current_branch(clone),
+                                     clone=clone))
+        return jobs
+    for line in read_manifest(path):
+        fields = line.split()
+        if len(fields) not in (2, 3):
+            raise SystemExit('%s: expected "package branch [version]", '
+                             'not "%s"' % (path, line))
+        version = None
+        if len(fields) == 3:
+            version = fields[2]
+        jobs.append(BatchJob(fields[0], fields[1], version=version))
+    return jobs
+
+
+class BatchJob(object):
+    """ One package and branch in a batch, from submission to result. """
+
+    def __init__(self, pkg, branch, clone=None, version=None):
+        self.pkg = pkg
+        self.branch = branch
+        # The dist-git clone, for a workspace directory.
+        self.clone = clone
+        # The debian/changelog version, if a manifest told us.
+        self.version = version
+        self.queue_number = None
+        self.queued = None
+        self.build_number = None
+        self.result = None
+
+    @property
+    def state(self):
+        if self.result is not None:
+            return self.result
+        if self.build_number is not None:
+            return 'BUILDING'
+        if self.queue_number is not None:
+            return 'QUEUED'
+        return 'PENDING'
+
+    @property
+    def in_flight(self):
+        return self.queue_number is not None and self.result is None
+
+
+def matrix(jobs):
+    """
+    Tabulate the states of a batch's jobs, with one row per package and one
+    column per branch.
+
+    :param jobs: ``list`` of ``BatchJob``s
+    :returns: ``str``
+    """
+    packages = []
+    for job in jobs:
+        if job.pkg not in packages:
+            packages.append(job.pkg)
+    branches = sorted(set(job.branch for job in jobs))
+    states = dict(((job.pkg, job.branch), job.state) for job in jobs)
+    rows = [['package'] + branches]
+    for pkg in packages:
+        rows.append([pkg] + [states.get((pkg, branch), '-')
+                             for branch in branches])
+    return util.format_table(rows)
+
 
 class Build(object):
     help_menu = 'build a package in Jenkins'
     _help = """
 Build a package in Jenkins.
-"""
+
+With no options, build the current directory's package and branch, and
+watch the build until it finishes.
+
+Jenkins builds the branch as it is on origin, so we fetch the branch
+first. We skip the build if Jenkins already built origin's latest commit
+successfully, or if chacra already has a build of that commit's
+debian/changelog version.
+
+Options:
+--force   Build even if it looks like we already have this build
+--batch   Build many packages: either a manifest file with one
+          "package branch [version]" entry per line, or a workspace
+          directory of dist-git clones (we build each clone's current
+          branch)
+--jobs    With --batch, how many jobs to have queued or building in
+          Jenkins at once (default: %d)
+
+A batch checks each package for an existing build in the same way, except
+that we can only look for a manifest entry's build in chacra, and only if
+the entry gives its version. Packages that are already built show as
+SKIPPED. A batch watches all its builds together, and prints a table of
+their results when they have all finished.
+""" % DEFAULT_IN_FLIGHT
     name = 'build'
 
     def __init__(self, argv):
         self.argv = argv
-        self.options = []
+        self.options = ['--batch', '--jobs']
+        # The commits that build-package has built, shared by all our
+        # duplicate checks.
+        self.built = None
 
     def main(self):
         self.parser = Transport(self.argv, options=self.options)
         self.parser.catch_help = self.help()
         self.parser.parse_args()
-        self._run()
+        if not self.parser.has('--batch'):
+            return self._run(force=self.parser.has('--force'))
+        path = self.parser.get('--batch')
+        if path is None:
+            raise SystemExit('Specify a manifest file or directory to --batch')
+        in_flight = DEFAULT_IN_FLIGHT
+        if self.parser.has('--jobs'):
+            in_flight = util.positive_int(self.parser, '--jobs')
+        jobs = read_batch(path)
+        if not jobs:
+            raise SystemExit('found no packages to build in %s' % path)
+        self.batch(jobs, in_flight, force=self.parser.has('--force'))
 
     def help(self):
         return self._help
 
-    def _run(self):
+    def _run(self, force=False):
         """ Build a package in Jenkins. """
         pkg_name = util.package_name()
         branch_name = util.current_branch()
@@ -37,6 +168,13 @@ Build a package in Jenkins.
             msg = 'You can switch to the debian branch with "gbp pq switch"'
             raise SystemExit(msg)
 
+        if not force:
+            duplicate = self.find_duplicate(jenkins, pkg_name, branch_name)
+            if duplicate is not None:
+                log.info('%s is already built, skipping (use --force to '
+                         'build it again)' % duplicate)
+                return
+
         log.info('building %s branch %s at %s', pkg_name, branch_name,
                  posixpath.join(jenkins.url, 'job', 'build-package'))
         job_params = {'PKG_NAME': pkg_name, 'BRANCH': branch_name}
@@ -48,12 +186,13 @@ Build a package in Jenkins.
         # Job is now queued, not yet running.
         log.info('Waiting for build queue #%d' % queue_number)
         log.info('This may be safely interrupted...')
-        queue_item = jenkins.get_queue_item(queue_number)
+        scheduler = PollScheduler()
+        queue_item = jenkins.queue_status(queue_number)
         while 'executable' not in queue_item:
             try:
                 log.info('queue state: %s' % queue_item['why'])
-                sleep(2)
-                queue_item = jenkins.get_queue_item(queue_number)
+                sleep(scheduler.next(queue_item['why']))
+                queue_item = jenkins.queue_status(queue_number)
             except KeyboardInterrupt:
                 # We have no build_number, so just print a general message with
                 # a basic URL for the user to check.
@@ -63,6 +202,162 @@ Build a package in Jenkins.
 
         # Job is now running.
         build_number = queue_item['executable']['number']
+        queued = None
+        if queue_item.get('inQueueSince'):
+            queued = queue_item['inQueueSince'] / 1000.0
         # Pass the rest over to the "watch-build" command.
         watcher = WatchBuild(['watch'])
-        watcher.watch(build_number)
+        watcher.watch(build_number, queued=queued)
+
+    def find_duplicate(self, jenkins, pkg_name, branch_name, clone=os.curdir,
+                       version=None):
+        """
+        Look for an existing build of the latest commit of a branch on
+        origin, or of that commit's debian/changelog version.
+
+        build-package builds the branch as it is on origin, not our clone,
+        which may be behind. So we fetch the branch first.
+
+        :param clone: ``str``, the dist-git clone (default: the current
+                      directory), or None if we do not have one
+        :param version: ``str``, the debian/changelog version, if we
+                        already know it
+        :returns: ``str`` describing the existing build, or None
+        """
+        if clone is not None:
+            try:
+                util.fetch_branch(branch_name, clone)
+                sha1 = util.current_revision(clone, 'origin/' + branch_name)
+            except subprocess.CalledProcessError as e:
+                log.warning('could not fetch %s from origin, not checking '
+                            'for an existing build: %s' % (branch_name, e))
+                return None
+            if self.built is None:
+                self.built = preflight.BuiltRevisions()
+            number = preflight.jenkins_duplicate(jenkins, pkg_name,
+                                                 branch_name, sha1,
+                                                 self.built)
+            if number is not None:
+                return '%s at %s' % (sha1[:10],
+                                     posixpath.join(jenkins.url, 'job',
+                                                    'build-package',
+                                                    str(number)))
+        if not util.config().has_option('rhcephpkg.chacra', 'url'):
+            return None
+        if version is None and clone is not None:
+            try:
+                version = str(util.get_deb_version(clone, sha1))
+            except (subprocess.CalledProcessError, ValueError,
+                    IndexError) as e:
+                log.debug('not checking chacra: %s' % e)
+        if version is None:
+            return None
+        nvr = preflight.chacra_duplicate(ChacraClient(pool_size=1), pkg_name,
+                                         branch_name, version)
+        if nvr is not None:
+            return '%s_%s in chacra' % (pkg_name, nvr)
+        return None
+
+    def batch(self, jobs, in_flight=DEFAULT_IN_FLIGHT, force=False):
+        """
+        Build many packages, with at most in_flight of them queued or
+        building at once.
+
+        :param jobs: ``list`` of ``BatchJob``s
+        :param force: ``bool``, build packages even if they look like they
+                      are already built
+        """
+        for job in jobs:
+            if job.branch.startswith('patch-queue/'):
+                raise SystemExit('%s: %s is a patch-queue branch' %
+                                 (job.pkg, job.branch))
+        jenkins = util.jenkins_connection()
+        log.info('building %d packages, %d at a time, at %s' %
+                 (len(jobs), in_flight,
+                  posixpath.join(jenkins.url, 'job', 'build-package')))
+        scheduler = PollScheduler()
+        breaker = CircuitBreaker()
+        delay = 0
+        while True:
+            try:
+                sleep(delay)
+                self.submit(jenkins, jobs, in_flight, force)
+                self.poll(jenkins, jobs)
+                breaker.success()
+                if all(job.result is not None for job in jobs):
+                    break
+                delay = scheduler.next([job.state for job in jobs])
+            except OUTAGE_ERRORS as e:
+                delay = breaker.failure(e)
+            except KeyboardInterrupt:
+                print('')
+                running = [str(job.build_number) for job in jobs
+                           if job.build_number is not None and
+                           job.result is None]
+                if running:
+                    log.info('continue watching with `rhcephpkg '
+                             'watch-build %s`' % ' '.join(running))
+                raise SystemExit(1)
+
+        print(matrix(jobs))
+        built = [job for job in jobs if job.result != 'SKIPPED']
+        failed = [job for job in built if job.result != 'SUCCESS']
+        if len(built) < len(jobs):
+            log.info('skipped %d packages that are already built (use '
+                     '--force to build them again)' %
+                     (len(jobs) - len(built)))
+        if failed:
+            raise SystemExit('%d of %d builds did not succeed' %
+                             (len(failed), len(built)))
+        if built:
+            log.info('all %d builds succeeded' % len(built))
+
+    def submit(self, jenkins, jobs, in_flight, force=False):
+        """ Queue pending jobs until in_flight jobs are in Jenkins. """
+        running = len([job for job in jobs if job.in_flight])
+        for job in jobs:
+            if running >= in_flight:
+                break
+            if job.queue_number is not None or job.result is not None:
+                continue
+            if not force:
+                duplicate = self.find_duplicate(jenkins, job.pkg, job.branch,
+                                                job.clone, job.version)
+                if duplicate is not None:
+                    job.result = 'SKIPPED'
+                    log.info('%s %s: %s is already built, skipping' %
+                             (job.pkg, job.branch, duplicate))
+                    continue
+            job_params = {'PKG_NAME': job.pkg, 'BRANCH': job.branch}
+            job.queue_number = jenkins.build_job('build-package',
+                                                 parameters=job_params,
+                                                 token=jenkins.password)
+            log.info('%s %s: queued as #%d' %
+                     (job.pkg, job.branch, job.queue_number))
+            running += 1
+
+    def poll(self, jenkins, jobs):
+        """ Update the state of each job that is in Jenkins. """
+        for job in jobs:
+            if not job.in_flight:
+                continue
+            if job.build_number is None:
+                queue_item = jenkins.queue_status(job.queue_number)
+                if queue_item.get('cancelled'):
+                    job.result = 'CANCELLED'
+                elif queue_item.get('executable'):
+                    if queue_item.get('inQueueSince'):
+                        job.queued = queue_item['inQueueSince'] / 1000.0
+                    job.build_number = queue_item['executable']['number']
+                    log.info('%s %s: building as %s' %
+                             (job.pkg, job.branch,
+                              posixpath.join(jenkins.url, 'job',
+                                             'build-package',
+                                             str(job.build_number))))
+            if job.build_number is not None and job.result is None:
+                build_info = jenkins.build_status('build-package',
+                                                  job.build_number)
+                if not build_info['building']:
+                    job.result = build_info['result']
+                    record_build(job.build_number, build_info, job.queued)
+                    log.info('%s %s: %s' % (job.pkg, job.branch, job.result))
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+import time
+from tambo import Transport
+from rhcephpkg.history import BuildHistory, percentile
+import rhcephpkg.util as util
+
+COLUMNS = ['package', 'builds', 'passed', 'build p50', 'build p95',
+           'queue p50', 'queue p95', 'busy']
+
+
+def format_seconds(seconds):
+    """ Return a number of seconds as "mm:ss", or "-" for None. """
+    if seconds is None:
+        return '-'
+    return util.format_seconds(seconds)
+
+
+def summarize(name, builds):
+    """
+    Summarize some builds in one table row.
+
+    :param name: ``str``, the label for the row
+    :param builds: ``list`` of tuples from BuildHistory.builds()
+    :returns: ``list`` of ``str``s, one per COLUMNS
+    """
+    durations = [build[4] for build in builds]
+    waits = [build[3] for build in builds if build[3] is not None]
+    passed = len([build for build in builds if build[5] == 'SUCCESS'])
+    return [name, str(len(builds)), str(passed),
+            format_seconds(percentile(durations, 0.5)),
+            format_seconds(percentile(durations, 0.95)),
+            format_seconds(percentile(waits, 0.5)),
+            format_seconds(percentile(waits, 0.95)),
+            # Executor time, to help size the pool.
+            '%.1fh' % (sum(durations) / 3600.0)]
+
+
+def week(started):
+    """ Return the date of the Monday of the week that a build started. """
+    day = datetime.fromtimestamp(started).date()
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+class BuildStats(object):
+    help_menu = 'summarize the Jenkins builds that we have watched'
+    _help = """
+Summarize the build-package builds that "build" and "watch-build" have
+recorded in ~/.cache/rhcephpkg/history.sqlite.
+
+For each package, print how many builds we saw and how many passed, the
+median (p50) and 95th percentile (p95) build times and queue waits, and the
+total executor time that the builds used. Queue waits are only known for
+builds that "build" queued.
+
+Options:
+--days    Only include builds from the last this many days
+--trend   Print one row per package per week
+
+Positional Arguments:
+
+[package...]  Only include these packages (default: all)
+"""
+    name = 'build-stats'
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.options = ['--days']
+
+    def main(self):
+        self.parser = Transport(self.argv, options=self.options)
+        self.parser.catch_help = self.help()
+        self.parser.parse_args()
+        since = None
+        if self.parser.has('--days'):
+            try:
+                days = float(self.parser.get('--days'))
+            except (TypeError, ValueError):
+                days = 0
+            if days <= 0:
+                raise SystemExit('Specify a positive number to --days')
+            since = time.time() - days * 86400
+        packages = [arg for arg in self.parser.unknown_commands
+                    if arg != '--trend']
+        self._run(packages, since=since, trend=self.parser.has('--trend'))
+
+    def help(self):
+        return self._help
+
+    def _run(self, packages=None, since=None, trend=False):
+        history = BuildHistory()
+        try:
+            builds = history.builds(packages, since)
+        finally:
+            history.close()
+        if not builds:
+            raise SystemExit('no recorded builds')
+        groups = {}
+        for build in builds:
+            key = build[0]
+            if trend:
+                key = (build[0], week(build[2]))
+            groups.setdefault(key, []).append(build)
+        rows = [COLUMNS]
+        if trend:
+            rows = [COLUMNS[:1] + ['week'] + COLUMNS[1:]]
+        for key in sorted(groups):
+            if trend:
+                row = summarize(key[0], groups[key])
+                rows.append(row[:1] + [key[1]] + row[1:])
+            else:
+                rows.append(summarize(key, groups[key]))
+        print(util.format_table(rows))
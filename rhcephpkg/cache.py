@@ -0,0 +1,263 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from tambo import Transport
+from six.moves import configparser
+import rhcephpkg.log as log
+import rhcephpkg.util as util
+
+DEFAULT_MAX_SIZE = '10G'
+
+# From linux/fs.h. Ask the filesystem to share the source file's extents
+# with the destination file (copy-on-write), like "cp --reflink".
+FICLONE = 0x40049409
+
+# Next to each cached artifact, we record its size and mtime in a file with
+# this suffix.
+STAMP_SUFFIX = '.stamp'
+
+
+def reflink(src, dest):
+    """ Clone src to dest without copying data, if the filesystem can. """
+    with open(src, 'rb') as src_fp:
+        with open(dest, 'wb') as dest_fp:
+            fcntl.ioctl(dest_fp.fileno(), FICLONE, src_fp.fileno())
+
+
+def temporary_path(dest):
+    """ Return a unique temporary name for a file that will become dest. """
+    thread_id = threading.current_thread().ident
+    return '%s.%d.%d.tmp' % (dest, os.getpid(), thread_id)
+
+
+def materialize(src, dest):
+    """
+    Make dest a copy of src as cheaply as possible: a reflink if the
+    filesystem supports them, or else a full copy.
+
+    We never hardlink, because then changing one file in place (eg. signing
+    a .deb) would change the other too.
+
+    dest appears atomically.
+    """
+    tmp = temporary_path(dest)
+    try:
+        try:
+            reflink(src, tmp)
+        except (IOError, OSError):
+            shutil.copyfile(src, tmp)
+        os.rename(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class ArtifactCache(object):
+    """
+    A per-user cache of chacra artifacts, shared by every download directory.
+
+    Each artifact lives at <root>/<package>/<version>/<arch>/<checksum>. We
+    record an artifact's last use in its atime, and evict the least-recently
+    used artifacts when the cache grows beyond max_size bytes.
+
+    Cached artifacts are read-only, and we only trust one while its size and
+    mtime match the stamp that we recorded when we added it. We evict an
+    artifact that does not match, so that the caller downloads it again.
+    """
+
+    def __init__(self, root=None, max_size=None):
+        if root is None:
+            root = os.path.join(util.cache_dir(), 'artifacts')
+        if max_size is None:
+            configp = util.config()
+            try:
+                max_size = configp.get('rhcephpkg.cache', 'max_size')
+            except configparser.Error:
+                max_size = DEFAULT_MAX_SIZE
+            max_size = util.parse_size(max_size)
+        self.root = root
+        self.max_size = max_size
+
+    def path(self, pkg, version, arch, checksum):
+        return os.path.join(self.root, pkg, version, arch, checksum)
+
+    def get(self, pkg, version, arch, checksum, dest):
+        """
+        Materialize a cached artifact at dest.
+
+        :returns: True if the artifact was in the cache, otherwise False.
+        """
+        path = self.path(pkg, version, arch, checksum)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if self._read_stamp(path) != (st.st_size, st.st_mtime):
+            log.warning('%s changed since we cached it, evicting' % path)
+            self._evict(path)
+            return False
+        # Touch only the atime, so the artifact still matches its stamp.
+        os.utime(path, (time.time(), st.st_mtime))
+        materialize(path, dest)
+        return True
+
+    def put(self, pkg, version, arch, checksum, src):
+        """ Add the (already-verified) file src to the cache. """
+        path = self.path(pkg, version, arch, checksum)
+        if os.path.exists(path):
+            return
+        util.makedirs(os.path.dirname(path))
+        tmp = temporary_path(path)
+        try:
+            materialize(src, tmp)
+            os.chmod(tmp, 0o444)
+            st = os.stat(tmp)
+            util.write_json(path + STAMP_SUFFIX,
+                            {'size': st.st_size, 'mtime': st.st_mtime})
+            os.rename(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _read_stamp(self, path):
+        """ Return the (size, mtime) that we recorded for an artifact. """
+        try:
+            with open(path + STAMP_SUFFIX) as fp:
+                stamp = json.load(fp)
+            return (stamp['size'], stamp['mtime'])
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def _evict(self, path):
+        """ Remove an artifact and its stamp. """
+        for filename in (path, path + STAMP_SUFFIX):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        self._remove_empty_dirs(os.path.dirname(path))
+
+    def entries(self):
+        """
+        Return a list of every cached artifact, least-recently used first.
+
+        :returns: ``list`` of (path, size, atime) tuples
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(STAMP_SUFFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                st = os.stat(path)
+                entries.append((path, st.st_size, st.st_atime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        return sum(size for (_, size, _) in self.entries())
+
+    def prune(self, max_size=None):
+        """
+        Evict the least-recently used artifacts until the cache is no larger
+        than max_size bytes (by default, our configured cap).
+
+        :returns: ``list`` of the paths we removed
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        removed = []
+        for (path, size, _) in entries:
+            if total <= max_size:
+                break
+            self._evict(path)
+            total -= size
+            removed.append(path)
+        return removed
+
+    def _remove_empty_dirs(self, directory):
+        while directory != self.root and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+
+class NullCache(object):
+    """ An ArtifactCache that never holds anything. """
+
+    def get(self, pkg, version, arch, checksum, dest):
+        return False
+
+    def put(self, pkg, version, arch, checksum, src):
+        pass
+
+    def prune(self, max_size=None):
+        return []
+
+
+class Cache(object):
+    help_menu = 'inspect or prune the local artifact cache'
+    _help = """
+Inspect or prune the per-user cache of chacra artifacts that "rhcephpkg
+download" shares between download directories.
+
+The cache lives in ~/.cache/rhcephpkg/artifacts. Set "max_size" in the
+[rhcephpkg.cache] section of ~/.rhcephpkg.conf to change its size cap
+(default: %s). "download" evicts the least-recently used artifacts when the
+cache grows beyond this size.
+
+Positional Arguments:
+
+[list]   List each cached artifact, least-recently used first
+[prune]  Evict least-recently used artifacts until the cache fits its cap
+
+Options:
+--max-size  With "prune", evict down to this size instead, eg "2G" or "0"
+""" % DEFAULT_MAX_SIZE
+    name = 'cache'
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.options = ['--max-size']
+
+    def main(self):
+        self.parser = Transport(self.argv, options=self.options)
+        self.parser.catch_help = self.help()
+        self.parser.parse_args()
+        max_size = None
+        if self.parser.has('--max-size'):
+            try:
+                max_size = util.parse_size(self.parser.get('--max-size'))
+            except (TypeError, ValueError):
+                raise SystemExit('Specify a size to --max-size, eg "2G"')
+        try:
+            action = self.parser.unknown_commands[0]
+        except IndexError:
+            action = None
+        if action not in (None, 'list', 'prune'):
+            return self.parser.print_help()
+        self._run(action, max_size)
+
+    def help(self):
+        return self._help
+
+    def _run(self, action, max_size=None):
+        cache = ArtifactCache()
+        if action == 'prune':
+            removed = cache.prune(max_size)
+            log.info('evicted %d artifacts' % len(removed))
+        entries = cache.entries()
+        if action == 'list':
+            for (path, size, atime) in entries:
+                relpath = os.path.relpath(path, cache.root)
+                last_used = time.strftime('%F %T', time.localtime(atime))
+                print('%s  %10s  %s' % (last_used, util.format_bytes(size),
+                                        relpath))
+        total = sum(size for (_, size, _) in entries)
+        print('%s: %d artifacts, %s of %s' % (cache.root, len(entries),
+                                              util.format_bytes(total),
+                                              util.format_bytes(
+                                                  cache.max_size)))
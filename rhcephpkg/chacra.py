@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import posixpath
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves import configparser
+import rhcephpkg.log as log
+import rhcephpkg.util as util
+
+DEFAULT_POOL_SIZE = 10
+
+
+class ResponseCache(object):
+    """
+    An on-disk cache of chacra's JSON responses, along with the validators
+    (ETag and Last-Modified headers) that chacra sent with them.
+
+    Each entry is a small JSON file in ~/.cache/rhcephpkg/http/.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(util.cache_dir(), 'http')
+        self.directory = directory
+
+    def path(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def get(self, url):
+        """ Return the cached entry ``dict`` for this URL, or None. """
+        try:
+            with open(self.path(url)) as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """ Store a response body and its validators for this URL. """
+        entry = {'url': url, 'body': body, 'etag': etag,
+                 'last_modified': last_modified, 'fetched': time.time()}
+        util.write_json(self.path(url), entry)
+        return entry
+
+
+class ChacraClient(object):
+    """
+    A client for chacra's HTTP API.
+
+    All requests go through one requests Session, which keeps a pool of
+    keep-alive connections to chacra, so we pay for the TCP and TLS
+    handshakes once instead of once per request.
+    """
+
+    def __init__(self, base_url=None, pool_size=DEFAULT_POOL_SIZE,
+                 refresh=False, ttl=None):
+        """
+        :param base_url: ``str``, eg. "https://chacra.example.com/". If
+                         unspecified, use the "url" setting in the
+                         [rhcephpkg.chacra] section of ~/.rhcephpkg.conf.
+        :param pool_size: ``int``, the number of connections to keep open.
+                          This should be at least the number of threads
+                          that share this client.
+        :param refresh: ``bool``, ignore any cached JSON responses.
+        :param ttl: ``int``, the number of seconds that we trust a cached
+                    JSON response without asking chacra at all. If
+                    unspecified, use the "cache_ttl" setting in the
+                    [rhcephpkg.chacra] section of ~/.rhcephpkg.conf, or
+                    0 (always ask chacra if a response has changed).
+        """
+        configp = util.config()
+        if base_url is None:
+            try:
+                base_url = configp.get('rhcephpkg.chacra', 'url')
+            except configparser.Error as err:
+                raise SystemExit('Problem parsing .rhcephpkg.conf: %s',
+                                 err.message)
+        if ttl is None:
+            try:
+                ttl = configp.getint('rhcephpkg.chacra', 'cache_ttl')
+            except configparser.Error:
+                ttl = 0
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.refresh = refresh
+        self.ttl = ttl
+        self.cache = ResponseCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def url(self, *parts):
+        """
+        Return the URL for a binaries endpoint.
+
+        :param parts: eg. ('ceph', '10.2.0-2redhat1trusty', 'ubuntu', 'all')
+        """
+        return posixpath.join(self.base_url, 'binaries/', *parts)
+
+    def get_json(self, url):
+        """
+        GET a chacra API URL and return the decoded JSON response.
+
+        We ask for a gzip-compressed response, since chacra's listings for
+        large packages are big and compress well.
+
+        We cache every response on disk. Within our TTL we answer from the
+        cache without contacting chacra at all. After that, we send the
+        cached ETag and Last-Modified validators so that chacra can answer
+        "304 Not Modified" instead of sending the whole listing again.
+
+        :raises: ``requests.exceptions.RequestException`` (an ``IOError``)
+        """
+        entry = None if self.refresh else self.cache.get(url)
+        if entry and time.time() - entry['fetched'] < self.ttl:
+            return entry['body']
+        headers = {'Accept': 'application/json',
+                   'Accept-Encoding': 'gzip, deflate'}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = self.session.get(url, headers=headers)
+        except requests.exceptions.ConnectionError as e:
+            if entry is None:
+                raise
+            log.warning('%s, using cached %s' % (e, url))
+            return entry['body']
+        if response.status_code == 304 and entry:
+            entry = self.cache.put(url, entry['body'], entry['etag'],
+                                   entry['last_modified'])
+            return entry['body']
+        response.raise_for_status()
+        body = response.json()
+        self.cache.put(url, body, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+        return body
+
+    def open(self, url, offset=0):
+        """
+        Start a streaming download of a binary.
+
+        :param offset: ``int``, the number of bytes to skip with a Range
+                       request. The server may ignore this, so check the
+                       response's status_code for 206.
+        :returns: a streaming ``requests.Response``. Close it when done.
+        :raises: ``requests.exceptions.RequestException`` (an ``IOError``)
+        """
+        # Binaries are already compressed, and a Content-Encoding would
+        # change the meaning of our Range offsets.
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        response = self.session.get(url, headers=headers, stream=True)
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+        return response
+
+    def builds(self, package):
+        """
+        Return a dict of all builds of a package, keyed by version.
+
+        :param package: ``str``, eg. "ceph"
+        :returns: ``dict``, eg. {"10.2.0-2redhat1trusty": ["ubuntu"], ...}
+        """
+        return self.get_json(self.url(package))
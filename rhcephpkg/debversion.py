@@ -0,0 +1,171 @@
+"""
+Pure-Python implementation of dpkg's version comparison rules.
+
+dpkg compares versions by epoch, then upstream version, then Debian revision.
+Each of the latter two is compared with dpkg's "verrevcmp" algorithm:
+alternating runs of non-digits (compared character by character, where "~"
+sorts before everything, even the end of the string, and letters sort before
+all other characters) and runs of digits (compared numerically).
+
+Rather than comparing two versions pairwise, ``version_key()`` computes a
+sort key once per version, so that sorting a large list of versions is a
+plain ``sorted(versions, key=version_key)``, with no dpkg subprocesses.
+``version_sort_key()`` encodes the same key as a plain ASCII string, for
+storing in databases that can only sort strings.
+"""
+import heapq
+import re
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def parse_version(version):
+    """
+    Split a Debian version string into its components.
+
+    :param version: ``str``, eg. "1:10.2.0-2redhat1trusty"
+    :returns: 3-tuple of (``int`` epoch, ``str`` upstream, ``str`` revision).
+              The revision is an empty string for native versions.
+    :raises: ``ValueError`` if the epoch is not an integer.
+    """
+    epoch = 0
+    if ':' in version:
+        (epoch_str, version) = version.split(':', 1)
+        epoch = int(epoch_str)
+    revision = ''
+    if '-' in version:
+        (version, revision) = version.rsplit('-', 1)
+    return (epoch, version, revision)
+
+
+def _order(char):
+    """ dpkg's weight for a single non-digit character. """
+    if char == '~':
+        return -1
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _flatten(part):
+    """
+    Flatten an upstream version or revision into the sequence of integers
+    that dpkg's verrevcmp effectively walks: the weight of each non-digit
+    character, a 0 terminator for each non-digit run, and then the value of
+    the following digit run (0 if absent).
+
+    verrevcmp behaves as if both strings are padded with an infinite run of
+    zeros in this representation.
+    """
+    sequence = []
+    chunks = _DIGITS.split(part)
+    # _DIGITS.split() always alternates non-digits, digits, non-digits...
+    for i in range(0, len(chunks), 2):
+        nondigits = chunks[i]
+        digits = chunks[i + 1] if i + 1 < len(chunks) else ''
+        sequence.extend(_order(c) for c in nondigits)
+        sequence.append(0)
+        sequence.append(int(digits) if digits else 0)
+    return sequence
+
+
+def _part_key(part):
+    """
+    Return a tuple that sorts exactly like verrevcmp on ``part``.
+
+    Python compares tuples by treating the shorter tuple as smaller, but
+    verrevcmp pads with zeros, so "1.0~rc1" must sort before "1.0". To get
+    the zero-padded ordering from plain tuple comparison, we group the
+    flattened sequence into tokens of (number of zeros skipped, next
+    non-zero value), and we map each token onto one of three tiers:
+
+      (0, zeros, value) - a negative value (a "~"), which sorts below the end
+      (1,)              - the end of the string (the infinite zero padding)
+      (2, -zeros, value) - a positive value, which sorts above the end
+    """
+    key = []
+    zeros = 0
+    for value in _flatten(part):
+        if value == 0:
+            zeros += 1
+        elif value < 0:
+            key.append((0, zeros, value))
+            zeros = 0
+        else:
+            key.append((2, -zeros, value))
+            zeros = 0
+    key.append((1,))
+    return tuple(key)
+
+
+def version_key(version):
+    """
+    Return a sort key for a Debian version string.
+
+    Keys compare in the same order as "dpkg --compare-versions", so
+    ``sorted(versions, key=version_key)`` sorts like dpkg does.
+
+    :param version: ``str``, eg. "10.2.0-2redhat1trusty"
+    :returns: ``tuple``
+    """
+    (epoch, upstream, revision) = parse_version(version)
+    return (epoch, _part_key(upstream), _part_key(revision))
+
+
+def compare_versions(a, b):
+    """
+    Compare two Debian version strings.
+
+    :returns: ``int``, negative if a < b, zero if a == b, positive if a > b.
+    """
+    key_a = version_key(a)
+    key_b = version_key(b)
+    return (key_a > key_b) - (key_a < key_b)
+
+
+def newest(versions, count=1):
+    """
+    Return the newest versions from an iterable of Debian version strings.
+
+    This selects the top versions with a heap, which is O(n log count)
+    rather than the O(n log n) of sorting every version.
+
+    :param count: ``int``, the number of versions to return.
+    :returns: ``list`` of up to ``count`` versions, oldest first.
+    """
+    return list(reversed(heapq.nlargest(count, versions, key=version_key)))
+
+
+def _encode_int(number):
+    """
+    Encode a non-negative integer as a string that sorts in numeric order:
+    two hex digits for the length, and then the number in hex.
+    """
+    digits = '%x' % number
+    return '%02x%s' % (len(digits), digits)
+
+
+def version_sort_key(version):
+    """
+    Return a sort key for a Debian version string as an ASCII ``str``.
+
+    These strings compare (character by character, like SQLite's default
+    BINARY collation) in the same order as ``version_key()``, so we can
+    store them and let a database ORDER BY them.
+    """
+    (epoch, upstream, revision) = parse_version(version)
+    encoded = [_encode_int(epoch)]
+    for part in (upstream, revision):
+        for token in _part_key(part):
+            if token[0] == 0:
+                # "~" is the only negative weight, so we only need the
+                # number of zeros before it.
+                encoded.append('0' + _encode_int(token[1]))
+            elif token[0] == 1:
+                encoded.append('1')
+            else:
+                # Fewer zeros before a positive value sorts higher.
+                zeros = -token[1]
+                encoded.append('2' + _encode_int(0xffff - zeros) +
+                               _encode_int(token[2]))
+    return ''.join(encoded)
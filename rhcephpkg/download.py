@@ -1,76 +1,523 @@
+from collections import namedtuple
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+import hashlib
 import json
 import os
 import posixpath
-import shutil
+import threading
+import time
 import six
-from six.moves import configparser
-from six.moves.urllib.request import Request, urlopen
+from requests.exceptions import HTTPError
 from tambo import Transport
+from rhcephpkg.cache import ArtifactCache
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.debversion import newest
+from rhcephpkg import transfer
 import rhcephpkg.util as util
 import rhcephpkg.log as log
 
+DEFAULT_JOBS = 4
+
+# chacra publishes a checksum of each binary with this algorithm.
+CHECKSUM_ALGORITHM = 'sha512'
+
+# What happened to each artifact.
+DOWNLOADED = 'downloaded'
+CACHED = 'cached'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+# One binary file in a chacra build.
+Artifact = namedtuple('Artifact', ['pkg', 'version', 'arch', 'name', 'url',
+                                   'checksum', 'size'])
+
+
+def select(artifacts, include=None, exclude=None):
+    """
+    Filter artifacts by their binary names.
+
+    :param include: ``list`` of glob patterns. If set, keep only artifacts
+                    that match at least one of these.
+    :param exclude: ``list`` of glob patterns. Drop artifacts that match any
+                    of these.
+    :returns: ``list`` of ``Artifact``s
+    """
+    selected = []
+    for artifact in artifacts:
+        name = artifact.name
+        if include and not any(fnmatch(name, pat) for pat in include):
+            continue
+        if exclude and any(fnmatch(name, pat) for pat in exclude):
+            continue
+        selected.append(artifact)
+    return selected
+
+
+def file_digest(path):
+    """ Return the hex digest of a file on disk. """
+    hasher = hashlib.new(CHECKSUM_ALGORITHM)
+    with open(path, 'rb') as fp:
+        transfer.copy(fp, hasher=hasher)
+    return hasher.hexdigest()
+
+
+def read_manifest(path):
+    """
+    Read a list of builds from a manifest file, one build per line.
+
+    Blank lines and lines that start with "#" are ignored.
+    """
+    builds = []
+    with open(path) as fp:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                builds.append(line)
+    return builds
+
+
+def report(results, builds):
+    """
+    Summarize what happened to each build's artifacts.
+
+    :param results: ``list`` of (``Artifact``, status, bytes) tuples from
+                    Download.fetch_all()
+    :param builds: ``list`` of build names, in the order to report them
+    :returns: ``str``, a table with one row per build
+    """
+    statuses = (DOWNLOADED, CACHED, SKIPPED, FAILED)
+    counts = dict((build, dict.fromkeys(statuses, 0)) for build in builds)
+    for (artifact, status, _) in results:
+        build = '%s_%s' % (artifact.pkg, artifact.version)
+        counts[build][status] += 1
+    width = max(len(build) for build in builds + ['build'])
+    lines = ['%-*s  %s' % (width, 'build',
+                           '  '.join('%10s' % s for s in statuses))]
+    for build in builds:
+        row = '  '.join('%10d' % counts[build][s] for s in statuses)
+        lines.append('%-*s  %s' % (width, build, row))
+    return '\n'.join(lines)
+
+
+class DigestCache(object):
+    """
+    Remember the digests of files that we have already downloaded or
+    verified, so that we do not need to re-read large unchanged files on
+    every run.
+
+    Entries are keyed by absolute path and are only valid while the file's
+    size and mtime are unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, filename):
+        """ Return the cached digest for this file, or None. """
+        st = os.stat(filename)
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(filename))
+        if entry is None:
+            return None
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            return None
+        return entry['digest']
+
+    def set(self, filename, digest):
+        st = os.stat(filename)
+        entry = {'size': st.st_size, 'mtime': st.st_mtime, 'digest': digest}
+        with self.lock:
+            self.entries[os.path.abspath(filename)] = entry
+
+    def save(self):
+        """ Write the cache to disk atomically. """
+        with self.lock:
+            util.write_json(self.path, self.entries)
+
 
 class Download(object):
     help_menu = 'download a build from chacra'
     _help = """
 Download a build's entire artifacts from chacra.
 
+Each artifact is verified against the checksum that chacra publishes for it.
+Artifacts that are already present are only downloaded again if they do not
+match their checksum.
+
+Options:
+--jobs      Number of artifacts to download at once (default: %d)
+--refresh   Ignore any cached chacra listings
+--arch      Only download these arches, eg. "amd64,noarch"
+--include   Only download binaries matching these globs, eg. "ceph*,rados*"
+--exclude   Skip binaries matching these globs, eg. "*-dbg_*,*.orig.tar.gz"
+--dry-run   List the binaries we would download and their sizes, and exit
+--manifest  Also download each build listed in this file, one per line
+--latest    Download the newest build of each package, eg. "ceph --latest"
+--prefix    With --latest, only consider versions that start with this,
+            eg. "3.0."
+
 Positional Arguments:
 
-[build]  The name of the build to download, eg. "ceph_10.2.0-2redhat1trusty"
-"""
+[build...]  The names of the builds to download,
+            eg. "ceph_10.2.0-2redhat1trusty ceph-ansible_3.0.16-2redhat1",
+            or with --latest, the names of packages, eg. "ceph"
+
+All the artifacts of all the builds share one pool of --jobs downloads.
+""" % DEFAULT_JOBS
     name = 'download'
 
     def __init__(self, argv):
         self.argv = argv
-        self.options = []
+        self.options = ['--jobs', '--arch', '--include', '--exclude',
+                        '--manifest', '--prefix']
 
     def main(self):
         self.parser = Transport(self.argv, options=self.options)
         self.parser.catch_help = self.help()
         self.parser.parse_args()
-        try:
-            build = self.parser.unknown_commands[0]
-        except IndexError:
+        jobs = self._jobs()
+        filters = {}
+        for option in ('--arch', '--include', '--exclude'):
+            if self.parser.has(option):
+                filters[option[2:]] = self._list_option(option)
+        refresh = self.parser.has('--refresh')
+        dry_run = self.parser.has('--dry-run')
+        latest = self.parser.has('--latest')
+        prefix = self.parser.get('--prefix')
+        if prefix is not None and not latest:
+            raise SystemExit('--prefix only makes sense with --latest')
+        builds = [arg for arg in self.parser.unknown_commands
+                  if arg not in ('--refresh', '--dry-run', '--latest')]
+        if self.parser.has('--manifest'):
+            if self.parser.get('--manifest') is None:
+                raise SystemExit('Specify a file to --manifest')
+            builds += read_manifest(self.parser.get('--manifest'))
+        if not builds:
             return self.parser.print_help()
-        self._run(build)
+        self._run(builds, jobs, refresh, dry_run=dry_run, latest=latest,
+                  prefix=prefix, **filters)
 
     def help(self):
         return self._help
 
-    def _run(self, build):
-        configp = util.config()
-        try:
-            base_url = configp.get('rhcephpkg.chacra', 'url')
-        except configparser.Error as err:
-            raise SystemExit('Problem parsing .rhcephpkg.conf: %s',
-                             err.message)
+    def _jobs(self):
+        """ Return the --jobs setting. """
+        if not self.parser.has('--jobs'):
+            return DEFAULT_JOBS
+        return util.positive_int(self.parser, '--jobs')
+
+    def _list_option(self, option):
+        """ Return the comma-separated values of this option as a list. """
+        if self.parser.get(option) is None:
+            raise SystemExit('Specify a comma-separated list to %s' % option)
+        return self.parser.get(option).split(',')
+
+    def _run(self, builds, jobs=DEFAULT_JOBS, refresh=False, arch=None,
+             include=None, exclude=None, dry_run=False, latest=False,
+             prefix=None):
+        self.client = ChacraClient(pool_size=jobs, refresh=refresh)
+        if latest:
+            builds = [self.latest_build(pkg, prefix) for pkg in builds]
+        # eg. a manifest that lists a build twice
+        unique_builds = []
+        for build in builds:
+            if build not in unique_builds:
+                unique_builds.append(build)
+        builds = unique_builds
+        nvrs = []
+        for build in builds:
+            try:
+                (pkg, version) = build.split('_')
+            except ValueError:
+                log.error('%s is not a valid package build N-V-R' % build)
+                return self.parser.print_help()
+            nvrs.append((pkg, version))
+        artifacts = []
+        missing = []
+        for (pkg, version) in nvrs:
+            try:
+                artifacts += self.plan(pkg, version, arch)
+            except HTTPError as e:
+                log.error('could not find %s_%s: %s' % (pkg, version, e))
+                missing.append('%s_%s' % (pkg, version))
+        artifacts = self.unique(select(artifacts, include, exclude))
+        if dry_run:
+            for artifact in artifacts:
+                size = util.format_bytes(artifact.size or 0)
+                print('%10s  %s/%s' % (size, artifact.arch, artifact.name))
+            total = sum(artifact.size or 0 for artifact in artifacts)
+            print('%d artifacts, %s' % (len(artifacts),
+                                        util.format_bytes(total)))
+            return
+        results = self.fetch_all(artifacts, jobs)
+        if len(nvrs) > 1:
+            print(report(results, builds))
+        failed = [artifact.name for (artifact, status, _) in results
+                  if status == FAILED]
+        if missing:
+            raise SystemExit('could not find %s in chacra' %
+                             ', '.join(missing))
+        if failed:
+            raise SystemExit('%d of %d artifacts failed to download' %
+                             (len(failed), len(artifacts)))
+
+    def unique(self, artifacts):
+        """
+        Drop artifacts that would download to the same path() as an earlier
+        one, eg. the "orig" tarball that the trusty and xenial builds of a
+        version share. Two workers must never write the same file.
+
+        :returns: ``list`` of ``Artifact``s
+        """
+        seen = {}
+        kept = []
+        for artifact in artifacts:
+            path = self.path(artifact)
+            if path not in seen:
+                seen[path] = artifact
+                kept.append(artifact)
+                continue
+            first = seen[path]
+            if artifact.checksum != first.checksum:
+                log.warning('%s_%s and %s_%s have different files named %s, '
+                            'downloading the first' %
+                            (first.pkg, first.version, artifact.pkg,
+                             artifact.version, path))
+        return kept
+
+    def latest_build(self, pkg, prefix=None):
+        """
+        Find the newest build of a package in chacra.
+
+        :param prefix: ``str``, only consider versions that start with this
+        :returns: ``str``, the build's N-V-R, eg. "ceph_10.2.0-2redhat1"
+        """
         try:
-            (pkg, version) = build.split('_')
-        except ValueError:
-            log.error('%s is not a valid package build N-V-R' % build)
-            return self.parser.print_help()
-        build_url = posixpath.join(base_url, 'binaries/', pkg, version,
-                                   'ubuntu', 'all')
+            versions = self.client.builds(pkg)
+        except HTTPError as e:
+            raise SystemExit('could not find %s in chacra: %s' % (pkg, e))
+        if prefix is not None:
+            versions = [v for v in versions if v.startswith(prefix)]
+        found = newest(versions)
+        if not found and prefix is None:
+            raise SystemExit('%s has no builds in chacra' % pkg)
+        if not found:
+            raise SystemExit('no builds of %s match "%s"' % (pkg, prefix))
+        return '%s_%s' % (pkg, found[0])
+
+    def plan(self, pkg, version, archs=None):
+        """
+        Find all the artifacts for a build in chacra.
+
+        :param archs: ``list`` of arches to consider, eg. ["amd64"], or None
+                      to consider every arch in the build.
+        :returns: ``list`` of ``Artifact``s
+        """
+        build_url = self.client.url(pkg, version, 'ubuntu', 'all')
         log.info('searching %s for builds' % build_url)
-        build_response = urlopen(Request(build_url))
-        headers = build_response.headers
-        if six.PY2:
-            encoding = headers.getparam('charset') or 'utf-8'
-            # if encoding is None:
-            #    encoding = 'utf-8'
-        else:
-            encoding = headers.get_content_charset(failobj='utf-8')
-        payload = json.loads(build_response.read().decode(encoding))
-        for arch, binaries in six.iteritems(payload):
+        payload = self.client.get_json(build_url)
+        artifacts = []
+        for arch, binaries in sorted(six.iteritems(payload)):
+            if archs is not None and arch not in archs:
+                continue
+            # chacra's per-arch listing has each binary's metadata.
+            arch_url = posixpath.join(build_url, arch) + '/'
+            metadata = self.client.get_json(arch_url)
             for binary in binaries:
-                if os.path.isfile(binary):
-                    # TODO: check the sha256sum of the already-downloaded file
-                    # here?
-                    log.info('skipping %s' % binary)
-                    continue
-                log.info('downloading %s' % binary)
-                binary_url = posixpath.join(build_url, arch, binary) + '/'
-                response = urlopen(Request(binary_url))
-                with open(binary, 'wb') as fp:
-                    shutil.copyfileobj(response, fp)
+                url = posixpath.join(arch_url, binary) + '/'
+                info = metadata.get(binary, {})
+                artifacts.append(Artifact(pkg, version, arch, binary, url,
+                                          info.get('checksum'),
+                                          info.get('size')))
+        return artifacts
+
+    def fetch_all(self, artifacts, jobs=DEFAULT_JOBS):
+        """
+        Download these artifacts to their local path()s, jobs at a time.
+
+        :returns: ``list`` of (``Artifact``, status, bytes downloaded)
+                  tuples, where status is one of DOWNLOADED, CACHED, SKIPPED
+                  or FAILED.
+        """
+        self.digests = DigestCache(os.path.join(util.cache_dir(),
+                                                'digests.json'))
+        self.cache = self.artifact_cache()
+        # Set on Ctrl-C, so each worker stops after its current chunk.
+        self.stopping = threading.Event()
+        start = time.time()
+        pool = ThreadPool(min(jobs, len(artifacts)) or 1)
+        try:
+            results = list(pool.imap_unordered(self._fetch, artifacts))
+        except BaseException:
+            # Do not start the transfers that are still queued.
+            self.stopping.set()
+            pool.terminate()
+            pool.join()
+            raise
+        else:
+            pool.close()
+            pool.join()
+        finally:
+            self.digests.save()
+        transfer.fsync_all([self.path(artifact) for (artifact, status, _)
+                            in results if status == DOWNLOADED])
+        elapsed = time.time() - start
+        self.cache.prune()
+
+        total = sum(nbytes for (_, _, nbytes) in results)
+        rate = total / elapsed if elapsed > 0 else 0
+        log.info('downloaded %s in %.1f seconds (%s/s)',
+                 util.format_bytes(total), elapsed, util.format_bytes(rate))
+        for (artifact, status, _) in sorted(results):
+            if status == FAILED:
+                log.error('failed to download %s' % artifact.name)
+        return results
+
+    def artifact_cache(self):
+        """ Return the cache that we share artifacts through. """
+        return ArtifactCache()
+
+    def _fetch(self, artifact):
+        """
+        Download one artifact, logging (rather than raising) any error so
+        that the other transfers in the pool can carry on.
+
+        :param artifact: ``Artifact``
+        :returns: 3-tuple of (``Artifact``, status, bytes downloaded)
+        """
+        try:
+            (status, nbytes) = self._download_binary(artifact)
+        except (IOError, OSError) as e:
+            # (This includes all of requests' exceptions.)
+            log.error('%s: %s' % (artifact.name, e))
+            (status, nbytes) = (FAILED, 0)
+        return (artifact, status, nbytes)
+
+    def path(self, artifact):
+        """ Return the local path for this artifact (in the cwd). """
+        return artifact.name
+
+    def _verify_existing(self, binary, checksum):
+        """ Return True if this already-present file matches checksum. """
+        digest = self.digests.get(binary)
+        if digest is None:
+            digest = file_digest(binary)
+            self.digests.set(binary, digest)
+        return digest == checksum
+
+    def _download_binary(self, artifact):
+        """
+        Download a binary to its local path().
+
+        Verified artifacts are shared between download directories through
+        our per-user ArtifactCache, so we only go to chacra on a cache miss.
+
+        We write to a "<binary>.part" file and rename it into place only once
+        it is complete, so a file named "<binary>" is always a finished
+        download. If a previous attempt left a .part file behind, we resume
+        from its end with an HTTP Range request.
+
+        We hash the bytes as we write them, so we never read a new download
+        back from disk to verify it. When we know the artifact's size, we
+        preallocate it on disk first. We do not fsync here; fetch_all()
+        syncs every new file at once when the whole batch is done.
+
+        :returns: 2-tuple of (status, number of bytes transferred)
+        """
+        binary = self.path(artifact)
+        checksum = artifact.checksum
+        if os.path.isfile(binary):
+            if checksum is None or self._verify_existing(binary, checksum):
+                log.info('skipping %s' % binary)
+                return (SKIPPED, 0)
+            log.warning('%s does not match its checksum, downloading again'
+                        % binary)
+            os.remove(binary)
+        cache_key = (artifact.pkg, artifact.version, artifact.arch, checksum)
+        if checksum is not None and self.cache.get(*cache_key, dest=binary):
+            log.info('using cached %s' % binary)
+            # binary is our own copy of a cached artifact that still matches
+            # the stamp from when we verified and cached it.
+            self.digests.set(binary, checksum)
+            return (CACHED, 0)
+        partial = binary + '.part'
+        offset = 0
+        if os.path.isfile(partial):
+            offset = os.path.getsize(partial)
+        if offset:
+            log.info('resuming %s at byte %d' % (binary, offset))
+        else:
+            log.info('downloading %s' % binary)
+        try:
+            response = self.client.open(artifact.url, offset)
+        except HTTPError as e:
+            if e.response.status_code != 416 or not offset:
+                raise
+            # Our .part file is at least as large as the whole artifact, so
+            # we cannot trust it. Start over.
+            log.warning('discarding %s' % partial)
+            os.remove(partial)
+            return self._download_binary(artifact)
+        if offset and response.status_code != 206:
+            # The server ignored our Range header and sent the whole file.
+            log.info('server cannot resume %s, restarting' % binary)
+            offset = 0
+        expected = self._expected_size(response, offset)
+        hasher = hashlib.new(CHECKSUM_ALGORITHM)
+        if offset:
+            # The bytes from the earlier attempt are the only ones we read.
+            with open(partial, 'rb') as fp:
+                transfer.copy(fp, hasher=hasher)
+        try:
+            with open(partial, 'r+b' if offset else 'wb') as fp:
+                fp.seek(offset)
+                if expected is not None:
+                    transfer.preallocate(fp, offset, expected - offset)
+                try:
+                    transfer.copy(response.raw, fp, hasher, self.stopping)
+                finally:
+                    # Give back any space we reserved but did not fill.
+                    size = fp.tell()
+                    fp.truncate(size)
+        finally:
+            response.close()
+        if expected is not None and size != expected:
+            # Leave the .part file in place so that we can resume it later.
+            raise IOError('%s is incomplete: received %d of %d bytes' %
+                          (binary, size, expected))
+        digest = hasher.hexdigest()
+        if checksum is not None and digest != checksum:
+            os.remove(partial)
+            if offset:
+                log.warning('resumed %s does not match its checksum, '
+                            'restarting' % binary)
+                return self._download_binary(artifact)
+            raise IOError('%s does not match its checksum' % binary)
+        os.rename(partial, binary)
+        self.digests.set(binary, digest)
+        if checksum is not None:
+            self.cache.put(*cache_key, src=binary)
+        return (DOWNLOADED, size - offset)
+
+    def _expected_size(self, response, offset):
+        """
+        Return the full size of the artifact according to this response's
+        headers, or None if the server did not tell us.
+        """
+        content_range = response.headers.get('Content-Range')
+        if content_range:
+            # eg. "bytes 100-999/1000"
+            total = content_range.rsplit('/', 1)[-1]
+            if total != '*':
+                return int(total)
+        content_length = response.headers.get('Content-Length')
+        if content_length:
+            return offset + int(content_length)
+        return None
@@ -0,0 +1,82 @@
+"""
+Recognize fatal errors in a build's console output.
+
+A ceph build runs many steps in parallel, so after one step hits a fatal
+compiler or dpkg error, the others can keep running for a long time before
+Jenkins marks the job FAILURE. The FailureScanner lets "watch-build" spot
+those errors as the console output arrives.
+"""
+import re
+from six.moves import configparser
+import rhcephpkg.util as util
+
+# Our default failure patterns, by name. The [rhcephpkg.failures] section
+# of ~/.rhcephpkg.conf can override these, disable them with an empty
+# value, or add more.
+DEFAULT_PATTERNS = {
+    'compiler': r':\d+(:\d+)?: (fatal )?error: ',
+    'make': r'^make(\[\d+\])?: \*\*\* .*Error \d+',
+    'dpkg': r'^dpkg-[a-z]+: error: ',
+    'linker': r'collect2: error: ld returned',
+}
+
+
+def failure_patterns():
+    """
+    Return our failure patterns from DEFAULT_PATTERNS and the
+    [rhcephpkg.failures] section of ~/.rhcephpkg.conf.
+
+    :returns: ``dict`` of names to compiled regexes
+    """
+    patterns = dict(DEFAULT_PATTERNS)
+    configp = util.config()
+    try:
+        patterns.update(configp.items('rhcephpkg.failures'))
+    except configparser.Error:
+        pass
+    compiled = {}
+    for (name, pattern) in patterns.items():
+        if not pattern:
+            continue
+        try:
+            compiled[name] = re.compile(pattern)
+        except re.error as e:
+            raise SystemExit('Problem parsing .rhcephpkg.conf: '
+                             '[rhcephpkg.failures] %s: %s' % (name, e))
+    return compiled
+
+
+class FailureScanner(object):
+    """
+    Match console output against failure patterns, one line at a time.
+
+    feed() takes the output in whatever pieces it arrives, and holds on to
+    a partial last line until the rest of it arrives.
+    """
+
+    def __init__(self, patterns=None):
+        if patterns is None:
+            patterns = failure_patterns()
+        self.patterns = patterns
+        self.partial = ''
+        self.matched = set()
+
+    def feed(self, text):
+        """
+        Scan the next piece of console output.
+
+        :param text: ``str``
+        :returns: ``list`` of (name, line) tuples, for the first line that
+                  matches each pattern
+        """
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        failures = []
+        for line in lines:
+            for name in sorted(self.patterns):
+                if name in self.matched:
+                    continue
+                if self.patterns[name].search(line):
+                    self.matched.add(name)
+                    failures.append((name, line.rstrip('\r')))
+        return failures
@@ -0,0 +1,236 @@
+"""
+A local SQLite history of the Jenkins builds that we have watched.
+
+"build" and "watch-build" already poll each build until it finishes, so
+they know when it started, how long it took and how it ended. When "build"
+queued the job itself, it also knows how long the job waited in Jenkins'
+queue for an executor. We record all of that in
+~/.cache/rhcephpkg/history.sqlite, and "build-stats" summarizes it.
+
+To predict how long a build will take, we also keep the durations of
+build-package's recent successful builds, which we fetch from Jenkins in
+one trimmed query at most once every DURATIONS_TTL seconds.
+"""
+import math
+import os
+import sqlite3
+import time
+from jenkins import JenkinsException
+import requests.exceptions
+import rhcephpkg.util as util
+import rhcephpkg.log as log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    number INTEGER PRIMARY KEY,
+    package TEXT NOT NULL,
+    branch TEXT,
+    started REAL NOT NULL,
+    queue_wait REAL,
+    duration REAL NOT NULL,
+    result TEXT,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_package ON builds (package, started);
+CREATE TABLE IF NOT EXISTS jenkins_builds (
+    number INTEGER PRIMARY KEY,
+    package TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fetched (
+    name TEXT PRIMARY KEY,
+    time REAL NOT NULL
+);
+"""
+
+# How many of the job's most recent builds we fetch from Jenkins.
+RECENT_BUILDS = 100
+
+# How often to fetch them, in seconds.
+DURATIONS_TTL = 3600
+
+# How many of a package's successful builds we base predictions on.
+RECENT_DURATIONS = 10
+
+
+def percentile(values, fraction):
+    """
+    Return a percentile of some values, with the nearest-rank method.
+
+    :param values: ``list`` of numbers
+    :param fraction: ``float``, eg. 0.95 for the 95th percentile
+    :returns: one of the values, or None if there are none
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(fraction * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def build_parameters(build_info):
+    """
+    Return the parameters of a build.
+
+    :param build_info: ``dict`` from JenkinsSession.build_status()
+    :returns: ``dict``, eg. {"PKG_NAME": "ceph", "BRANCH": "ceph-2-xenial"}
+    """
+    parameters = {}
+    for action in build_info.get('actions', []):
+        for parameter in action.get('parameters', []):
+            parameters[parameter['name']] = parameter.get('value')
+    return parameters
+
+
+class BuildHistory(object):
+    """
+    Our history of build-package builds, stored in
+    ~/.cache/rhcephpkg/history.sqlite.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(util.cache_dir(), 'history.sqlite')
+        util.makedirs(os.path.dirname(path))
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, number, build_info, queued=None):
+        """
+        Record one finished build.
+
+        :param number: ``int``, the build number
+        :param build_info: ``dict`` from JenkinsSession.build_status()
+        :param queued: ``float``, when the job entered Jenkins' queue
+                       (seconds since the epoch), if we know
+        """
+        parameters = build_parameters(build_info)
+        started = build_info['timestamp'] / 1000.0
+        queue_wait = None
+        if queued is not None:
+            queue_wait = max(started - queued, 0)
+        with self.conn:
+            # Keep the queue wait from an earlier record of this build, eg.
+            # when "watch-build" looks at a build that "build" queued.
+            self.conn.execute(
+                'INSERT OR REPLACE INTO builds (number, package, branch, '
+                'started, queue_wait, duration, result, recorded) VALUES '
+                '(?, ?, ?, ?, COALESCE(?, (SELECT queue_wait FROM builds '
+                'WHERE number = ?)), ?, ?, ?)',
+                (number, parameters.get('PKG_NAME'),
+                 parameters.get('BRANCH'), started, queue_wait, number,
+                 build_info['duration'] / 1000.0, build_info['result'],
+                 time.time()))
+
+    def builds(self, packages=None, since=None):
+        """
+        Query our recorded builds.
+
+        :param packages: ``list`` of package names, or None for all
+        :param since: ``float``, only return builds that started at or
+                      after this time (seconds since the epoch)
+        :returns: ``list`` of (package, branch, started, queue_wait,
+                  duration, result) tuples, oldest first
+        """
+        query = ('SELECT package, branch, started, queue_wait, duration, '
+                 'result FROM builds WHERE 1')
+        params = []
+        if packages:
+            query += ' AND package IN (%s)' % ', '.join('?' * len(packages))
+            params.extend(packages)
+        if since is not None:
+            query += ' AND started >= ?'
+            params.append(since)
+        query += ' ORDER BY started'
+        return self.conn.execute(query, params).fetchall()
+
+    def refresh_durations(self, jenkins, ttl=DURATIONS_TTL):
+        """
+        Fetch the durations of build-package's recent successful builds,
+        unless we already did in the last ttl seconds.
+
+        :param jenkins: ``JenkinsSession``
+        """
+        row = self.conn.execute(
+            "SELECT time FROM fetched WHERE name = 'jenkins_builds'"
+        ).fetchone()
+        if row is not None and time.time() - row[0] < ttl:
+            return
+        builds = jenkins.recent_builds('build-package', RECENT_BUILDS)
+        rows = []
+        for build in builds:
+            package = build_parameters(build).get('PKG_NAME')
+            if build.get('result') == 'SUCCESS' and package is not None:
+                rows.append((build['number'], package,
+                             build['duration'] / 1000.0))
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO jenkins_builds '
+                '(number, package, duration) VALUES (?, ?, ?)', rows)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO fetched (name, time) '
+                "VALUES ('jenkins_builds', ?)", (time.time(),))
+
+    def durations(self, package, count=RECENT_DURATIONS):
+        """
+        Return the durations of a package's most recent successful builds,
+        from both Jenkins' list and our own records.
+
+        :returns: ``list`` of seconds, newest build first
+        """
+        cursor = self.conn.execute(
+            'SELECT duration FROM ('
+            'SELECT number, duration FROM jenkins_builds WHERE package = ? '
+            'UNION SELECT number, duration FROM builds '
+            "WHERE package = ? AND result = 'SUCCESS') "
+            'ORDER BY number DESC LIMIT ?', (package, package, count))
+        return [row[0] for row in cursor]
+
+
+def record_build(number, build_info, queued=None):
+    """
+    Record a finished build in our history, if we can.
+
+    The history is only a convenience, so problems writing it are not
+    fatal.
+    """
+    if build_info.get('building') or build_info.get('result') is None:
+        return
+    try:
+        history = BuildHistory()
+        try:
+            history.record(number, build_info, queued)
+        finally:
+            history.close()
+    except (sqlite3.Error, KeyError, OSError) as e:
+        log.warning('could not record build #%d in our history: %s' %
+                    (number, e))
+
+
+def expected_duration(jenkins, package):
+    """
+    Predict how long a build of this package will take, from the median
+    of its recent successful builds.
+
+    :param jenkins: ``JenkinsSession``
+    :returns: ``float``, seconds, or None if we have no successful builds
+    """
+    try:
+        history = BuildHistory()
+        try:
+            try:
+                history.refresh_durations(jenkins)
+            except (requests.exceptions.RequestException,
+                    JenkinsException) as e:
+                # We can still predict from what we fetched before.
+                log.debug('could not list recent builds: %s' % e)
+            return percentile(history.durations(package), 0.5)
+        finally:
+            history.close()
+    except (sqlite3.Error, OSError) as e:
+        log.warning('could not read our build history: %s' % e)
+        return None
@@ -0,0 +1,227 @@
+"""
+A local SQLite index of the builds in chacra.
+
+chacra's listing of a package's builds is a flat JSON object that we would
+otherwise fetch and sort in full every time. The index stores each build's
+version along with its precomputed ``version_sort_key()``, its distro, and
+its arches and binaries, so queries are answered by SQLite with an ORDER BY
+on an indexed column.
+
+Refreshing a package's builds costs one request: we ask chacra for the
+package's list of versions (a cheap conditional request, see ChacraClient)
+and add or remove the versions that changed. Each build's binaries take one
+more request, so we only fetch those when something asks for them, and
+only once per build.
+"""
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import sqlite3
+import time
+from requests.exceptions import HTTPError
+from rhcephpkg.debversion import version_sort_key
+import rhcephpkg.util as util
+import rhcephpkg.log as log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    name TEXT PRIMARY KEY,
+    refreshed REAL
+);
+CREATE TABLE IF NOT EXISTS builds (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    sort_key TEXT NOT NULL,
+    distro TEXT,
+    indexed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (package, version)
+);
+CREATE INDEX IF NOT EXISTS builds_sort_key ON builds (package, sort_key);
+CREATE TABLE IF NOT EXISTS binaries (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (package, version, arch, name)
+);
+"""
+
+# eg. "10.2.0-2redhat1trusty" is a build for trusty.
+DISTRO_RE = re.compile(r'redhat\d+([a-z]+)$')
+
+
+def version_distro(version):
+    """
+    Return the distro codename at the end of a build's version, eg. "xenial"
+    for "12.2.4-10redhat1xenial", or None if the version does not have one.
+    """
+    match = DISTRO_RE.search(version)
+    if match:
+        return match.group(1)
+    return None
+
+
+class BuildIndex(object):
+    """
+    Our index of chacra builds, stored in ~/.cache/rhcephpkg/index.sqlite.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(util.cache_dir(), 'index.sqlite')
+        util.makedirs(os.path.dirname(path))
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def refresh(self, package, client):
+        """
+        Bring our list of this package's builds up to date with chacra.
+
+        :param client: ``ChacraClient``
+        :returns: ``list`` of the versions that we newly indexed
+        """
+        remote = client.builds(package)
+        cursor = self.conn.execute(
+            'SELECT version FROM builds WHERE package = ?', (package,))
+        known = set(row[0] for row in cursor)
+        removed = [version for version in known if version not in remote]
+        added = [version for version in remote if version not in known]
+        # Another process (or another thread, with its own connection) may
+        # be refreshing this package at the same time, so we tolerate rows
+        # that have appeared or gone since we read "known".
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM builds WHERE package = ? AND version = ?',
+                [(package, version) for version in removed])
+            self.conn.executemany(
+                'DELETE FROM binaries WHERE package = ? AND version = ?',
+                [(package, version) for version in removed])
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO builds '
+                '(package, version, sort_key, distro) '
+                'VALUES (?, ?, ?, ?)',
+                [(package, version, version_sort_key(version),
+                  version_distro(version)) for version in added])
+            self.conn.execute(
+                'INSERT OR REPLACE INTO packages (name, refreshed) '
+                'VALUES (?, ?)', (package, time.time()))
+        return added
+
+    def index_binaries(self, package, client, versions=None, jobs=None):
+        """
+        Fetch and store the binaries of builds that we have not indexed yet.
+
+        :param client: ``ChacraClient``
+        :param versions: ``list`` of versions to index, or None for all of
+                         this package's builds
+        :param jobs: ``int``, how many build listings to fetch at once. By
+                     default, the size of the client's connection pool.
+        :returns: ``list`` of the versions that we newly indexed
+        """
+        cursor = self.conn.execute(
+            'SELECT version FROM builds WHERE package = ? AND indexed = 0',
+            (package,))
+        missing = [row[0] for row in cursor
+                   if versions is None or row[0] in versions]
+        if not missing:
+            return []
+        remote = client.builds(package)
+
+        def fetch(version):
+            binaries = {}
+            for distro_name in remote.get(version, []):
+                url = client.url(package, version, distro_name, 'all')
+                try:
+                    binaries.update(client.get_json(url))
+                except HTTPError as e:
+                    # eg. a build that is still in progress. We will try
+                    # again next time.
+                    log.debug('could not index %s_%s: %s' %
+                              (package, version, e))
+                    return (version, None)
+            return (version, binaries)
+
+        if jobs is None:
+            jobs = client.pool_size
+        pool = ThreadPool(min(jobs, len(missing)))
+        try:
+            results = pool.map(fetch, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+        # sqlite3 connections belong to the thread that created them, so we
+        # do all our writing here, in one transaction.
+        indexed = [(version, binaries) for (version, binaries) in results
+                   if binaries is not None]
+        with self.conn:
+            for (version, binaries) in indexed:
+                self.conn.execute(
+                    'UPDATE builds SET indexed = 1 '
+                    'WHERE package = ? AND version = ?', (package, version))
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO binaries '
+                    '(package, version, arch, name) VALUES (?, ?, ?, ?)',
+                    [(package, version, arch, name)
+                     for (arch, names) in binaries.items()
+                     for name in names])
+        return [version for (version, _) in indexed]
+
+    def versions(self, package, since=None, latest=None, distro=None,
+                 prefix=None):
+        """
+        Query the versions of a package's builds, in dpkg order.
+
+        :param since: ``str``, only return versions at least this new, eg.
+                      "12.2.4"
+        :param latest: ``int``, only return (up to) this many of the newest
+                       versions
+        :param distro: ``str``, only return builds for this distro, eg.
+                       "xenial"
+        :param prefix: ``str``, only return versions that start with this,
+                       eg. "3.0."
+        :returns: ``list`` of version ``str``s, oldest first
+        """
+        query = 'SELECT version FROM builds WHERE package = ?'
+        params = [package]
+        if since is not None:
+            query += ' AND sort_key >= ?'
+            params.append(version_sort_key(since))
+        if distro is not None:
+            query += ' AND distro = ?'
+            params.append(distro)
+        if prefix is not None:
+            query += ' AND substr(version, 1, ?) = ?'
+            params.extend([len(prefix), prefix])
+        if latest is None:
+            query += ' ORDER BY sort_key'
+        else:
+            query += ' ORDER BY sort_key DESC LIMIT ?'
+            params.append(latest)
+        versions = [row[0] for row in self.conn.execute(query, params)]
+        if latest is not None:
+            versions.reverse()
+        return versions
+
+    def binaries(self, package, version, client=None):
+        """
+        Return the binaries of one build.
+
+        :param client: ``ChacraClient``. If given, we fetch the build's
+                       binaries first if we have not indexed them yet.
+        :returns: ``dict`` of arch to ``list`` of binary names
+        """
+        if client is not None:
+            self.index_binaries(package, client, [version], jobs=1)
+        cursor = self.conn.execute(
+            'SELECT arch, name FROM binaries '
+            'WHERE package = ? AND version = ? ORDER BY arch, name',
+            (package, version))
+        arches = {}
+        for (arch, name) in cursor:
+            arches.setdefault(arch, []).append(name)
+        return arches
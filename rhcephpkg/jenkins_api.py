@@ -0,0 +1,152 @@
+"""
+Our layer on top of python-jenkins.
+
+python-jenkins' get_build_info() and get_queue_item() return every field
+that Jenkins has for a build or queue item, including every action, cause
+and changeset. Our polling loops only read a handful of fields, so
+JenkinsSession asks for just those with Jenkins' "tree" query parameter,
+and keeps count of how many bytes each request transferred over the wire.
+
+util.jenkins_connection() shares one JenkinsSession across the whole
+process. python-jenkins already keeps a requests Session (with its pool of
+keep-alive connections) and the CSRF crumb on each Jenkins object, and
+JenkinsSession also remembers who we are authenticated as.
+"""
+import threading
+import requests
+from jenkins import Jenkins, TimeoutException
+import rhcephpkg.log as log
+
+# The fields that our polling loops read.
+BUILD_TREE = ('number,building,timestamp,duration,estimatedDuration,result,'
+              'actions[parameters[name,value]]')
+QUEUE_TREE = 'why,cancelled,inQueueSince,executable[number]'
+JOB_BUILDS_TREE = 'builds[number,building,actions[causes[userId]]]'
+# The results, durations, parameters and Git commits of a job's most recent
+# builds.
+RECENT_BUILDS_TREE = ('builds[number,result,duration,'
+                      'actions[parameters[name,value],'
+                      'lastBuiltRevision[SHA1]]]{0,%d}')
+
+
+class JenkinsUnavailable(requests.exceptions.ConnectionError):
+    """ Jenkins, or a proxy in front of it, answered with a 5xx error. """
+
+
+# The errors that mean Jenkins is down or restarting, rather than that our
+# request was wrong. Our polling loops count these in their CircuitBreaker.
+OUTAGE_ERRORS = (requests.exceptions.ConnectionError, TimeoutException)
+
+
+def wire_size(response):
+    """
+    Return how many bytes of body a response took on the wire.
+
+    requests decompresses gzipped bodies for us, so for a compressed
+    response we trust its Content-Length header rather than the length of
+    its decompressed content.
+    """
+    content = response.content
+    length = response.headers.get('Content-Length')
+    if response.headers.get('Content-Encoding') and length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            pass
+    return len(content)
+
+
+class JenkinsSession(Jenkins):
+    """
+    A python-jenkins connection with trimmed polling queries and transfer
+    accounting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(JenkinsSession, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.transferred = 0
+        self.whoami = None
+
+    def jenkins_request(self, req, add_crumb=True, resolve_auth=True,
+                        stream=None):
+        response = super(JenkinsSession, self).jenkins_request(
+            req, add_crumb, resolve_auth, stream)
+        # Do not consume streaming responses here.
+        if not stream:
+            size = wire_size(response)
+            with self.lock:
+                self.requests += 1
+                self.transferred += size
+            log.debug('%s %s: %d bytes on the wire' %
+                      (req.method, req.url, size))
+        return response
+
+    def _response_handler(self, response):
+        # python-jenkins would turn a 500 into a JenkinsException that reads
+        # like an authentication failure, and a 502, 503 or 504 into an
+        # HTTPError, so our callers could not tell an outage apart from a
+        # bad request.
+        if response.status_code >= 500:
+            raise JenkinsUnavailable('%d %s: %s' % (response.status_code,
+                                                    response.reason,
+                                                    response.url),
+                                     response=response)
+        return super(JenkinsSession, self)._response_handler(response)
+
+    def get_whoami(self, depth=0):
+        """ Like python-jenkins' get_whoami(), but only asks Jenkins once.
+        """
+        with self.lock:
+            whoami = self.whoami
+        if whoami is None:
+            whoami = super(JenkinsSession, self).get_whoami(depth)
+            with self.lock:
+                self.whoami = whoami
+        return whoami
+
+    def get_tree(self, path, tree):
+        """
+        GET a JSON API path with only the fields in tree.
+
+        :param path: ``str``, eg. "job/build-package/123/api/json"
+        :param tree: ``str``, eg. "building,result"
+        :returns: ``dict``
+        """
+        url = '%s?tree=%s' % (self._build_url(path), tree)
+        return self.jenkins_request(requests.Request('GET', url)).json()
+
+    def build_status(self, name, number):
+        """
+        Like get_build_info(), but with only the fields in BUILD_TREE.
+        """
+        path = 'job/%s/%d/api/json' % (name, number)
+        return self.get_tree(path, BUILD_TREE)
+
+    def queue_status(self, number):
+        """
+        Like get_queue_item(), but with only the fields in QUEUE_TREE.
+        """
+        return self.get_tree('queue/item/%d/api/json' % number, QUEUE_TREE)
+
+    def job_builds(self, name):
+        """
+        Return the job's builds, with whether each is building and who
+        started it.
+
+        :returns: ``list`` of ``dict``s
+        """
+        return self.get_tree('job/%s/api/json' % name,
+                             JOB_BUILDS_TREE)['builds']
+
+    def recent_builds(self, name, count):
+        """
+        Return the job's most recent builds, with their results, durations,
+        parameters and the Git commits that they built.
+
+        :param count: ``int``, how many builds to return
+        :returns: ``list`` of ``dict``s, newest first
+        """
+        return self.get_tree('job/%s/api/json' % name,
+                             RECENT_BUILDS_TREE % count)['builds']
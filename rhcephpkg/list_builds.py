@@ -1,12 +1,18 @@
+from multiprocessing.pool import ThreadPool
 import json
-import posixpath
-import six
-from six.moves import configparser
-from six.moves.urllib.request import Request, urlopen
-from gbp.deb import DpkgCompareVersions
+import sqlite3
+import sys
 from tambo import Transport
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.debversion import newest, version_key
+from rhcephpkg.index import BuildIndex, version_distro
+import rhcephpkg.log as log
 import rhcephpkg.util as util
 
+DEFAULT_JOBS = 8
+
+FILTERS = ('--since', '--latest', '--distro', '--prefix')
+
 
 class ListBuilds(object):
     help_menu = 'list builds for a package in chacra'
@@ -15,57 +21,186 @@ Print a sorted list of all builds (NVRs) stored in chacra for a package.
 
 This is somewhat similar to the "koji list-builds" command.
 
+We answer from a local index of chacra's builds
+(~/.cache/rhcephpkg/index.sqlite), which we update from one request per
+package for chacra's list of versions. With --latest, we skip the index and
+pick the newest builds straight from that list.
+
+Options:
+--refresh   Ignore any cached chacra listings
+--since     Only list builds at least this new, eg "12.2.4"
+--latest    Only list this many of the newest builds, eg "1"
+--distro    Only list builds for this distro, eg "xenial"
+--prefix    Only list versions that start with this, eg "3.0."
+--jobs      Number of packages to query at once (default: %d)
+--json      Print a JSON array with one object per package
+--ndjson    Print one JSON object per package, per line
+
 Positional Arguments:
 
-[package]  The name of the package, eg "ceph"
-"""
+[package...]  The names of the packages, eg "ceph ceph-ansible"
+
+With --json or --ndjson, we print each package's object as soon as its
+query finishes, so the packages may appear in any order. Each object has
+a "package" key, and either a "builds" list (oldest first) or an "error".
+""" % DEFAULT_JOBS
     name = 'list-builds'
 
     def __init__(self, argv):
         self.argv = argv
-        self.options = []
+        self.options = list(FILTERS) + ['--jobs']
+        self.refresh = False
+        self.client = None
 
     def main(self):
         self.parser = Transport(self.argv, options=self.options)
         self.parser.catch_help = self.help()
         self.parser.parse_args()
-        try:
-            package = self.parser.unknown_commands[0]
-        except IndexError:
+        self.refresh = self.parser.has('--refresh')
+        filters = {}
+        for option in FILTERS:
+            if self.parser.has(option):
+                if self.parser.get(option) is None:
+                    raise SystemExit('Specify a value to %s' % option)
+                filters[option[2:]] = self.parser.get(option)
+        if 'latest' in filters:
+            filters['latest'] = util.positive_int(self.parser, '--latest')
+        if 'since' in filters:
+            try:
+                version_key(filters['since'])
+            except ValueError as e:
+                raise SystemExit('Invalid --since version %s: %s' %
+                                 (filters['since'], e))
+        jobs = DEFAULT_JOBS
+        if self.parser.has('--jobs'):
+            jobs = util.positive_int(self.parser, '--jobs')
+        output = None
+        for fmt in ('--json', '--ndjson'):
+            if self.parser.has(fmt):
+                if output is not None:
+                    raise SystemExit('Specify only one of --json or --ndjson')
+                output = fmt[2:]
+        flags = ('--refresh', '--json', '--ndjson')
+        packages = [arg for arg in self.parser.unknown_commands
+                    if arg not in flags]
+        if not packages:
             return self.parser.print_help()
-        self._run(package)
+        self._run(packages, output=output, jobs=jobs, **filters)
 
     def help(self):
         return self._help
 
-    def _run(self, package):
+    def _run(self, packages, output=None, jobs=DEFAULT_JOBS, **filters):
+        self.client = ChacraClient(pool_size=jobs, refresh=self.refresh)
+
+        def query(package):
+            try:
+                return (package, self.builds(package, **filters), None)
+            except (IOError, sqlite3.Error) as e:
+                # (IOError includes all of requests' exceptions.) Report
+                # this package's error, and carry on with the others.
+                return (package, None, str(e))
+
+        pool = ThreadPool(min(jobs, len(packages)))
+        try:
+            if output is None:
+                # Plain text keeps the order of the packages we were given.
+                results = pool.imap(query, packages)
+            else:
+                results = pool.imap_unordered(query, packages)
+            failed = self.emit(results, output)
+        finally:
+            pool.close()
+            pool.join()
+        if failed:
+            raise SystemExit('could not list builds for %s' %
+                             ', '.join(failed))
+
+    def emit(self, results, output=None):
+        """
+        Print each package's builds as soon as we have them.
+
+        :param results: iterable of (package, versions, error) tuples
+        :param output: None for plain text, "json" or "ndjson"
+        :returns: ``list`` of the packages that we could not query
+        """
+        failed = []
+        first = True
+        if output == 'json':
+            sys.stdout.write('[')
+        for (package, versions, error) in results:
+            if error is not None:
+                failed.append(package)
+            if output is None:
+                if error is not None:
+                    log.error('%s: %s' % (package, error))
+                for version in versions or []:
+                    print('%s_%s' % (package, version))
+                continue
+            obj = {'package': package}
+            if error is None:
+                obj['builds'] = ['%s_%s' % (package, version)
+                                 for version in versions]
+            else:
+                obj['error'] = error
+            if output == 'json':
+                sys.stdout.write('%s\n' % ('' if first else ','))
+            sys.stdout.write(json.dumps(obj, sort_keys=True))
+            if output == 'ndjson':
+                sys.stdout.write('\n')
+            # Let consumers start on this package before the next one.
+            sys.stdout.flush()
+            first = False
+        if output == 'json':
+            sys.stdout.write('\n]\n')
+        return failed
+
+    def builds(self, package, since=None, latest=None, distro=None,
+               prefix=None):
+        """
+        Return the versions of this package's builds, oldest first.
+        """
+        if latest is None:
+            return self.query_index(package, since, distro, prefix)
+        return self.newest_builds(package, latest, since, distro, prefix)
+
+    def query_index(self, package, since=None, distro=None, prefix=None):
+        """ Refresh our index of this package, and query it. """
+        # sqlite3 connections are not shared between threads, so each query
+        # opens its own.
+        index = BuildIndex()
+        try:
+            index.refresh(package, self._client())
+            return index.versions(package, since, distro=distro,
+                                  prefix=prefix)
+        finally:
+            index.close()
+
+    def newest_builds(self, package, count, since=None, distro=None,
+                      prefix=None):
+        """
+        Return the newest count builds of this package, oldest first.
+
+        This needs only chacra's list of versions, and selects the newest
+        versions with a heap instead of sorting them all.
+        """
         versions = self.list_builds(package)
-        versions = self.sort_nvrs(versions)
-        nvrs = ['%s_%s' % (package, version) for version in versions]
-        print("\n".join(nvrs))
+        if prefix is not None:
+            versions = [v for v in versions if v.startswith(prefix)]
+        if distro is not None:
+            versions = [v for v in versions if version_distro(v) == distro]
+        if since is not None:
+            since_key = version_key(since)
+            versions = [v for v in versions if version_key(v) >= since_key]
+        return newest(versions, count)
 
     def list_builds(self, package):
-        configp = util.config()
-        try:
-            base_url = configp.get('rhcephpkg.chacra', 'url')
-        except configparser.Error as err:
-            raise SystemExit('Problem parsing .rhcephpkg.conf: %s',
-                             err.message)
-        builds_url = posixpath.join(base_url, 'binaries/', package)
-        build_response = urlopen(Request(builds_url))
-        headers = build_response.headers
-        if six.PY2:
-            encoding = headers.getparam('charset') or 'utf-8'
-            # if encoding is None:
-            #    encoding = 'utf-8'
-        else:
-            encoding = headers.get_content_charset(failobj='utf-8')
-        payload = json.loads(build_response.read().decode(encoding))
-        return payload.keys()
+        return self._client().builds(package).keys()
 
     def sort_nvrs(self, nvrs):
-        dcmp = DpkgCompareVersions()
-        if six.PY2:
-            return sorted(nvrs, cmp=dcmp)
-        from functools import cmp_to_key
-        return sorted(nvrs, key=cmp_to_key(dcmp))
+        return sorted(nvrs, key=version_key)
+
+    def _client(self):
+        if self.client is None:
+            self.client = ChacraClient(refresh=self.refresh)
+        return self.client
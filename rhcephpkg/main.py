@@ -19,6 +19,8 @@ Global Options:
 
     mapper = {
         'build': rhcephpkg.Build,
+        'build-stats': rhcephpkg.BuildStats,
+        'cache': rhcephpkg.Cache,
         'checkout-from-patches': rhcephpkg.CheckoutFromPatches,
         'clone': rhcephpkg.Clone,
         'download': rhcephpkg.Download,
@@ -27,6 +29,7 @@ Global Options:
         'list-builds': rhcephpkg.ListBuilds,
         'localbuild': rhcephpkg.Localbuild,
         'merge-patches': rhcephpkg.MergePatches,
+        'mirror': rhcephpkg.Mirror,
         'new-version': rhcephpkg.NewVersion,
         'patch': rhcephpkg.Patch,
         'source': rhcephpkg.Source,
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+from requests.exceptions import HTTPError
+from tambo import Transport
+from rhcephpkg.cache import NullCache
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.debversion import version_key
+from rhcephpkg.download import Download, DEFAULT_JOBS, FAILED
+import rhcephpkg.util as util
+import rhcephpkg.log as log
+
+# The name of the manifest file in the top of each mirror directory.
+MANIFEST = '.rhcephpkg-mirror.json'
+
+
+class MirrorManifest(object):
+    """
+    Record of what we have already mirrored into a directory.
+
+    "builds" maps each mirrored version to a dict of its binaries' names and
+    checksums. We only consider a build mirrored once every one of its
+    artifacts downloaded successfully.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            data = {}
+        self.package = data.get('package')
+        self.arch = data.get('arch')
+        self.builds = data.get('builds', {})
+
+    def save(self):
+        """ Write the manifest to disk atomically. """
+        data = {'package': self.package, 'arch': self.arch,
+                'builds': self.builds}
+        util.write_json(self.path, data, indent=2, sort_keys=True)
+
+
+class Mirror(Download):
+    help_menu = 'incrementally mirror every build of a package'
+    _help = """
+Mirror every build of a package from chacra into a local directory.
+
+Each build goes into its own "<package>_<version>" directory. A manifest in
+the mirror directory records which builds we have already mirrored, so each
+run only fetches builds that are new in chacra (or whose files have gone
+missing locally). Artifacts are verified against chacra's checksums.
+
+Options:
+--dest      Directory to mirror into (default: the current directory)
+--jobs      Number of artifacts to download at once (default: %d)
+--arch      Only mirror these arches, eg. "amd64,noarch"
+--delete    Remove builds that are no longer in chacra, and stray files in
+            the builds we fetch
+--refresh   Ignore any cached chacra listings
+--dry-run   Show what we would fetch and delete, and exit
+
+Positional Arguments:
+
+[package]  The name of the package to mirror, eg. "ceph"
+""" % DEFAULT_JOBS
+    name = 'mirror'
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.options = ['--dest', '--jobs', '--arch']
+        self.dest = '.'
+
+    def main(self):
+        self.parser = Transport(self.argv, options=self.options)
+        self.parser.catch_help = self.help()
+        self.parser.parse_args()
+        jobs = self._jobs()
+        arch = None
+        if self.parser.has('--arch'):
+            arch = self._list_option('--arch')
+        if self.parser.has('--dest'):
+            if self.parser.get('--dest') is None:
+                raise SystemExit('Specify a directory to --dest')
+            self.dest = self.parser.get('--dest')
+        flags = ('--delete', '--refresh', '--dry-run')
+        args = [arg for arg in self.parser.unknown_commands
+                if arg not in flags]
+        if len(args) != 1:
+            return self.parser.print_help()
+        self._run(args[0], jobs=jobs, arch=arch,
+                  delete=self.parser.has('--delete'),
+                  refresh=self.parser.has('--refresh'),
+                  dry_run=self.parser.has('--dry-run'))
+
+    def path(self, artifact):
+        """ Return the local path for this artifact in our mirror. """
+        return os.path.join(self.build_dir(artifact.pkg, artifact.version),
+                            artifact.name)
+
+    def artifact_cache(self):
+        """
+        A mirror keeps every build, and its manifest already tells us which
+        builds we have, so we do not copy them into the per-user cache.
+        """
+        return NullCache()
+
+    def build_dir(self, pkg, version):
+        return os.path.join(self.dest, '%s_%s' % (pkg, version))
+
+    def _run(self, package, jobs=DEFAULT_JOBS, arch=None, delete=False,
+             refresh=False, dry_run=False):
+        self.client = ChacraClient(pool_size=jobs, refresh=refresh)
+        util.makedirs(self.dest)
+        manifest = MirrorManifest(os.path.join(self.dest, MANIFEST))
+        if manifest.package not in (None, package):
+            raise SystemExit('%s is a mirror of %s, not %s' %
+                             (self.dest, manifest.package, package))
+        # If our earlier runs mirrored different arches, we must look at
+        # every build again.
+        rescan = manifest.arch != arch
+        manifest.package = package
+        manifest.arch = arch
+
+        remote = sorted(self.client.builds(package), key=version_key)
+        wanted = [version for version in remote if rescan or
+                  not self._mirrored(package, version, manifest)]
+        stale = sorted((version for version in manifest.builds
+                        if version not in remote), key=version_key)
+
+        artifacts = []
+        planned = []
+        for version in wanted:
+            try:
+                build_artifacts = self.plan(package, version, arch)
+            except HTTPError as e:
+                # eg. a build that is still in progress
+                log.warning('skipping %s_%s: %s' % (package, version, e))
+                continue
+            planned.append(version)
+            artifacts += build_artifacts
+
+        if dry_run:
+            for version in planned:
+                build = [a for a in artifacts if a.version == version]
+                size = sum(a.size or 0 for a in build)
+                print('fetch   %s_%s (%d artifacts, %s)' %
+                      (package, version, len(build), util.format_bytes(size)))
+            if delete:
+                for version in stale:
+                    print('delete  %s_%s' % (package, version))
+            return
+
+        for version in planned:
+            util.makedirs(self.build_dir(package, version))
+        results = []
+        if artifacts:
+            results = self.fetch_all(artifacts, jobs)
+        failed = set(artifact.version for (artifact, status, _) in results
+                     if status == FAILED)
+        for version in planned:
+            if version in failed:
+                continue
+            manifest.builds[version] = dict(
+                (a.name, a.checksum) for a in artifacts
+                if a.version == version)
+            if delete:
+                self._remove_strays(package, version, manifest)
+        if delete:
+            for version in stale:
+                log.info('deleting %s_%s' % (package, version))
+                shutil.rmtree(self.build_dir(package, version),
+                              ignore_errors=True)
+                del manifest.builds[version]
+        elif stale:
+            log.info('%d builds are no longer in chacra (use --delete to '
+                     'remove them)' % len(stale))
+        manifest.save()
+
+        log.info('mirrored %d new builds of %s, %d already up to date' %
+                 (len(planned) - len(failed), package,
+                  len(remote) - len(wanted)))
+        if failed:
+            count = len([r for r in results if r[1] == FAILED])
+            raise SystemExit('%d of %d artifacts failed to download' %
+                             (count, len(artifacts)))
+
+    def _mirrored(self, package, version, manifest):
+        """
+        Return True if we already mirrored this build and all its files are
+        still present.
+        """
+        binaries = manifest.builds.get(version)
+        if binaries is None:
+            return False
+        directory = self.build_dir(package, version)
+        return all(os.path.isfile(os.path.join(directory, binary))
+                   for binary in binaries)
+
+    def _remove_strays(self, package, version, manifest):
+        """ Remove files in a build's directory that chacra does not have. """
+        directory = self.build_dir(package, version)
+        binaries = manifest.builds[version]
+        for filename in os.listdir(directory):
+            if filename in binaries:
+                continue
+            path = os.path.join(directory, filename)
+            log.info('deleting %s' % path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
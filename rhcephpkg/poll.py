@@ -0,0 +1,173 @@
+"""
+Decide how long to wait between polls of Jenkins.
+
+Polling Jenkins on a fixed short interval costs the server an API call every
+few seconds for every engineer and CI job that is watching a build. The
+PollScheduler polls quickly right after something changes, backs off
+exponentially (with random jitter, so many watchers do not synchronize)
+while nothing changes, and wakes up near a build's expected finish time.
+
+When Jenkins is down, the CircuitBreaker stops us from retrying in a tight
+loop: after a few consecutive connection errors, timeouts or 5xx responses
+(see jenkins_api.OUTAGE_ERRORS) it pauses polling, and
+backs off exponentially between single reconnection attempts.
+"""
+import random
+import time
+from six.moves import configparser
+import rhcephpkg.util as util
+import rhcephpkg.log as log
+
+# Defaults for the [rhcephpkg.poll] section of ~/.rhcephpkg.conf.
+DEFAULTS = {
+    'min_interval': 2.0,
+    'max_interval': 60.0,
+    'backoff': 2.0,
+    'jitter': 0.1,
+    'outage_interval': 300.0,
+    'failure_threshold': 3,
+}
+
+
+def poll_config():
+    """
+    Return our polling policy from the [rhcephpkg.poll] section of
+    ~/.rhcephpkg.conf.
+
+    :returns: ``dict`` with the same keys as DEFAULTS
+    """
+    configp = util.config()
+    settings = {}
+    for (key, default) in DEFAULTS.items():
+        try:
+            settings[key] = configp.getfloat('rhcephpkg.poll', key)
+        except configparser.Error:
+            settings[key] = default
+        except ValueError:
+            raise SystemExit('Problem parsing .rhcephpkg.conf: '
+                             '[rhcephpkg.poll] %s must be a number' % key)
+    return settings
+
+
+class PollScheduler(object):
+    """
+    Compute the delay before each poll.
+
+    Call next() with the state that the last poll observed (anything that
+    compares equal when nothing has changed, eg. a queue item's "why"
+    text). When the state changes, we return to the minimum interval.
+    Otherwise each delay is "backoff" times the previous one, up to the
+    maximum interval.
+
+    If we know when the thing we are polling should finish (see expect()),
+    we never sleep past that time, and we poll quickly again once it
+    arrives.
+    """
+
+    def __init__(self, min_interval=None, max_interval=None, backoff=None,
+                 jitter=None):
+        settings = poll_config()
+        self.min_interval = settings['min_interval'] \
+            if min_interval is None else min_interval
+        self.max_interval = settings['max_interval'] \
+            if max_interval is None else max_interval
+        self.backoff = settings['backoff'] if backoff is None else backoff
+        self.jitter = settings['jitter'] if jitter is None else jitter
+        self.interval = None
+        self.state = None
+        self.expected_end = None
+        self._reached_end = False
+
+    def expect(self, end):
+        """
+        Tell the scheduler when we expect the polled thing to finish.
+
+        :param end: ``float``, seconds since the epoch, or None if unknown
+        """
+        self.expected_end = end
+        self._reached_end = False
+
+    def next(self, state=None, now=None):
+        """
+        Return the number of seconds to wait before the next poll.
+
+        :param state: what the last poll observed
+        :param now: ``float``, the current time (for testing)
+        """
+        if now is None:
+            now = time.time()
+        if self.interval is None or state != self.state:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff,
+                                self.max_interval)
+        self.state = state
+        if self.expected_end is not None:
+            remaining = self.expected_end - now
+            if remaining <= 0 and not self._reached_end:
+                # We are at (or past) the expected finish, so the build
+                # could end at any moment. Start over from the minimum.
+                self._reached_end = True
+                self.interval = self.min_interval
+            elif 0 < remaining < self.interval:
+                # Wake up just after the expected finish.
+                return remaining + self.min_interval / 2.0
+        return self.interval * random.uniform(1 - self.jitter,
+                                              1 + self.jitter)
+
+
+class CircuitBreaker(object):
+    """
+    Decide how long to wait after each failed connection to Jenkins.
+
+    The breaker starts out closed. Call failure() after each connection
+    error, and success() after each request that works. After "threshold"
+    consecutive failures the breaker opens: we log once that Jenkins is
+    unreachable, and from then on only make one attempt per delay. Each
+    delay is "backoff" times the previous one, up to "outage_interval"
+    seconds. The first successful request closes the breaker again.
+    """
+
+    def __init__(self, min_interval=None, outage_interval=None, backoff=None,
+                 jitter=None, threshold=None):
+        settings = poll_config()
+        self.min_interval = settings['min_interval'] \
+            if min_interval is None else min_interval
+        self.outage_interval = settings['outage_interval'] \
+            if outage_interval is None else outage_interval
+        self.backoff = settings['backoff'] if backoff is None else backoff
+        self.jitter = settings['jitter'] if jitter is None else jitter
+        self.threshold = int(settings['failure_threshold']
+                             if threshold is None else threshold)
+        self.failures = 0
+
+    @property
+    def open(self):
+        return self.failures >= self.threshold
+
+    def failure(self, error):
+        """
+        Record a connection error.
+
+        :param error: the exception that we caught
+        :returns: ``float``, the number of seconds to wait before trying
+                  again
+        """
+        self.failures += 1
+        if self.failures < self.threshold:
+            log.warning('connection error (attempt %d): %s' %
+                        (self.failures, error))
+        elif self.failures == self.threshold:
+            log.error('Jenkins is unreachable, pausing polls: %s' % error)
+        else:
+            log.debug('still unreachable: %s' % error)
+        delay = min(self.min_interval * self.backoff ** (self.failures - 1),
+                    self.outage_interval)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def success(self):
+        """ Record a request that worked. """
+        if self.open:
+            log.info('reconnected to Jenkins after %d failed attempts' %
+                     self.failures)
+        self.failures = 0
@@ -0,0 +1,130 @@
+"""
+Check whether a build would only repeat one that we already have.
+
+Before "build" queues a build-package job, we look for a successful
+build-package run of the same dist-git commit in Jenkins, and for the
+debian/changelog version in chacra.
+
+Successful builds never change, so we remember every one that we see in
+~/.cache/rhcephpkg/built.json. Once we have seen a commit's build, checking
+that commit again does not need to ask Jenkins at all, and a BuiltRevisions
+object only asks Jenkins for its recent builds once, however many commits
+we check with it (eg. for a whole "build --batch"). The chacra lookup goes
+through ChacraClient's response cache.
+"""
+import json
+import os
+import re
+from requests.exceptions import HTTPError
+import rhcephpkg.util as util
+import rhcephpkg.log as log
+
+# How many of the job's most recent builds we look through.
+RECENT_BUILDS = 50
+
+# A distro codename at the end of a chacra version, eg. "xenial".
+DISTRO_RE = re.compile(r'^[a-z]+$')
+
+
+class BuiltRevisions(object):
+    """
+    Our record of the commits that build-package built successfully.
+
+    "revisions" maps "<package> <branch> <sha1>" to a build number.
+    "scanned" is True once we have added Jenkins' recent builds.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(util.cache_dir(), 'built.json')
+        self.path = path
+        try:
+            with open(path) as fp:
+                self.revisions = json.load(fp)
+        except (IOError, ValueError):
+            self.revisions = {}
+        self.scanned = False
+
+    def get(self, pkg, branch, sha1):
+        return self.revisions.get('%s %s %s' % (pkg, branch, sha1))
+
+    def add(self, pkg, branch, sha1, number):
+        self.revisions['%s %s %s' % (pkg, branch, sha1)] = number
+
+    def save(self):
+        """ Write the record to disk atomically. """
+        util.write_json(self.path, self.revisions, indent=2, sort_keys=True)
+
+
+def build_revision(build):
+    """
+    Return the parameters and Git commit of a build from
+    JenkinsSession.recent_builds().
+
+    :returns: ``tuple`` of (``dict`` of parameters, sha1 ``str`` or None)
+    """
+    parameters = {}
+    sha1 = None
+    for action in build.get('actions', []):
+        for parameter in action.get('parameters', []):
+            parameters[parameter['name']] = parameter.get('value')
+        if action.get('lastBuiltRevision'):
+            sha1 = action['lastBuiltRevision'].get('SHA1')
+    return (parameters, sha1)
+
+
+def jenkins_duplicate(jenkins, pkg, branch, sha1, built=None):
+    """
+    Find a successful build-package run of this commit.
+
+    :param jenkins: ``JenkinsSession``
+    :param built: ``BuiltRevisions``. Pass the same one to check many
+                  commits with one query to Jenkins.
+    :returns: ``int``, the build number, or None if we found no such build
+    """
+    if built is None:
+        built = BuiltRevisions()
+    number = built.get(pkg, branch, sha1)
+    if number is not None or built.scanned:
+        return number
+    for build in jenkins.recent_builds('build-package', RECENT_BUILDS):
+        if build.get('result') != 'SUCCESS':
+            continue
+        (parameters, revision) = build_revision(build)
+        if revision is None or 'PKG_NAME' not in parameters \
+                or 'BRANCH' not in parameters:
+            continue
+        built.add(parameters['PKG_NAME'], parameters['BRANCH'], revision,
+                  build['number'])
+    built.scanned = True
+    built.save()
+    return built.get(pkg, branch, sha1)
+
+
+def chacra_duplicate(client, pkg, branch, version):
+    """
+    Find a chacra build of this debian/changelog version.
+
+    chacra's versions may end with a distro codename, eg.
+    "10.2.0-2redhat1xenial". We only count those if the branch is for the
+    same distro, eg. "ceph-2-xenial".
+
+    :param client: ``ChacraClient``
+    :param version: ``str``, eg. "10.2.0-2redhat1"
+    :returns: ``str``, the chacra version, or None if there is no such
+              build
+    """
+    try:
+        builds = client.builds(pkg)
+    except HTTPError as e:
+        log.debug('could not list %s builds in chacra: %s' % (pkg, e))
+        return None
+    for candidate in sorted(builds):
+        if not candidate.startswith(version):
+            continue
+        distro = candidate[len(version):]
+        if not distro:
+            return candidate
+        if DISTRO_RE.match(distro) and branch.endswith('-' + distro):
+            return candidate
+    return None
@@ -1,7 +1,7 @@
 import os
 import pytest
 import py.path
-from rhcephpkg.tests.util import git
+from rhcephpkg.tests.util import FakeChacraAdapter, git
 
 
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -13,6 +13,20 @@ def fake_home(monkeypatch):
     monkeypatch.setenv('HOME', FIXTURES_DIR)
 
 
+@pytest.fixture(autouse=True)
+def fake_cache(monkeypatch, tmpdir_factory):
+    """ Keep each test's cached data out of FIXTURES_DIR. """
+    cache = tmpdir_factory.mktemp('cache')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache))
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_jenkins(monkeypatch):
+    """ Do not share util.jenkins_connection()'s object between tests. """
+    monkeypatch.setattr('rhcephpkg.util._jenkins', None)
+
+
 @pytest.fixture
 def testpkg(tmpdir, monkeypatch):
     """ Set up a minimal testpkg Git repository and chdir into it. """
@@ -28,3 +42,9 @@ def testpkg(tmpdir, monkeypatch):
     git('branch', '-m', 'ceph-2-ubuntu')
     git('branch', 'patch-queue/ceph-2-ubuntu')
     return dest
+
+
+@pytest.fixture
+def fake_chacra(monkeypatch):
+    """ Serve chacra requests from our local fixture files. """
+    monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', FakeChacraAdapter)
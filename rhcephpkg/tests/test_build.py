@@ -1,4 +1,7 @@
+from jenkins import TimeoutException
 from rhcephpkg import Build
+from rhcephpkg.jenkins_api import JenkinsUnavailable
+from rhcephpkg.tests.util import git
 import pytest
 
 
@@ -40,10 +43,14 @@ class TestBuild(object):
 
     def test_working_build(self, monkeypatch):
         monkeypatch.setattr('jenkins.Jenkins.build_job', self.fake_build_job)
-        monkeypatch.setattr('jenkins.Jenkins.get_queue_item',
-                            self.fake_get_queue_item)
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.recent_builds',
+            lambda self, name, count: [])
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.queue_status',
+            self.fake_get_queue_item)
         monkeypatch.setattr('rhcephpkg.watch_build.WatchBuild.watch',
-                            lambda self, build_id: None)
+                            lambda self, build_id, queued: None)
         monkeypatch.setattr('rhcephpkg.util.package_name', lambda: 'mypkg')
         monkeypatch.setattr('rhcephpkg.util.current_branch',
                             lambda: 'ceph-2-ubuntu')
@@ -53,3 +60,228 @@ class TestBuild(object):
         assert self.kwargs == {'parameters': {'BRANCH': 'ceph-2-ubuntu',
                                               'PKG_NAME': 'mypkg'},
                                'token': '5d41402abc4b2a76b9719d911017c592'}
+
+    def test_duplicate(self, monkeypatch, testpkg, fake_chacra):
+        monkeypatch.setattr('jenkins.Jenkins.build_job', self.fake_build_job)
+        git('remote', 'add', 'origin', str(testpkg))
+        sha1 = git('rev-parse', 'HEAD')
+        built = {'number': 7, 'result': 'SUCCESS', 'actions': [
+            {'parameters': [{'name': 'PKG_NAME', 'value': 'testpkg'},
+                            {'name': 'BRANCH', 'value': 'ceph-2-ubuntu'}]},
+            {'lastBuiltRevision': {'SHA1': sha1}}]}
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.recent_builds',
+            lambda self, name, count: [built])
+        build = Build(['build'])
+        build.main()
+        # We did not queue a build.
+        assert self.args == []
+
+    def test_behind_origin(self, monkeypatch, testpkg, tmpdir, fake_chacra):
+        monkeypatch.setattr('jenkins.Jenkins.build_job', self.fake_build_job)
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.queue_status',
+            self.fake_get_queue_item)
+        monkeypatch.setattr('rhcephpkg.watch_build.WatchBuild.watch',
+                            lambda self, build_id, queued: None)
+        # Jenkins built our clone's commit...
+        clone = tmpdir.mkdir('workspace').join('testpkg')
+        git('clone', '-q', '-b', 'ceph-2-ubuntu', str(testpkg), str(clone))
+        built = {'number': 7, 'result': 'SUCCESS', 'actions': [
+            {'parameters': [{'name': 'PKG_NAME', 'value': 'testpkg'},
+                            {'name': 'BRANCH', 'value': 'ceph-2-ubuntu'}]},
+            {'lastBuiltRevision': {'SHA1': git('rev-parse', 'HEAD')}}]}
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.recent_builds',
+            lambda self, name, count: [built])
+        # ... but someone has since pushed a new one.
+        git('commit', '-q', '--allow-empty', '-m', 'new commit')
+        monkeypatch.chdir(clone)
+        build = Build(['build'])
+        build.main()
+        assert self.args == ('build-package',)
+
+    def test_force(self, monkeypatch):
+        monkeypatch.setattr('jenkins.Jenkins.build_job', self.fake_build_job)
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.queue_status',
+            self.fake_get_queue_item)
+        monkeypatch.setattr('rhcephpkg.watch_build.WatchBuild.watch',
+                            lambda self, build_id, queued: None)
+        monkeypatch.setattr('rhcephpkg.util.package_name', lambda: 'mypkg')
+        monkeypatch.setattr('rhcephpkg.util.current_branch',
+                            lambda: 'ceph-2-ubuntu')
+        monkeypatch.setattr('rhcephpkg.build.Build.find_duplicate',
+                            lambda self, *args: 'mypkg build #7')
+        build = Build(['build', '--force'])
+        build.main()
+        assert self.args == ('build-package',)
+
+
+class BatchJenkins(object):
+    """ Fake Jenkins that runs each queued build for a few polls. """
+
+    def __init__(self, results):
+        # package name -> final result
+        self.results = results
+        self.queue = {}
+        self.builds = {}
+        self.max_in_flight = 0
+        # build-package's earlier builds, for the duplicate check.
+        self.built = []
+
+    def build_job(self, name, parameters, token):
+        number = len(self.queue) + 1
+        self.queue[number] = parameters['PKG_NAME']
+        in_flight = len([n for n in self.queue
+                         if n not in self.builds or self.builds[n][0] > 0])
+        self.max_in_flight = max(self.max_in_flight, in_flight)
+        return number
+
+    def queue_status(self, number):
+        if number not in self.builds:
+            self.builds[number] = [2, self.queue[number]]
+        return {'executable': {'number': number + 100}}
+
+    def recent_builds(self, name, count):
+        return self.built
+
+    def build_status(self, job, number):
+        build = self.builds[number - 100]
+        build[0] -= 1
+        if build[0] > 0:
+            return {'building': True}
+        return {'building': False, 'result': self.results[build[1]]}
+
+
+class TestBatch(object):
+
+    @pytest.fixture
+    def fake(self, monkeypatch):
+        monkeypatch.setattr('rhcephpkg.build.sleep', lambda s: None)
+        fake = BatchJenkins({'ceph': 'SUCCESS', 'ceph-ansible': 'SUCCESS',
+                             'nfs-ganesha': 'FAILURE'})
+        monkeypatch.setattr('jenkins.Jenkins.build_job',
+                            lambda self, *a, **kw: fake.build_job(*a, **kw))
+        for method in ('queue_status', 'build_status', 'recent_builds'):
+            monkeypatch.setattr(
+                'rhcephpkg.jenkins_api.JenkinsSession.%s' % method,
+                getattr(fake, method))
+        return fake
+
+    def test_manifest(self, fake, tmpdir, capsys):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('# z-stream\n'
+                       'ceph ceph-3.0-xenial\n'
+                       'ceph ceph-3.0-trusty\n'
+                       'ceph-ansible ceph-3.0-xenial\n')
+        build = Build(['build', '--batch', str(manifest), '--jobs', '2'])
+        build.main()
+        out, _ = capsys.readouterr()
+        assert out.splitlines() == [
+            'package       ceph-3.0-trusty  ceph-3.0-xenial',
+            'ceph          SUCCESS          SUCCESS',
+            'ceph-ansible  -                SUCCESS',
+        ]
+        assert len(fake.queue) == 3
+        assert fake.max_in_flight == 2
+
+    def test_failure(self, fake, tmpdir, capsys):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph ceph-3.0-xenial\nnfs-ganesha ceph-3.0-xenial\n')
+        build = Build(['build', '--batch', str(manifest)])
+        with pytest.raises(SystemExit) as e:
+            build.main()
+        assert str(e.value) == '1 of 2 builds did not succeed'
+        out, _ = capsys.readouterr()
+        assert 'nfs-ganesha  FAILURE' in out
+
+    def test_workspace(self, fake, tmpdir, capsys):
+        for pkg in ('ceph', 'ceph-ansible'):
+            clone = tmpdir.mkdir(pkg)
+            git('init', '-q', str(clone))
+            git('-C', str(clone), 'checkout', '-q', '-b', 'ceph-3.0-xenial')
+            git('-C', str(clone), '-c', 'user.name=Test',
+                '-c', 'user.email=test@example.com',
+                'commit', '-q', '--allow-empty', '-m', 'initial')
+        tmpdir.mkdir('not-a-clone')
+        build = Build(['build', '--batch', str(tmpdir)])
+        build.main()
+        assert sorted(fake.queue.values()) == ['ceph', 'ceph-ansible']
+
+    def test_skip_workspace(self, fake, tmpdir, capsys):
+        for pkg in ('ceph', 'ceph-ansible'):
+            clone = tmpdir.mkdir(pkg)
+            git('init', '-q', str(clone))
+            git('-C', str(clone), 'checkout', '-q', '-b', 'ceph-3.0-xenial')
+            git('-C', str(clone), '-c', 'user.name=Test',
+                '-c', 'user.email=test@example.com',
+                'commit', '-q', '--allow-empty', '-m', pkg)
+            git('-C', str(clone), 'remote', 'add', 'origin', str(clone))
+        sha1 = git('-C', str(tmpdir.join('ceph')), 'rev-parse', 'HEAD')
+        fake.built = [{'number': 7, 'result': 'SUCCESS', 'actions': [
+            {'parameters': [{'name': 'PKG_NAME', 'value': 'ceph'},
+                            {'name': 'BRANCH', 'value': 'ceph-3.0-xenial'}]},
+            {'lastBuiltRevision': {'SHA1': sha1}}]}]
+        build = Build(['build', '--batch', str(tmpdir)])
+        build.main()
+        assert list(fake.queue.values()) == ['ceph-ansible']
+        out, _ = capsys.readouterr()
+        assert out.splitlines() == [
+            'package       ceph-3.0-xenial',
+            'ceph          SKIPPED',
+            'ceph-ansible  SUCCESS',
+        ]
+
+    def test_skip_manifest(self, fake, fake_chacra, tmpdir, capsys):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph ceph-2-trusty 10.2.0-2redhat1\n'
+                       'ceph-ansible ceph-2-trusty\n')
+        build = Build(['build', '--batch', str(manifest)])
+        build.main()
+        assert list(fake.queue.values()) == ['ceph-ansible']
+        out, _ = capsys.readouterr()
+        assert 'ceph          SKIPPED' in out
+
+    def test_force_batch(self, fake, fake_chacra, tmpdir):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph ceph-2-trusty 10.2.0-2redhat1\n')
+        build = Build(['build', '--batch', str(manifest), '--force'])
+        build.main()
+        assert list(fake.queue.values()) == ['ceph']
+
+    def test_outage(self, fake, tmpdir, monkeypatch):
+        monkeypatch.setattr('rhcephpkg.poll.random.uniform', lambda a, b: 1)
+        outage = [TimeoutException('timed out'),
+                  JenkinsUnavailable('502 Bad Gateway')]
+        build_status = fake.build_status
+
+        def flaky_build_status(self, job, number):
+            if outage:
+                raise outage.pop(0)
+            return build_status(job, number)
+        monkeypatch.setattr(
+            'rhcephpkg.jenkins_api.JenkinsSession.build_status',
+            flaky_build_status)
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph ceph-3.0-xenial\n')
+        build = Build(['build', '--batch', str(manifest)])
+        build.main()
+        assert outage == []
+
+    def test_bad_manifest(self, tmpdir):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph\n')
+        build = Build(['build', '--batch', str(manifest)])
+        with pytest.raises(SystemExit) as e:
+            build.main()
+        assert 'expected "package branch [version]", not "ceph"' in \
+            str(e.value)
+
+    def test_patch_queue(self, tmpdir):
+        manifest = tmpdir.join('batch.txt')
+        manifest.write('ceph patch-queue/ceph-3.0-xenial\n')
+        build = Build(['build', '--batch', str(manifest)])
+        with pytest.raises(SystemExit) as e:
+            build.main()
+        assert 'is a patch-queue branch' in str(e.value)
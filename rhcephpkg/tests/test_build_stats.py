@@ -0,0 +1,55 @@
+from rhcephpkg import BuildStats
+from rhcephpkg.history import BuildHistory
+from rhcephpkg.tests.test_history import build_info
+import pytest
+
+
+@pytest.fixture
+def history():
+    history = BuildHistory()
+    # Two weeks of ceph builds, and one ceph-ansible build.
+    day = 86400
+    monday = 1514808000  # noon on 2018-01-01, in UTC
+    for (number, offset, duration, wait) in [(1, 0, 3000, 60),
+                                             (2, day, 3600, 120),
+                                             (3, 8 * day, 4200, 600)]:
+        history.record(number, build_info('ceph', monday + offset, duration),
+                       queued=monday + offset - wait)
+    history.record(4, build_info('ceph-ansible', monday, 90, 'FAILURE'))
+    history.close()
+
+
+class TestBuildStats(object):
+
+    def test_summary(self, history, capsys):
+        build_stats = BuildStats(['build-stats'])
+        build_stats.main()
+        out, _ = capsys.readouterr()
+        assert out.splitlines() == [
+            'package       builds  passed  build p50  build p95  '
+            'queue p50  queue p95  busy',
+            'ceph          3       3       60:00      70:00      '
+            '02:00      10:00      3.0h',
+            'ceph-ansible  1       0       01:30      01:30      '
+            '-          -          0.0h',
+        ]
+
+    def test_package(self, history, capsys):
+        build_stats = BuildStats(['build-stats', 'ceph-ansible'])
+        build_stats.main()
+        out, _ = capsys.readouterr()
+        assert len(out.splitlines()) == 2
+
+    def test_trend(self, history, capsys):
+        build_stats = BuildStats(['build-stats', '--trend', 'ceph'])
+        build_stats.main()
+        out, _ = capsys.readouterr()
+        weeks = [line.split()[1] for line in out.splitlines()[1:]]
+        assert weeks == ['2018-01-01', '2018-01-08']
+
+    def test_days(self, history):
+        # All our builds are years old.
+        build_stats = BuildStats(['build-stats', '--days', '7'])
+        with pytest.raises(SystemExit) as e:
+            build_stats.main()
+        assert str(e.value) == 'no recorded builds'
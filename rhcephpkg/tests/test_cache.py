@@ -0,0 +1,125 @@
+import os
+import pytest
+from rhcephpkg import Cache
+from rhcephpkg.cache import ArtifactCache
+from rhcephpkg.cache import materialize
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ArtifactCache(root=str(tmpdir.join('artifacts')), max_size=100)
+
+
+def add(cache, tmpdir, name, size, atime):
+    """ Add a fake artifact to this cache, last used at atime. """
+    src = tmpdir.join(name)
+    src.write('x' * size)
+    cache.put('ceph', '12.2.4-1redhat1', 'amd64', name, str(src))
+    path = cache.path('ceph', '12.2.4-1redhat1', 'amd64', name)
+    os.utime(path, (atime, os.stat(path).st_mtime))
+    return path
+
+
+class TestMaterialize(object):
+
+    def test_materialize(self, tmpdir):
+        src = tmpdir.join('src')
+        src.write('contents')
+        dest = tmpdir.join('dest')
+        materialize(str(src), str(dest))
+        assert dest.read() == 'contents'
+        assert sorted(os.listdir(str(tmpdir))) == ['dest', 'src']
+
+    def test_independent_copy(self, tmpdir):
+        src = tmpdir.join('src')
+        src.write('contents')
+        dest = tmpdir.join('dest')
+        materialize(str(src), str(dest))
+        # Changing the copy in place does not change the original.
+        with open(str(dest), 'r+') as fp:
+            fp.write('CONTENTS')
+        assert src.read() == 'contents'
+        assert os.stat(str(src)).st_nlink == 1
+
+
+class TestArtifactCache(object):
+
+    def test_miss(self, cache, tmpdir):
+        dest = str(tmpdir.join('dest'))
+        assert not cache.get('ceph', '12.2.4-1redhat1', 'amd64', 'abc', dest)
+        assert not os.path.exists(dest)
+
+    def test_hit(self, cache, tmpdir):
+        add(cache, tmpdir, 'abc', 10, 1000)
+        dest = tmpdir.join('dest')
+        assert cache.get('ceph', '12.2.4-1redhat1', 'amd64', 'abc', str(dest))
+        assert dest.read() == 'x' * 10
+        # The hit counts as a use, for LRU eviction.
+        path = cache.path('ceph', '12.2.4-1redhat1', 'amd64', 'abc')
+        assert os.stat(path).st_atime > 1000
+
+    def test_read_only(self, cache, tmpdir):
+        path = add(cache, tmpdir, 'abc', 10, 1000)
+        assert os.stat(path).st_mode & 0o777 == 0o444
+        dest = tmpdir.join('dest')
+        cache.get('ceph', '12.2.4-1redhat1', 'amd64', 'abc', str(dest))
+        # The user's copy is theirs to change.
+        assert os.access(str(dest), os.W_OK)
+
+    def test_changed(self, cache, tmpdir):
+        path = add(cache, tmpdir, 'abc', 10, 1000)
+        os.chmod(path, 0o644)
+        with open(path, 'a') as fp:
+            fp.write('corrupted')
+        dest = tmpdir.join('dest')
+        assert not cache.get('ceph', '12.2.4-1redhat1', 'amd64', 'abc',
+                             str(dest))
+        assert not dest.check()
+        # We evicted it.
+        assert cache.entries() == []
+        assert os.listdir(cache.root) == []
+
+    def test_no_stamp(self, cache, tmpdir):
+        path = add(cache, tmpdir, 'abc', 10, 1000)
+        os.remove(path + '.stamp')
+        dest = tmpdir.join('dest')
+        assert not cache.get('ceph', '12.2.4-1redhat1', 'amd64', 'abc',
+                             str(dest))
+
+    def test_prune_lru(self, cache, tmpdir):
+        oldest = add(cache, tmpdir, 'a', 40, 1000)
+        middle = add(cache, tmpdir, 'b', 40, 2000)
+        newest = add(cache, tmpdir, 'c', 40, 3000)
+        assert cache.size() == 120
+        assert cache.prune() == [oldest]
+        assert os.path.exists(middle)
+        assert os.path.exists(newest)
+
+    def test_prune_all(self, cache, tmpdir):
+        add(cache, tmpdir, 'a', 40, 1000)
+        assert len(cache.prune(0)) == 1
+        assert cache.entries() == []
+        # Empty directories are cleaned up too.
+        assert os.listdir(cache.root) == []
+
+
+class TestCacheCommand(object):
+
+    def test_summary(self, capsys):
+        cache = Cache(['rhcephpkg'])
+        cache.main()
+        out, _ = capsys.readouterr()
+        assert '0 artifacts, 0 B of 10.0 GiB' in out
+
+    def test_bad_action(self, capsys):
+        cache = Cache(['rhcephpkg', 'frobnicate'])
+        with pytest.raises(SystemExit):
+            cache.main()
+        out, _ = capsys.readouterr()
+        assert out == cache._help + "\n"
+
+    def test_bad_max_size(self):
+        cache = Cache(['rhcephpkg', 'prune', '--max-size', 'lots'])
+        with pytest.raises(SystemExit) as e:
+            cache.main()
+        assert 'Specify a size to --max-size' in str(e.value)
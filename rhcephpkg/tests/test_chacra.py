@@ -0,0 +1,93 @@
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.tests.util import FakeChacraAdapter
+
+
+class RecordingAdapter(FakeChacraAdapter):
+    """ Record the status code of each response we send. """
+    statuses = []
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        RecordingAdapter.statuses.append(response.status_code)
+        return response
+
+
+@pytest.fixture
+def recording_chacra(monkeypatch):
+    RecordingAdapter.statuses = []
+    monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', RecordingAdapter)
+    return RecordingAdapter
+
+
+class TestChacraClient(object):
+
+    def test_base_url_from_config(self):
+        client = ChacraClient()
+        assert client.base_url == 'https://chacra.example.com/'
+
+    def test_url(self):
+        client = ChacraClient('https://chacra.example.com/')
+        url = client.url('ceph', '10.2.0-2redhat1trusty', 'ubuntu', 'all')
+        expected = 'https://chacra.example.com/binaries/ceph/' \
+                   '10.2.0-2redhat1trusty/ubuntu/all'
+        assert url == expected
+
+    def test_one_pool(self):
+        client = ChacraClient(pool_size=8)
+        http = client.session.get_adapter('http://chacra.example.com/')
+        https = client.session.get_adapter('https://chacra.example.com/')
+        assert http is https
+        assert http._pool_maxsize == 8
+
+    def test_builds(self, fake_chacra):
+        client = ChacraClient()
+        builds = client.builds('ceph-ansible')
+        assert sorted(builds) == ['3.0.14-2redhat1', '3.0.16-2redhat1']
+
+    def test_missing(self, fake_chacra):
+        client = ChacraClient()
+        with pytest.raises(HTTPError):
+            client.builds('nonexistent')
+
+    def test_open_range(self, fake_chacra):
+        client = ChacraClient()
+        binary = 'libcephfs-java_10.2.0-2redhat1trusty_all.deb'
+        url = client.url('ceph', '10.2.0-2redhat1trusty', 'ubuntu', 'all',
+                         'noarch', binary)
+        response = client.open(url, offset=10)
+        assert response.status_code == 206
+        assert response.request.headers['Range'] == 'bytes=10-'
+        assert response.request.headers['Accept-Encoding'] == 'identity'
+        response.close()
+
+
+class TestResponseCache(object):
+
+    def test_not_modified(self, recording_chacra):
+        ChacraClient(ttl=0).builds('ceph-ansible')
+        builds = ChacraClient(ttl=0).builds('ceph-ansible')
+        assert sorted(builds) == ['3.0.14-2redhat1', '3.0.16-2redhat1']
+        assert recording_chacra.statuses == [200, 304]
+
+    def test_ttl(self, recording_chacra):
+        ChacraClient(ttl=60).builds('ceph-ansible')
+        builds = ChacraClient(ttl=60).builds('ceph-ansible')
+        assert sorted(builds) == ['3.0.14-2redhat1', '3.0.16-2redhat1']
+        assert recording_chacra.statuses == [200]
+
+    def test_refresh(self, recording_chacra):
+        ChacraClient(ttl=60).builds('ceph-ansible')
+        ChacraClient(ttl=60, refresh=True).builds('ceph-ansible')
+        assert recording_chacra.statuses == [200, 200]
+
+    def test_offline(self, fake_chacra, monkeypatch):
+        ChacraClient(ttl=0).builds('ceph-ansible')
+
+        class OfflineAdapter(FakeChacraAdapter):
+            def send(self, request, **kwargs):
+                raise ConnectionError('network is unreachable')
+        monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', OfflineAdapter)
+        builds = ChacraClient(ttl=0).builds('ceph-ansible')
+        assert sorted(builds) == ['3.0.14-2redhat1', '3.0.16-2redhat1']
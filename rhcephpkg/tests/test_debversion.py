@@ -0,0 +1,136 @@
+import subprocess
+try:
+    from shutil import which  # py3
+except ImportError:
+    from distutils.spawn import find_executable as which
+import pytest
+from rhcephpkg.debversion import compare_versions
+from rhcephpkg.debversion import newest
+from rhcephpkg.debversion import parse_version
+from rhcephpkg.debversion import version_key
+from rhcephpkg.debversion import version_sort_key
+
+
+# Pairs of (lower, higher) versions, according to dpkg.
+ORDERED = [
+    ('1.0', '1.1'),
+    ('1.0', '1.0.1'),
+    ('1.0~rc1', '1.0'),
+    ('1.0~~', '1.0~'),
+    ('1.0~', '1.0'),
+    ('1.0', '1.0a'),
+    ('1.0a', '1.0+'),
+    ('1.0a', '1.0.'),
+    ('1.0', '1:0.1'),
+    ('2:1.0', '10:0.1'),
+    ('1.0-1', '1.0-2'),
+    ('1.0-9', '1.0-10'),
+    ('1.0-1~bpo1', '1.0-1'),
+    ('1.0', '1.0-1'),
+    ('1.9', '1.10'),
+    ('12.2.4', '12.2.4-1redhat1'),
+    ('10.2.0-2redhat1trusty', '10.2.0-2redhat1xenial'),
+    ('10.2.0-2redhat1xenial', '10.2.0-3redhat1trusty'),
+    ('3.0.14-2redhat1', '3.0.16-2redhat1'),
+    ('3.0.9-1redhat1', '3.0.14-2redhat1'),
+    ('12.2.4-1redhat1', '12.2.4-10redhat1'),
+    ('12.2.4-0.1redhat1', '12.2.4-1redhat1'),
+    ('12.2.4-4.0.bz123redhat1', '12.2.4-4.1redhat1'),
+    ('1.0~rc1-1', '1.0-0'),
+    ('a', 'b'),
+    ('', 'a'),
+    ('0~', '0'),
+    ('~', ''),
+]
+
+EQUAL = [
+    ('1.0', '1.0'),
+    ('1.0', '0:1.0'),
+    ('1.0', '1.0-0'),
+    ('1.01', '1.1'),
+    ('1.0-0', '1.0-00'),
+]
+
+
+class TestParseVersion(object):
+
+    @pytest.mark.parametrize('version,expected', [
+        ('10.2.0', (0, '10.2.0', '')),
+        ('10.2.0-2redhat1', (0, '10.2.0', '2redhat1')),
+        ('1:10.2.0-2redhat1', (1, '10.2.0', '2redhat1')),
+        ('1.0-rc1-2', (0, '1.0-rc1', '2')),
+        ('1:2:3', (1, '2:3', '')),
+    ])
+    def test_parse(self, version, expected):
+        assert parse_version(version) == expected
+
+    def test_bad_epoch(self):
+        with pytest.raises(ValueError):
+            parse_version('a:1.0')
+
+
+class TestCompareVersions(object):
+
+    @pytest.mark.parametrize('lower,higher', ORDERED)
+    def test_ordered(self, lower, higher):
+        assert compare_versions(lower, higher) < 0
+        assert compare_versions(higher, lower) > 0
+
+    @pytest.mark.parametrize('a,b', EQUAL)
+    def test_equal(self, a, b):
+        assert compare_versions(a, b) == 0
+        assert version_key(a) == version_key(b)
+
+    def test_sorted(self):
+        versions = ['1.0', '1.0~rc1', '1:0.1', '1.0-1', '0.9', '1.0+dfsg']
+        expected = ['0.9', '1.0~rc1', '1.0', '1.0-1', '1.0+dfsg', '1:0.1']
+        assert sorted(versions, key=version_key) == expected
+
+
+class TestNewest(object):
+
+    versions = ['1.0', '1.0~rc1', '1:0.1', '1.0-1', '0.9', '1.0+dfsg']
+
+    def test_newest(self):
+        assert newest(self.versions) == ['1:0.1']
+
+    def test_count(self):
+        assert newest(self.versions, 3) == ['1.0-1', '1.0+dfsg', '1:0.1']
+
+    def test_too_few(self):
+        assert newest(iter(['1.0', '0.9']), 5) == ['0.9', '1.0']
+        assert newest([]) == []
+
+
+class TestVersionSortKey(object):
+
+    @pytest.mark.parametrize('lower,higher', ORDERED)
+    def test_ordered(self, lower, higher):
+        assert version_sort_key(lower) < version_sort_key(higher)
+
+    @pytest.mark.parametrize('a,b', EQUAL)
+    def test_equal(self, a, b):
+        assert version_sort_key(a) == version_sort_key(b)
+
+    def test_large_numbers(self):
+        assert version_sort_key('1.99999999999999999999') > \
+            version_sort_key('1.9999')
+
+
+@pytest.mark.skipif(not which('dpkg'), reason='dpkg is missing')
+class TestDpkgParity(object):
+    """ Verify that our ordering matches the real dpkg. """
+
+    def dpkg_compare(self, a, b):
+        for op, result in (('lt', -1), ('eq', 0), ('gt', 1)):
+            cmd = ['dpkg', '--compare-versions', a, op, b]
+            if subprocess.call(cmd) == 0:
+                return result
+        raise RuntimeError('dpkg could not compare %s and %s' % (a, b))
+
+    @pytest.mark.parametrize('a,b', [
+        pair for pair in ORDERED + EQUAL if pair[0] and pair[1]
+    ])
+    def test_parity(self, a, b):
+        assert compare_versions(a, b) == self.dpkg_compare(a, b)
+        assert compare_versions(b, a) == self.dpkg_compare(b, a)
@@ -1,12 +1,21 @@
+from multiprocessing.pool import ThreadPool
 import os
+import time
+import pytest
+from requests.exceptions import ConnectionError
 from rhcephpkg import Download
-from rhcephpkg.tests.util import fake_urlopen
+from rhcephpkg.download import Artifact, DOWNLOADED
+from rhcephpkg.tests.util import CallRecorder, FakeChacraAdapter
+
+
+def contents(binary):
+    """ Return the contents of our fake chacra binary fixture files. """
+    return '(fake binary file contents: %s)\n' % binary
 
 
 class TestDownload(object):
 
-    def test_basic_download(self, monkeypatch, tmpdir):
-        monkeypatch.setattr('rhcephpkg.download.urlopen', fake_urlopen)
+    def test_basic_download(self, fake_chacra, monkeypatch, tmpdir):
         monkeypatch.chdir(tmpdir)
         download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
         download.main()
@@ -23,3 +32,285 @@ class TestDownload(object):
         ]
         for binary in expected:
             assert os.path.isfile(binary)
+
+    def test_parallel_download(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', '--jobs', '2',
+                             'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert len(tmpdir.listdir()) == 9
+
+    def test_bad_jobs(self):
+        download = Download(['rhcephpkg', '--jobs', 'many',
+                             'ceph_10.2.0-2redhat1trusty'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert 'Specify a positive number to --jobs' in str(e.value)
+
+    def test_one_failure(self, monkeypatch, tmpdir):
+        class FlakyAdapter(FakeChacraAdapter):
+            def send(self, request, **kwargs):
+                if 'radosgw' in request.url:
+                    raise ConnectionError('connection reset')
+                return super(FlakyAdapter, self).send(request, **kwargs)
+        monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', FlakyAdapter)
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert str(e.value) == '1 of 9 artifacts failed to download'
+        assert not os.path.exists('radosgw_10.2.0-2redhat1trusty_amd64.deb')
+        assert os.path.isfile('ceph_10.2.0-2redhat1trusty_amd64.deb')
+
+    def test_interrupted(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        fetched = []
+
+        def fetch(self, artifact):
+            fetched.append(artifact)
+            time.sleep(0.05)
+            return (artifact, DOWNLOADED, 0)
+
+        class InterruptedPool(ThreadPool):
+            """ Pretend that the user hits Ctrl-C after one result. """
+            def imap_unordered(self, func, iterable):
+                results = ThreadPool.imap_unordered(self, func, iterable)
+                next(results)
+                raise KeyboardInterrupt()
+        monkeypatch.setattr(Download, '_fetch', fetch)
+        monkeypatch.setattr('rhcephpkg.download.ThreadPool', InterruptedPool)
+        download = Download(['rhcephpkg', '--jobs', '1',
+                             'ceph_10.2.0-2redhat1trusty'])
+        with pytest.raises(KeyboardInterrupt):
+            download.main()
+        # We did not wait for the rest of the queued artifacts.
+        assert len(fetched) < 9
+        assert download.stopping.is_set()
+
+    def test_repeated_build(self, fake_chacra, monkeypatch, tmpdir, capsys):
+        monkeypatch.chdir(tmpdir)
+        fetched = []
+        real_fetch = Download._fetch
+
+        def fetch(self, artifact):
+            fetched.append(artifact.name)
+            return real_fetch(self, artifact)
+        monkeypatch.setattr(Download, '_fetch', fetch)
+        download = Download(['rhcephpkg', '--jobs', '8',
+                             'ceph_10.2.0-2redhat1trusty',
+                             'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert len(fetched) == 9
+        assert len(set(fetched)) == 9
+        assert len(tmpdir.listdir()) == 9
+
+    def test_shared_filename(self, caplog):
+        def artifact(version, name, checksum):
+            return Artifact('ceph', version, 'source', name, None, checksum,
+                            None)
+        artifacts = [
+            artifact('10.2.0-2redhat1trusty', 'ceph_10.2.0.orig.tar.gz', 'a'),
+            artifact('10.2.0-2redhat1trusty', 'ceph.dsc', 'b'),
+            artifact('10.2.0-2redhat1xenial', 'ceph_10.2.0.orig.tar.gz', 'a'),
+            artifact('10.2.0-2redhat1xenial', 'ceph.dsc', 'c'),
+        ]
+        kept = Download([]).unique(artifacts)
+        assert kept == artifacts[:2]
+        # Only the files that really differ are worth a warning.
+        assert 'different files named ceph.dsc' in caplog.text
+        assert 'orig.tar.gz' not in caplog.text
+
+    def test_resume_partial(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        binary = 'radosgw_10.2.0-2redhat1trusty_amd64.deb'
+        tmpdir.join(binary + '.part').write('(fake bin')
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.join(binary).read() == contents(binary)
+        assert not tmpdir.join(binary + '.part').exists()
+
+    def test_resume_unsupported(self, monkeypatch, tmpdir):
+        class NoRangeAdapter(FakeChacraAdapter):
+            # Behave like a server that ignores our Range header.
+            def send(self, request, **kwargs):
+                request.headers.pop('Range', None)
+                return super(NoRangeAdapter, self).send(request, **kwargs)
+        monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', NoRangeAdapter)
+        monkeypatch.chdir(tmpdir)
+        binary = 'radosgw_10.2.0-2redhat1trusty_amd64.deb'
+        tmpdir.join(binary + '.part').write('garbage')
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.join(binary).read() == contents(binary)
+
+    def test_oversized_partial(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        binary = 'radosgw_10.2.0-2redhat1trusty_amd64.deb'
+        tmpdir.join(binary + '.part').write('x' * 100)
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.join(binary).read() == contents(binary)
+
+    def test_corrupt_existing_file(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        binary = 'radosgw_10.2.0-2redhat1trusty_amd64.deb'
+        tmpdir.join(binary).write(contents(binary).upper())
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.join(binary).read() == contents(binary)
+
+    def test_cached_digest(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        # A second run trusts the digests we recorded during the first run.
+        recorder = CallRecorder()
+        monkeypatch.setattr('rhcephpkg.download.file_digest', recorder)
+        download.main()
+        assert recorder.called == 0
+
+    def test_corrupt_partial(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        binary = 'radosgw_10.2.0-2redhat1trusty_amd64.deb'
+        tmpdir.join(binary + '.part').write('(fake BIN')
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.join(binary).read() == contents(binary)
+
+    def test_checksum_mismatch(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.setattr('rhcephpkg.download.CHECKSUM_ALGORITHM', 'md5')
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert str(e.value) == '9 of 9 artifacts failed to download'
+        assert tmpdir.listdir() == []
+
+    def test_shared_cache(self, monkeypatch, tmpdir):
+        recorder = CallRecorder()
+
+        class CountingAdapter(FakeChacraAdapter):
+            def send(self, request, **kwargs):
+                if request.url.endswith('.deb/'):
+                    recorder()
+                return super(CountingAdapter, self).send(request, **kwargs)
+        monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', CountingAdapter)
+        for directory in ('first', 'second'):
+            monkeypatch.chdir(tmpdir.mkdir(directory))
+            download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+            download.main()
+            assert len(os.listdir('.')) == 9
+        # The second directory came entirely from the local cache.
+        assert recorder.called == 5
+
+    def test_edited_copy(self, fake_chacra, monkeypatch, tmpdir):
+        # Editing a downloaded file in place (eg. signing it) must not
+        # change what other download directories get from the cache.
+        binary = 'ceph_10.2.0-2redhat1trusty_amd64.deb'
+        for directory in ('first', 'second'):
+            monkeypatch.chdir(tmpdir.mkdir(directory))
+            download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty'])
+            download.main()
+            assert open(binary).read() == contents(binary)
+            with open(binary, 'a') as fp:
+                fp.write('signed')
+
+    def test_arch_filter(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', '--arch', 'noarch,source',
+                             'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert len(tmpdir.listdir()) == 5
+        assert not os.path.exists('ceph_10.2.0-2redhat1trusty_amd64.deb')
+
+    def test_include_exclude(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', '--include', '*.deb',
+                             '--exclude', '*-dbg_*,*-java_*',
+                             'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        expected = [
+            'ceph_10.2.0-2redhat1trusty_amd64.deb',
+            'radosgw_10.2.0-2redhat1trusty_amd64.deb',
+        ]
+        assert sorted(os.listdir('.')) == expected
+
+    def test_dry_run(self, fake_chacra, monkeypatch, tmpdir, capsys):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', '--dry-run', '--arch', 'amd64',
+                             '--exclude', '*-dbg_*',
+                             'ceph_10.2.0-2redhat1trusty'])
+        download.main()
+        assert tmpdir.listdir() == []
+        out, _ = capsys.readouterr()
+        expected = """
+      66 B  amd64/ceph_10.2.0-2redhat1trusty_amd64.deb
+      69 B  amd64/radosgw_10.2.0-2redhat1trusty_amd64.deb
+2 artifacts, 135 B
+""".lstrip('\n')
+        assert out == expected
+
+    def test_missing_filter(self):
+        download = Download(['rhcephpkg', 'ceph_10.2.0-2redhat1trusty',
+                             '--exclude'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert 'Specify a comma-separated list to --exclude' in str(e.value)
+
+    def test_manifest(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        manifest = tmpdir.join('builds.txt')
+        manifest.write('# builds to ship\n\nceph_10.2.0-2redhat1trusty\n')
+        download = Download(['rhcephpkg', '--manifest', str(manifest)])
+        download.main()
+        assert len(tmpdir.listdir()) == 10
+
+    def test_many_builds(self, fake_chacra, monkeypatch, tmpdir, capsys):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', '--arch', 'amd64',
+                             'ceph_10.2.0-2redhat1trusty',
+                             'ceph_99.0.0-1redhat1'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert str(e.value) == \
+            'could not find ceph_99.0.0-1redhat1 in chacra'
+        # The build that does exist was downloaded anyway.
+        assert len(tmpdir.listdir()) == 4
+        out, _ = capsys.readouterr()
+        expected = """
+build                       downloaded      cached     skipped      failed
+ceph_10.2.0-2redhat1trusty           4           0           0           0
+ceph_99.0.0-1redhat1                 0           0           0           0
+""".lstrip('\n')
+        assert out == expected
+
+    def test_latest(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', 'ceph', '--latest',
+                             '--prefix', '10.2.'])
+        download.main()
+        assert len(tmpdir.listdir()) == 9
+
+    def test_latest_no_match(self, fake_chacra, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        download = Download(['rhcephpkg', 'ceph', '--latest',
+                             '--prefix', '12.'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert str(e.value) == 'no builds of ceph match "12."'
+        assert tmpdir.listdir() == []
+
+    def test_latest_no_builds(self, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        monkeypatch.setattr('rhcephpkg.chacra.ChacraClient.builds',
+                            lambda self, pkg: {})
+        download = Download(['rhcephpkg', 'ceph', '--latest'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert str(e.value) == 'ceph has no builds in chacra'
+
+    def test_prefix_without_latest(self):
+        download = Download(['rhcephpkg', 'ceph', '--prefix', '10.2.'])
+        with pytest.raises(SystemExit) as e:
+            download.main()
+        assert '--prefix only makes sense with --latest' in str(e.value)
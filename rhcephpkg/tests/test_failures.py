@@ -0,0 +1,56 @@
+from rhcephpkg.failures import FailureScanner, failure_patterns
+import pytest
+
+
+class TestFailurePatterns(object):
+
+    def test_defaults(self):
+        assert 'compiler' in failure_patterns()
+
+    def test_configured(self, monkeypatch, tmpdir):
+        monkeypatch.setenv('HOME', str(tmpdir))
+        tmpdir.join('.rhcephpkg.conf').write(
+            '[rhcephpkg.failures]\n'
+            'oom = Killed signal terminated program\n'
+            'linker =\n')
+        patterns = failure_patterns()
+        assert 'oom' in patterns
+        assert 'linker' not in patterns
+
+    def test_invalid(self, monkeypatch, tmpdir):
+        monkeypatch.setenv('HOME', str(tmpdir))
+        tmpdir.join('.rhcephpkg.conf').write(
+            '[rhcephpkg.failures]\nbroken = (\n')
+        with pytest.raises(SystemExit) as e:
+            failure_patterns()
+        assert '[rhcephpkg.failures] broken' in str(e.value)
+
+
+class TestFailureScanner(object):
+
+    @pytest.mark.parametrize('line,name', [
+        ('src/osd/OSD.cc:123:5: error: expected ";"', 'compiler'),
+        ('make[2]: *** [src/CMakeFiles/osd.dir/all] Error 2', 'make'),
+        ('dpkg-buildpackage: error: debian/rules build returned exit code 2',
+         'dpkg'),
+        ('collect2: error: ld returned 1 exit status', 'linker'),
+    ])
+    def test_defaults(self, line, name):
+        scanner = FailureScanner()
+        assert scanner.feed(line + '\n') == [(name, line)]
+
+    def test_clean(self):
+        scanner = FailureScanner()
+        assert scanner.feed('Scanning dependencies of target osd\n'
+                            '-- Looking for error.h - found\n') == []
+
+    def test_split_line(self):
+        scanner = FailureScanner()
+        assert scanner.feed('dpkg-source: err') == []
+        assert scanner.feed('or: unrepresentable changes\n') == [
+            ('dpkg', 'dpkg-source: error: unrepresentable changes')]
+
+    def test_first_match_only(self):
+        scanner = FailureScanner()
+        text = 'a.cc:1:1: error: one\r\nb.cc:2:2: error: two\n'
+        assert scanner.feed(text) == [('compiler', 'a.cc:1:1: error: one')]
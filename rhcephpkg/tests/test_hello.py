@@ -21,7 +21,7 @@ class TestHelloJenkins(object):
 
     def test_success(self, monkeypatch, capsys):
         monkeypatch.setattr('jenkins.Jenkins.get_whoami',
-                            lambda x: {'fullName': 'Ken'})
+                            lambda x, depth=0: {'fullName': 'Ken'})
         monkeypatch.setattr('jenkins.Jenkins.get_version', lambda x: '1.5')
         hello = Hello([])
         hello._run()
@@ -29,3 +29,16 @@ class TestHelloJenkins(object):
         expected = "Hello Ken from Jenkins 1.5\n" \
                    "Logged in to https://ceph-jenkins.example.com/\n"
         assert out == expected
+
+    def test_shared_connection(self, monkeypatch, capsys):
+        recorder = CallRecorder()
+
+        def get_whoami(self, depth=0):
+            recorder()
+            return {'fullName': 'Ken', 'id': 'kdreyer'}
+        monkeypatch.setattr('jenkins.Jenkins.get_whoami', get_whoami)
+        monkeypatch.setattr('jenkins.Jenkins.get_version', lambda x: '1.5')
+        Hello([])._run()
+        Hello([])._run()
+        # Both commands used the same connection and its cached whoami.
+        assert recorder.called == 1
@@ -0,0 +1,121 @@
+from rhcephpkg.history import BuildHistory, expected_duration
+from rhcephpkg.history import percentile, record_build
+import pytest
+
+
+def build_info(pkg, timestamp, duration, result='SUCCESS'):
+    return {
+        'actions': [{'parameters': [{'name': 'PKG_NAME', 'value': pkg},
+                                    {'name': 'BRANCH',
+                                     'value': 'ceph-3.0-xenial'}]}],
+        'building': False,
+        'timestamp': timestamp * 1000,
+        'duration': duration * 1000,
+        'result': result,
+    }
+
+
+@pytest.fixture
+def history():
+    history = BuildHistory()
+    yield history
+    history.close()
+
+
+class TestPercentile(object):
+
+    @pytest.mark.parametrize('fraction,expected', [
+        (0.5, 5),
+        (0.95, 10),
+        (0.1, 1),
+        (0, 1),
+    ])
+    def test_nearest_rank(self, fraction, expected):
+        values = [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
+        assert percentile(values, fraction) == expected
+
+    def test_empty(self):
+        assert percentile([], 0.5) is None
+
+
+class TestBuildHistory(object):
+
+    def test_record(self, history):
+        history.record(10, build_info('ceph', 1000, 600), queued=940)
+        assert history.builds() == [
+            ('ceph', 'ceph-3.0-xenial', 1000, 60, 600, 'SUCCESS'),
+        ]
+
+    def test_keeps_queue_wait(self, history):
+        history.record(10, build_info('ceph', 1000, 600), queued=940)
+        # eg. "watch-build 10" later, without knowing the queue time.
+        history.record(10, build_info('ceph', 1000, 600))
+        assert history.builds()[0][3] == 60
+
+    def test_filters(self, history):
+        history.record(10, build_info('ceph', 1000, 600))
+        history.record(11, build_info('ceph-ansible', 2000, 60))
+        history.record(12, build_info('ceph', 3000, 600, 'FAILURE'))
+        assert [b[0] for b in history.builds()] == \
+            ['ceph', 'ceph-ansible', 'ceph']
+        assert [b[2] for b in history.builds(['ceph'])] == [1000, 3000]
+        assert [b[2] for b in history.builds(since=2000)] == [2000, 3000]
+
+
+class TestRecordBuild(object):
+
+    def test_finished(self):
+        record_build(10, build_info('ceph', 1000, 600))
+        history = BuildHistory()
+        assert len(history.builds()) == 1
+        history.close()
+
+    def test_still_building(self):
+        info = build_info('ceph', 1000, 0, result=None)
+        info['building'] = True
+        record_build(10, info)
+        history = BuildHistory()
+        assert history.builds() == []
+        history.close()
+
+
+class FakeJenkins(object):
+    def __init__(self, builds):
+        self.builds = builds
+        self.queried = 0
+
+    def recent_builds(self, name, count):
+        self.queried += 1
+        return self.builds
+
+
+def recent_build(number, pkg, duration, result='SUCCESS'):
+    return {'number': number, 'result': result, 'duration': duration * 1000,
+            'actions': [{'parameters': [{'name': 'PKG_NAME',
+                                         'value': pkg}]}]}
+
+
+class TestDurations(object):
+
+    def test_refresh(self, history):
+        jenkins = FakeJenkins([recent_build(3, 'ceph', 300),
+                               recent_build(2, 'ceph', 200, 'FAILURE'),
+                               recent_build(1, 'ceph-ansible', 60)])
+        history.refresh_durations(jenkins)
+        history.record(4, build_info('ceph', 1000, 400))
+        assert history.durations('ceph') == [400, 300]
+        assert history.durations('ceph-ansible') == [60]
+
+    def test_cached(self, history):
+        jenkins = FakeJenkins([])
+        history.refresh_durations(jenkins)
+        history.refresh_durations(jenkins)
+        assert jenkins.queried == 1
+        history.refresh_durations(jenkins, ttl=0)
+        assert jenkins.queried == 2
+
+    def test_expected_duration(self):
+        jenkins = FakeJenkins([recent_build(n, 'ceph', n * 100)
+                               for n in range(1, 6)])
+        assert expected_duration(jenkins, 'ceph') == 300
+        assert expected_duration(jenkins, 'ceph-ansible') is None
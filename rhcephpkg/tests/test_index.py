@@ -0,0 +1,153 @@
+import posixpath
+import threading
+import pytest
+from requests.exceptions import HTTPError
+from rhcephpkg.debversion import version_sort_key
+from rhcephpkg.index import BuildIndex, version_distro
+
+
+class FakeClient(object):
+    """ A ChacraClient that answers from a dict of builds. """
+
+    def __init__(self, builds):
+        self.listing = builds
+        self.pool_size = 10
+        self.requests = 0
+
+    def builds(self, package):
+        return dict((version, ['ubuntu']) for version in self.listing)
+
+    def get_json(self, url):
+        self.requests += 1
+        return {'amd64': ['foo_amd64.deb']}
+
+    def url(self, *parts):
+        return posixpath.join('https://chacra.example.com/binaries/', *parts)
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = BuildIndex(str(tmpdir.join('index.sqlite')))
+    yield index
+    index.close()
+
+
+VERSIONS = [
+    '12.2.4-10redhat1xenial',
+    '12.2.4-1redhat1trusty',
+    '12.2.4-1redhat1xenial',
+    '12.2.4~rc1-1redhat1xenial',
+    '10.2.0-2redhat1trusty',
+]
+
+
+class TestDistro(object):
+
+    @pytest.mark.parametrize('version,expected', [
+        ('12.2.4-10redhat1xenial', 'xenial'),
+        ('10.2.0-2redhat1trusty', 'trusty'),
+        ('3.0.16-2redhat1', None),
+    ])
+    def test_version_distro(self, version, expected):
+        assert version_distro(version) == expected
+
+
+class TestBuildIndex(object):
+
+    def test_refresh(self, index):
+        client = FakeClient(VERSIONS)
+        assert sorted(index.refresh('ceph', client)) == sorted(VERSIONS)
+        # Refreshing only needs the list of versions.
+        assert client.requests == 0
+
+    def test_incremental(self, index):
+        client = FakeClient(VERSIONS[1:])
+        index.refresh('ceph', client)
+        client.listing = VERSIONS[:-1]
+        # We add the new build, and forget the removed one.
+        assert index.refresh('ceph', client) == ['12.2.4-10redhat1xenial']
+        assert '10.2.0-2redhat1trusty' not in index.versions('ceph')
+        assert len(index.versions('ceph')) == 4
+
+    def test_binaries(self, index):
+        client = FakeClient(VERSIONS)
+        index.refresh('ceph', client)
+        assert index.binaries('ceph', '10.2.0-2redhat1trusty') == {}
+        assert index.binaries('ceph', '10.2.0-2redhat1trusty', client) == \
+            {'amd64': ['foo_amd64.deb']}
+        # We fetch each build's listing once.
+        index.binaries('ceph', '10.2.0-2redhat1trusty', client)
+        assert client.requests == 1
+
+    def test_index_binaries(self, index):
+        client = FakeClient(VERSIONS)
+        index.refresh('ceph', client)
+        assert sorted(index.index_binaries('ceph', client)) == \
+            sorted(VERSIONS)
+        assert index.index_binaries('ceph', client) == []
+        assert client.requests == 5
+
+    def test_unavailable_build(self, index):
+        client = FakeClient(VERSIONS)
+
+        def get_json(url):
+            raise HTTPError('404 Not Found')
+        client.get_json = get_json
+        index.refresh('ceph', client)
+        assert index.index_binaries('ceph', client) == []
+        # We retry the builds next time.
+        client = FakeClient(VERSIONS)
+        assert len(index.index_binaries('ceph', client)) == 5
+
+    def test_concurrent_refresh(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join('index.sqlite'))
+        arrived = set()
+        both = threading.Event()
+
+        def sort_key(version):
+            # Make both refreshes read the index before either writes.
+            arrived.add(threading.current_thread().ident)
+            if len(arrived) == 2:
+                both.set()
+            both.wait(5)
+            return version_sort_key(version)
+        monkeypatch.setattr('rhcephpkg.index.version_sort_key', sort_key)
+        errors = []
+
+        def refresh():
+            index = BuildIndex(path)
+            try:
+                index.refresh('ceph', FakeClient(VERSIONS))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                index.close()
+        threads = [threading.Thread(target=refresh) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        index = BuildIndex(path)
+        assert len(index.versions('ceph')) == 5
+        index.close()
+
+    def test_versions(self, index):
+        index.refresh('ceph', FakeClient(VERSIONS))
+        expected = [
+            '10.2.0-2redhat1trusty',
+            '12.2.4~rc1-1redhat1xenial',
+            '12.2.4-1redhat1trusty',
+            '12.2.4-1redhat1xenial',
+            '12.2.4-10redhat1xenial',
+        ]
+        assert index.versions('ceph') == expected
+        assert index.versions('ceph', since='12.2.4') == expected[2:]
+        assert index.versions('ceph', latest=2) == expected[3:]
+        assert index.versions('ceph', distro='trusty') == \
+            [expected[0], expected[2]]
+        assert index.versions('ceph', latest=1, distro='trusty') == \
+            [expected[2]]
+        assert index.versions('ceph', prefix='12.2.4-1') == \
+            [expected[2], expected[3], expected[4]]
+        assert index.versions('ceph-ansible') == []
@@ -0,0 +1,96 @@
+import json
+from jenkins import NotFoundException
+import pytest
+from requests import Request, Response
+from requests.structures import CaseInsensitiveDict
+from rhcephpkg.jenkins_api import JenkinsSession, JenkinsUnavailable
+from rhcephpkg.jenkins_api import BUILD_TREE, QUEUE_TREE
+
+
+class FakeJenkinsServer(object):
+    """ Record each request, and answer with a JSON body. """
+
+    def __init__(self, body, headers=None):
+        self.body = body
+        self.headers = headers or {}
+        self.urls = []
+
+    def jenkins_request(self, req, add_crumb=True, resolve_auth=True,
+                        stream=None):
+        self.urls.append(req.url)
+        response = Response()
+        response.status_code = 200
+        response._content = json.dumps(self.body).encode('utf-8')
+        response.headers = CaseInsensitiveDict(self.headers)
+        return response
+
+
+def session(monkeypatch, body, headers=None):
+    server = FakeJenkinsServer(body, headers)
+    monkeypatch.setattr('jenkins.Jenkins.jenkins_request',
+                        lambda self, *a, **kw: server.jenkins_request(*a,
+                                                                      **kw))
+    return (JenkinsSession('https://jenkins.example.com/'), server)
+
+
+class TestJenkinsSession(object):
+
+    def test_build_status(self, monkeypatch):
+        body = {'building': True, 'timestamp': 1}
+        (jenkins, server) = session(monkeypatch, body)
+        assert jenkins.build_status('build-package', 123) == body
+        assert server.urls == [
+            'https://jenkins.example.com/job/build-package/123/api/json'
+            '?tree=' + BUILD_TREE]
+
+    def test_queue_status(self, monkeypatch):
+        (jenkins, server) = session(monkeypatch, {'why': 'waiting'})
+        assert jenkins.queue_status(5) == {'why': 'waiting'}
+        assert server.urls == [
+            'https://jenkins.example.com/queue/item/5/api/json'
+            '?tree=' + QUEUE_TREE]
+
+    def test_job_builds(self, monkeypatch):
+        body = {'builds': [{'number': 1, 'building': False}]}
+        (jenkins, server) = session(monkeypatch, body)
+        assert jenkins.job_builds('build-package') == body['builds']
+
+    def test_transferred(self, monkeypatch):
+        (jenkins, server) = session(monkeypatch, {'building': False})
+        jenkins.build_status('build-package', 1)
+        jenkins.build_status('build-package', 1)
+        assert jenkins.requests == 2
+        assert jenkins.transferred == 2 * len('{"building": false}')
+
+    def test_transferred_compressed(self, monkeypatch):
+        body = {'builds': [{'number': n} for n in range(100)]}
+        headers = {'Content-Encoding': 'gzip', 'Content-Length': '42'}
+        (jenkins, server) = session(monkeypatch, body, headers)
+        jenkins.job_builds('build-package')
+        # We count the compressed bytes, not the decompressed JSON.
+        assert jenkins.transferred == 42
+
+    @pytest.mark.parametrize('status', [500, 502, 503, 504])
+    def test_unavailable(self, monkeypatch, status):
+        def request(self, req, stream=None):
+            response = Response()
+            response.status_code = status
+            response.url = req.url
+            return response
+        monkeypatch.setattr('jenkins.Jenkins._request', request)
+        jenkins = JenkinsSession('https://jenkins.example.com/')
+        req = Request('GET', 'https://jenkins.example.com/api/json')
+        with pytest.raises(JenkinsUnavailable):
+            jenkins.jenkins_request(req, add_crumb=False, resolve_auth=False)
+
+    def test_not_found(self, monkeypatch):
+        def request(self, req, stream=None):
+            response = Response()
+            response.status_code = 404
+            response.url = req.url
+            return response
+        monkeypatch.setattr('jenkins.Jenkins._request', request)
+        jenkins = JenkinsSession('https://jenkins.example.com/')
+        req = Request('GET', 'https://jenkins.example.com/api/json')
+        with pytest.raises(NotFoundException):
+            jenkins.jenkins_request(req, add_crumb=False, resolve_auth=False)
@@ -1,15 +1,17 @@
+import json
+import sqlite3
+import pytest
+from requests.exceptions import ConnectionError
 from rhcephpkg import ListBuilds
-from rhcephpkg.tests.util import fake_urlopen
 
 
 class TestListBuilds(object):
 
     # Note these tests use Python's "sorted()", which is not the same as
-    # gbp.deb.DpkgCompareVersions, but it's good enough for this trivial test
-    # fixture data.
+    # dpkg's version ordering, but it's good enough for this trivial test
+    # fixture data. See test_debversion.py for the real ordering tests.
 
-    def test_list_builds(self, monkeypatch):
-        monkeypatch.setattr('rhcephpkg.list_builds.urlopen', fake_urlopen)
+    def test_list_builds(self, fake_chacra):
         lb = ListBuilds(['rhcephpkg', 'ceph-ansible'])
         versions = lb.list_builds('ceph-ansible')
         expected = [
@@ -27,8 +29,18 @@ class TestListBuilds(object):
         sorted_versions = lb.sort_nvrs(versions)
         assert sorted_versions == sorted(versions)
 
-    def test_main(self, monkeypatch, capsys):
-        monkeypatch.setattr('rhcephpkg.list_builds.urlopen', fake_urlopen)
+    def test_sort_nvrs_dpkg_order(self):
+        lb = ListBuilds(['rhcephpkg', 'ceph'])
+        versions = [
+            '12.2.4-10redhat1xenial',
+            '12.2.4-9redhat1xenial',
+            '12.2.4-1redhat1xenial',
+            '12.2.4~rc1-1redhat1xenial',
+        ]
+        sorted_versions = lb.sort_nvrs(versions)
+        assert sorted_versions == list(reversed(versions))
+
+    def test_main(self, fake_chacra, capsys):
         lb = ListBuilds(['rhcephpkg', 'ceph-ansible'])
         lb.main()
         expected = """
@@ -37,3 +49,111 @@ ceph-ansible_3.0.16-2redhat1
 """.lstrip()
         out, _ = capsys.readouterr()
         assert out == expected
+
+    def test_refresh(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', '--refresh', 'ceph-ansible'])
+        lb.main()
+        assert lb.refresh
+        out, _ = capsys.readouterr()
+        assert out.startswith('ceph-ansible_3.0.14-2redhat1')
+
+    def test_latest(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph-ansible', '--latest', '1'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == 'ceph-ansible_3.0.16-2redhat1\n'
+
+    def test_since(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph-ansible', '--since', '3.0.15'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == 'ceph-ansible_3.0.16-2redhat1\n'
+
+    def test_distro(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph', '--distro', 'trusty'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == 'ceph_10.2.0-2redhat1trusty\n'
+        lb = ListBuilds(['rhcephpkg', 'ceph', '--distro', 'xenial'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == ''
+
+    def test_bad_latest(self):
+        lb = ListBuilds(['rhcephpkg', 'ceph', '--latest', 'all'])
+        with pytest.raises(SystemExit) as e:
+            lb.main()
+        assert 'Specify a positive number to --latest' in str(e.value)
+
+    def test_latest_prefix(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph-ansible', '--latest', '5',
+                         '--prefix', '3.0.14'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == 'ceph-ansible_3.0.14-2redhat1\n'
+
+    def test_prefix(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph-ansible', '--prefix', '3.0.16'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        assert out == 'ceph-ansible_3.0.16-2redhat1\n'
+
+    def test_many_packages(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', 'ceph-ansible', 'ceph'])
+        lb.main()
+        expected = """
+ceph-ansible_3.0.14-2redhat1
+ceph-ansible_3.0.16-2redhat1
+ceph_10.2.0-2redhat1trusty
+""".lstrip()
+        out, _ = capsys.readouterr()
+        assert out == expected
+
+    def test_json(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', '--json', 'ceph-ansible', 'ceph'])
+        lb.main()
+        out, _ = capsys.readouterr()
+        result = sorted(json.loads(out), key=lambda obj: obj['package'])
+        assert result == [
+            {'package': 'ceph', 'builds': ['ceph_10.2.0-2redhat1trusty']},
+            {'package': 'ceph-ansible',
+             'builds': ['ceph-ansible_3.0.14-2redhat1',
+                        'ceph-ansible_3.0.16-2redhat1']},
+        ]
+
+    def test_ndjson(self, fake_chacra, capsys):
+        lb = ListBuilds(['rhcephpkg', '--ndjson', '--latest', '1',
+                         'ceph-ansible', 'nosuchpackage'])
+        with pytest.raises(SystemExit) as e:
+            lb.main()
+        assert str(e.value) == 'could not list builds for nosuchpackage'
+        out, _ = capsys.readouterr()
+        lines = [json.loads(line) for line in out.splitlines()]
+        result = dict((obj['package'], obj) for obj in lines)
+        assert result['ceph-ansible']['builds'] == \
+            ['ceph-ansible_3.0.16-2redhat1']
+        assert '404' in result['nosuchpackage']['error']
+
+    @pytest.mark.parametrize('error', [
+        ConnectionError('connection refused'),
+        sqlite3.OperationalError('database is locked'),
+    ])
+    def test_json_error(self, fake_chacra, monkeypatch, capsys, error):
+        def refresh(self, package, client):
+            if package == 'ceph':
+                raise error
+        monkeypatch.setattr('rhcephpkg.index.BuildIndex.refresh', refresh)
+        lb = ListBuilds(['rhcephpkg', '--json', 'ceph-ansible', 'ceph'])
+        with pytest.raises(SystemExit) as e:
+            lb.main()
+        assert str(e.value) == 'could not list builds for ceph'
+        out, _ = capsys.readouterr()
+        result = dict((obj['package'], obj) for obj in json.loads(out))
+        assert result['ceph'] == {'package': 'ceph', 'error': str(error)}
+        assert 'builds' in result['ceph-ansible']
+
+    def test_one_format(self):
+        lb = ListBuilds(['rhcephpkg', '--json', '--ndjson', 'ceph'])
+        with pytest.raises(SystemExit) as e:
+            lb.main()
+        assert 'Specify only one of --json or --ndjson' in str(e.value)
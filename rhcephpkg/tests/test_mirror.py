@@ -0,0 +1,92 @@
+import json
+import pytest
+from rhcephpkg import Mirror
+from rhcephpkg.cache import ArtifactCache
+from rhcephpkg.mirror import MANIFEST
+from rhcephpkg.tests.util import CallRecorder, FakeChacraAdapter
+
+BUILD = 'ceph_10.2.0-2redhat1trusty'
+
+
+def read_manifest(directory):
+    with open(str(directory.join(MANIFEST))) as fp:
+        return json.load(fp)
+
+
+class TestMirror(object):
+
+    def test_mirror(self, fake_chacra, tmpdir):
+        mirror = Mirror(['rhcephpkg', '--dest', str(tmpdir), 'ceph'])
+        mirror.main()
+        assert len(tmpdir.join(BUILD).listdir()) == 9
+        manifest = read_manifest(tmpdir)
+        assert manifest['package'] == 'ceph'
+        assert list(manifest['builds']) == ['10.2.0-2redhat1trusty']
+        assert len(manifest['builds']['10.2.0-2redhat1trusty']) == 9
+
+    def test_bypass_cache(self, fake_chacra, tmpdir):
+        mirror = Mirror(['rhcephpkg', '--dest', str(tmpdir.join('mirror')),
+                         'ceph'])
+        mirror.main()
+        # We did not fill the per-user artifact cache.
+        assert ArtifactCache().entries() == []
+
+    def test_incremental(self, monkeypatch, tmpdir):
+        recorder = CallRecorder()
+
+        class CountingAdapter(FakeChacraAdapter):
+            def send(self, request, **kwargs):
+                if request.url.endswith('.deb/'):
+                    recorder()
+                return super(CountingAdapter, self).send(request, **kwargs)
+        monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', CountingAdapter)
+        monkeypatch.chdir(tmpdir)
+        Mirror(['rhcephpkg', 'ceph']).main()
+        assert recorder.called == 5
+        # Nothing changed, so we do not even look at the build again.
+        Mirror(['rhcephpkg', 'ceph']).main()
+        assert recorder.called == 5
+        # A missing file makes us look at its build again, but we only fetch
+        # what is missing.
+        tmpdir.join(BUILD, 'radosgw_10.2.0-2redhat1trusty_amd64.deb').remove()
+        Mirror(['rhcephpkg', 'ceph']).main()
+        assert len(tmpdir.join(BUILD).listdir()) == 9
+
+    def test_delete(self, fake_chacra, tmpdir):
+        stale = tmpdir.mkdir('ceph_9.0.0-1redhat1trusty')
+        stale.join('ceph_9.0.0-1redhat1trusty_amd64.deb').write('old')
+        manifest = {'package': 'ceph', 'arch': None, 'builds': {
+            '9.0.0-1redhat1trusty': {
+                'ceph_9.0.0-1redhat1trusty_amd64.deb': 'abc123'}}}
+        tmpdir.join(MANIFEST).write(json.dumps(manifest))
+        Mirror(['rhcephpkg', '--dest', str(tmpdir), 'ceph']).main()
+        # Without --delete, we keep old builds.
+        assert stale.check()
+        assert '9.0.0-1redhat1trusty' in read_manifest(tmpdir)['builds']
+        tmpdir.join(BUILD, 'stray.txt').write('stray')
+        Mirror(['rhcephpkg', '--dest', str(tmpdir), '--delete',
+                '--arch', 'source', 'ceph']).main()
+        assert not stale.check()
+        assert list(read_manifest(tmpdir)['builds']) == \
+            ['10.2.0-2redhat1trusty']
+        assert len(tmpdir.join(BUILD).listdir()) == 4
+
+    def test_dry_run(self, fake_chacra, tmpdir, capsys):
+        Mirror(['rhcephpkg', '--dest', str(tmpdir), '--dry-run',
+                'ceph']).main()
+        assert not tmpdir.join(BUILD).check()
+        out, _ = capsys.readouterr()
+        assert out.startswith('fetch   %s (9 artifacts, ' % BUILD)
+
+    def test_other_package(self, fake_chacra, tmpdir):
+        tmpdir.join(MANIFEST).write(json.dumps({'package': 'ceph-ansible'}))
+        mirror = Mirror(['rhcephpkg', '--dest', str(tmpdir), 'ceph'])
+        with pytest.raises(SystemExit) as e:
+            mirror.main()
+        assert 'is a mirror of ceph-ansible, not ceph' in str(e.value)
+
+    def test_no_package(self, capsys):
+        with pytest.raises(SystemExit):
+            Mirror(['rhcephpkg']).main()
+        out, _ = capsys.readouterr()
+        assert 'Mirror every build of a package' in out
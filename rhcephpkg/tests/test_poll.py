@@ -0,0 +1,85 @@
+import pytest
+from rhcephpkg.poll import CircuitBreaker, PollScheduler, poll_config
+
+
+@pytest.fixture
+def scheduler():
+    return PollScheduler(min_interval=2, max_interval=30, backoff=2, jitter=0)
+
+
+class TestPollConfig(object):
+
+    def test_defaults(self):
+        assert poll_config()['min_interval'] == 2.0
+
+    def test_configured(self, monkeypatch, tmpdir):
+        monkeypatch.setenv('HOME', str(tmpdir))
+        tmpdir.join('.rhcephpkg.conf').write(
+            '[rhcephpkg.poll]\nmin_interval = 5\njitter = 0\n')
+        settings = poll_config()
+        assert settings['min_interval'] == 5.0
+        assert settings['jitter'] == 0.0
+        assert settings['max_interval'] == 60.0
+
+    def test_invalid(self, monkeypatch, tmpdir):
+        monkeypatch.setenv('HOME', str(tmpdir))
+        tmpdir.join('.rhcephpkg.conf').write(
+            '[rhcephpkg.poll]\nbackoff = fast\n')
+        with pytest.raises(SystemExit) as e:
+            poll_config()
+        assert 'backoff must be a number' in str(e.value)
+
+
+class TestPollScheduler(object):
+
+    def test_backoff(self, scheduler):
+        delays = [scheduler.next('waiting', now=0) for _ in range(6)]
+        assert delays == [2, 4, 8, 16, 30, 30]
+
+    def test_state_change(self, scheduler):
+        for _ in range(3):
+            scheduler.next('waiting', now=0)
+        assert scheduler.next('starting', now=0) == 2
+        assert scheduler.next('starting', now=0) == 4
+
+    def test_jitter(self):
+        scheduler = PollScheduler(min_interval=10, jitter=0.5)
+        for _ in range(20):
+            scheduler.interval = None
+            assert 5 <= scheduler.next(now=0) <= 15
+
+    def test_expected_end(self, scheduler):
+        scheduler.expect(100)
+        assert scheduler.next(True, now=0) == 2
+        scheduler.interval = 30
+        # We wake up just after the expected end, not a full interval later.
+        assert scheduler.next(True, now=90) == 11
+        # Once we pass the expected end, we poll quickly again.
+        assert scheduler.next(True, now=101) == 2
+        assert scheduler.next(True, now=103) == 4
+
+
+class TestCircuitBreaker(object):
+
+    @pytest.fixture
+    def breaker(self):
+        return CircuitBreaker(min_interval=2, outage_interval=30, backoff=2,
+                              jitter=0, threshold=3)
+
+    def test_backoff(self, breaker):
+        delays = [breaker.failure(Exception('down')) for _ in range(6)]
+        assert delays == [2, 4, 8, 16, 30, 30]
+
+    def test_opens(self, breaker):
+        breaker.failure(Exception('down'))
+        breaker.failure(Exception('down'))
+        assert not breaker.open
+        breaker.failure(Exception('down'))
+        assert breaker.open
+
+    def test_success_closes(self, breaker):
+        for _ in range(4):
+            breaker.failure(Exception('down'))
+        breaker.success()
+        assert not breaker.open
+        assert breaker.failure(Exception('down')) == 2
@@ -0,0 +1,84 @@
+from rhcephpkg.chacra import ChacraClient
+from rhcephpkg.preflight import BuiltRevisions
+from rhcephpkg.preflight import chacra_duplicate
+from rhcephpkg.preflight import jenkins_duplicate
+import pytest
+
+
+def recent_build(number, result, pkg, branch, sha1):
+    return {'number': number, 'result': result, 'actions': [
+        {'parameters': [{'name': 'PKG_NAME', 'value': pkg},
+                        {'name': 'BRANCH', 'value': branch}]},
+        {'lastBuiltRevision': {'SHA1': sha1}},
+    ]}
+
+
+class FakeJenkins(object):
+    def __init__(self, builds):
+        self.builds = builds
+        self.queried = 0
+
+    def recent_builds(self, name, count):
+        self.queried += 1
+        return self.builds
+
+
+class TestJenkinsDuplicate(object):
+
+    def test_found(self):
+        jenkins = FakeJenkins([
+            recent_build(8, 'FAILURE', 'ceph', 'ceph-3.0-xenial', 'b' * 40),
+            recent_build(7, 'SUCCESS', 'ceph', 'ceph-3.0-xenial', 'a' * 40),
+        ])
+        assert jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial',
+                                 'a' * 40) == 7
+        assert jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial',
+                                 'b' * 40) is None
+
+    def test_cached(self):
+        jenkins = FakeJenkins([
+            recent_build(7, 'SUCCESS', 'ceph', 'ceph-3.0-xenial', 'a' * 40),
+        ])
+        jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial', 'a' * 40)
+        # Jenkins has since forgotten this build, but we remember it.
+        jenkins.builds = []
+        assert jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial',
+                                 'a' * 40) == 7
+        assert jenkins.queried == 1
+        assert BuiltRevisions().get('ceph', 'ceph-3.0-xenial', 'a' * 40) == 7
+
+    def test_one_scan(self):
+        jenkins = FakeJenkins([])
+        built = BuiltRevisions()
+        for sha1 in ('a' * 40, 'b' * 40):
+            assert jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial',
+                                     sha1, built) is None
+        # We only asked Jenkins once.
+        assert jenkins.queried == 1
+
+    def test_other_branch(self):
+        jenkins = FakeJenkins([
+            recent_build(7, 'SUCCESS', 'ceph', 'ceph-3.0-trusty', 'a' * 40),
+        ])
+        assert jenkins_duplicate(jenkins, 'ceph', 'ceph-3.0-xenial',
+                                 'a' * 40) is None
+
+
+class TestChacraDuplicate(object):
+
+    @pytest.fixture
+    def client(self, fake_chacra):
+        return ChacraClient()
+
+    @pytest.mark.parametrize('branch,version,expected', [
+        ('ceph-2-trusty', '10.2.0-2redhat1', '10.2.0-2redhat1trusty'),
+        ('ceph-2-xenial', '10.2.0-2redhat1', None),
+        ('ceph-2-trusty', '10.2.0-2redhat', None),
+        ('ceph-2-trusty', '10.2.0-3redhat1', None),
+    ])
+    def test_versions(self, client, branch, version, expected):
+        assert chacra_duplicate(client, 'ceph', branch, version) == expected
+
+    def test_unknown_package(self, client):
+        assert chacra_duplicate(client, 'testpkg', 'ceph-2-xenial',
+                                '1.0.0-2redhat1') is None
@@ -0,0 +1,62 @@
+import hashlib
+import io
+import os
+import threading
+import pytest
+from rhcephpkg import transfer
+
+
+class TestCopy(object):
+
+    def test_copy(self, tmpdir):
+        data = os.urandom(transfer.BUFFER_SIZE * 2 + 123)
+        dest = tmpdir.join('dest')
+        hasher = hashlib.sha512()
+        with open(str(dest), 'wb') as fp:
+            assert transfer.copy(io.BytesIO(data), fp, hasher) == len(data)
+        assert dest.read_binary() == data
+        assert hasher.hexdigest() == hashlib.sha512(data).hexdigest()
+
+    def test_hash_only(self):
+        hasher = hashlib.sha512()
+        assert transfer.copy(io.BytesIO(b'abc'), hasher=hasher) == 3
+        assert hasher.hexdigest() == hashlib.sha512(b'abc').hexdigest()
+
+    def test_empty(self):
+        assert transfer.copy(io.BytesIO(b'')) == 0
+
+    def test_stop(self):
+        stop = threading.Event()
+        stop.set()
+        with pytest.raises(transfer.Stopped):
+            transfer.copy(io.BytesIO(b'abc'), stop=stop)
+
+    def test_buffer_reused(self):
+        assert transfer.buffer() is transfer.buffer()
+
+
+class TestPreallocate(object):
+
+    def test_preallocate(self, tmpdir):
+        path = tmpdir.join('dest')
+        with open(str(path), 'wb') as fp:
+            fp.write(b'abc')
+            fp.flush()
+            transfer.preallocate(fp, 3, 4096)
+        # We never change the file's size, so a crash cannot leave a
+        # resumable file larger than what we wrote.
+        assert path.size() == 3
+
+    def test_nothing_to_reserve(self, tmpdir):
+        with open(str(tmpdir.join('dest')), 'wb') as fp:
+            assert transfer.preallocate(fp, 0, 0) is False
+
+
+class TestFsyncAll(object):
+
+    def test_fsync_all(self, tmpdir):
+        paths = []
+        for name in ('a', 'b'):
+            tmpdir.join(name).write(name)
+            paths.append(str(tmpdir.join(name)))
+        transfer.fsync_all(paths)
@@ -1,7 +1,7 @@
 import os
 import pytest
 from rhcephpkg import util
-from rhcephpkg.tests.util import CallRecorder
+from rhcephpkg.tests.util import CallRecorder, git
 
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
 FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
@@ -81,6 +81,11 @@ class TestUtilChangelog(object):
         assert util.bump_changelog(['some change']) is True
         assert str(util.get_deb_version()) == '1.0.0-3redhat1'
 
+    def test_deb_version_path(self, testpkg, tmpdir):
+        """ test reading another directory's debian changelog """
+        tmpdir.chdir()
+        assert str(util.get_deb_version(str(testpkg))) == '1.0.0-2redhat1'
+
 
 class TestUtilDebVersion(object):
     @pytest.mark.parametrize('current,expected', [
@@ -166,3 +171,104 @@ class TestUtilSetupPristineTarBranch(object):
         expected = ['git', 'branch', '--force', '--track',
                     'pristine-tar', 'origin/pristine-tar']
         assert recorder.args == expected
+
+
+class TestUtilFormatBytes(object):
+
+    @pytest.mark.parametrize('num,expected', [
+        (0, '0 B'),
+        (1023, '1023 B'),
+        (1536, '1.5 KiB'),
+        (5 * 1024 * 1024, '5.0 MiB'),
+        (3 * 1024 ** 4, '3.0 TiB'),
+    ])
+    def test_format_bytes(self, num, expected):
+        assert util.format_bytes(num) == expected
+
+
+class TestUtilParseSize(object):
+
+    @pytest.mark.parametrize('size,expected', [
+        ('0', 0),
+        ('123', 123),
+        ('1.5K', 1536),
+        ('500M', 500 * 1024 ** 2),
+        ('10G', 10 * 1024 ** 3),
+        ('2GiB', 2 * 1024 ** 3),
+    ])
+    def test_parse_size(self, size, expected):
+        assert util.parse_size(size) == expected
+
+    def test_bad_size(self):
+        with pytest.raises(ValueError):
+            util.parse_size('lots')
+
+
+class TestUtilMakedirs(object):
+
+    def test_makedirs(self, tmpdir):
+        path = str(tmpdir.join('a', 'b'))
+        util.makedirs(path)
+        assert os.path.isdir(path)
+        # It is fine if the directory already exists.
+        util.makedirs(path)
+
+
+class TestUtilRevisions(object):
+
+    def test_fetch_branch(self, testpkg, tmpdir):
+        git('remote', 'add', 'origin', str(testpkg))
+        util.fetch_branch('ceph-2-ubuntu')
+        assert util.current_revision(ref='origin/ceph-2-ubuntu') == \
+            util.current_revision()
+
+    def test_deb_version_revision(self, testpkg):
+        sha1 = util.current_revision()
+        util.bump_changelog(['some change'])
+        assert str(util.get_deb_version(revision=sha1)) == '1.0.0-2redhat1'
+
+
+class TestUtilWriteJson(object):
+
+    def test_write_json(self, tmpdir):
+        path = tmpdir.join('a', 'data.json')
+        util.write_json(str(path), {'b': 1})
+        util.write_json(str(path), {'b': 2})
+        assert path.read() == '{"b": 2}'
+        # No temporary files are left behind.
+        assert os.listdir(str(tmpdir.join('a'))) == ['data.json']
+
+
+class TestUtilPositiveInt(object):
+
+    class FakeParser(object):
+        def __init__(self, value):
+            self.value = value
+
+        def get(self, option):
+            return self.value
+
+    def test_positive_int(self):
+        assert util.positive_int(self.FakeParser('3'), '--jobs') == 3
+
+    @pytest.mark.parametrize('value', [None, '0', '-1', 'many'])
+    def test_not_positive(self, value):
+        with pytest.raises(SystemExit) as e:
+            util.positive_int(self.FakeParser(value), '--jobs')
+        assert str(e.value) == 'Specify a positive number to --jobs'
+
+
+class TestUtilFormatTable(object):
+
+    def test_format_table(self):
+        rows = [['package', 'result'], ['ceph', 'SUCCESS']]
+        assert util.format_table(rows) == ('package  result\n'
+                                           'ceph     SUCCESS')
+
+
+class TestUtilJenkinsConnection(object):
+
+    def test_shared(self):
+        jenkins = util.jenkins_connection()
+        assert util.jenkins_connection() is jenkins
+        assert jenkins.url == 'https://ceph-jenkins.example.com/'
@@ -1,6 +1,14 @@
 from rhcephpkg import WatchBuild
-from datetime import datetime
+from rhcephpkg.history import BuildHistory
+from rhcephpkg.watch_build import ConsoleLog, WatchState
+from datetime import datetime, timedelta
+from dateutil import tz
+from jenkins import NotFoundException, TimeoutException
 import pytest
+import requests.exceptions
+from rhcephpkg.jenkins_api import JenkinsUnavailable
+
+BUILD_STATUS = 'rhcephpkg.jenkins_api.JenkinsSession.build_status'
 
 
 class FakeJenkins(object):
@@ -10,7 +18,7 @@ class FakeJenkins(object):
         self.timestamp = dt.microsecond
         self.result = 'SUCCESS'
 
-    def get_build_info(self, job, id_):
+    def build_status(self, job, id_):
         """ Fake information about a ceph package build. """
         if self.queried < 3:
             # Pretend we're still building
@@ -32,11 +40,43 @@ class FakeJenkins(object):
         }
 
 
+class FakeResponse(object):
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+
+class FakeConsole(object):
+    """ Serve a console log through a fake progressiveText API. """
+
+    def __init__(self, chunks):
+        self.log = b''.join(chunks)
+        self.chunks = list(chunks)
+        self.starts = []
+
+    def jenkins_request(self, req):
+        start = int(req.url.rsplit('start=', 1)[1])
+        self.starts.append(start)
+        chunk = self.chunks.pop(0) if self.chunks else b''
+        end = start + len(chunk)
+        headers = {'X-Text-Size': str(end)}
+        if self.chunks:
+            headers['X-More-Data'] = 'true'
+        return FakeResponse(self.log[start:end], headers)
+
+
 @pytest.fixture
 def fake_jenkins():
     return FakeJenkins()
 
 
+@pytest.fixture(autouse=True)
+def no_recent_builds(monkeypatch):
+    """ Predict build times only from builds that a test records. """
+    monkeypatch.setattr('rhcephpkg.jenkins_api.JenkinsSession.recent_builds',
+                        lambda self, name, count: [])
+
+
 class TestWatchBuild(object):
 
     def test_no_args(self, capsys):
@@ -49,8 +89,7 @@ class TestWatchBuild(object):
 
     def test_simple(self, monkeypatch, fake_jenkins):
         monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
-        monkeypatch.setattr('jenkins.Jenkins.get_build_info',
-                            fake_jenkins.get_build_info)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
         watch_build = WatchBuild(['watch-build', 123])
         watch_build.main()
         assert fake_jenkins.queried > 0
@@ -58,9 +97,292 @@ class TestWatchBuild(object):
     def test_failed_build(self, monkeypatch, fake_jenkins):
         monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
         fake_jenkins.result = 'FAILED'
-        monkeypatch.setattr('jenkins.Jenkins.get_build_info',
-                            fake_jenkins.get_build_info)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
         watch_build = WatchBuild(['watch-build', 123])
         with pytest.raises(SystemExit) as excinfo:
             watch_build.main()
         assert excinfo.value.code == 1
+
+    @pytest.mark.parametrize('error', [
+        requests.exceptions.ConnectionError('refused'),
+        JenkinsUnavailable('503 Service Unavailable'),
+        TimeoutException('timed out'),
+    ])
+    def test_outage(self, monkeypatch, fake_jenkins, error):
+        waits = [0]
+
+        def sleep(seconds):
+            waits[-1] += seconds
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', sleep)
+        monkeypatch.setattr('rhcephpkg.poll.random.uniform', lambda a, b: 1)
+        outage = [4]
+
+        def build_status(self, job, id_):
+            waits.append(0)
+            if fake_jenkins.queried == 1 and outage[0]:
+                outage[0] -= 1
+                raise error
+            return fake_jenkins.build_status(job, id_)
+        monkeypatch.setattr(BUILD_STATUS, build_status)
+        watch_build = WatchBuild(['watch-build', '123'])
+        watch_build.main()
+        # Each attempt during the outage waited longer than the last.
+        assert waits == [0, 2, 2, 4, 8, 16, 4, 8, 0]
+        # We finished watching, so there is nothing to resume.
+        assert WatchState.interrupted() == []
+
+    def test_no_such_build(self, monkeypatch):
+        def build_status(self, job, id_):
+            raise NotFoundException('Requested item could not be found')
+        monkeypatch.setattr(BUILD_STATUS, build_status)
+        watch_build = WatchBuild(['watch-build', '999'])
+        with pytest.raises(NotFoundException):
+            watch_build.main()
+        # There is nothing to resume.
+        assert WatchState.interrupted() == []
+
+    def test_resume(self, monkeypatch, fake_jenkins):
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
+        WatchState([123]).save()
+        recorder = []
+        monkeypatch.setattr(WatchBuild, 'watch',
+                            lambda self, number, **kw: recorder.append(
+                                (number, kw)))
+        watch_build = WatchBuild(['watch-build', '--resume'])
+        watch_build.main()
+        assert recorder == [(123, {'follow_log': False, 'offset': 0,
+                                   'fail_fast': False, 'abort': False})]
+
+    def test_resume_chosen(self, monkeypatch):
+        WatchState([123]).save()
+        WatchState([200, 201]).save()
+        recorder = []
+        monkeypatch.setattr(WatchBuild, 'watch_many',
+                            lambda self, numbers: recorder.append(numbers))
+        watch_build = WatchBuild(['watch-build', '--resume', '201'])
+        watch_build.main()
+        assert recorder == [[201, 200]]
+        # The other interrupted watch is still there to resume.
+        remaining = [state.builds for state in WatchState.interrupted()]
+        assert [123] in remaining
+
+    def test_separate_watchers(self, monkeypatch, fake_jenkins):
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
+        # Another terminal is watching build 77.
+        other = WatchState([77])
+        other.save()
+        WatchBuild(['watch-build', '123']).main()
+        # "build" calls watch() without saving any state.
+        fake_jenkins.queried = 0
+        WatchBuild(['watch']).watch(124)
+        assert [state.builds for state in WatchState.interrupted()] == [[77]]
+
+    def test_nothing_to_resume(self):
+        watch_build = WatchBuild(['watch-build', '--resume'])
+        with pytest.raises(SystemExit) as e:
+            watch_build.main()
+        assert str(e.value) == 'there is no watch-build to resume'
+
+    @pytest.mark.parametrize('expected,suffix', [
+        (None, ''),
+        (240, ', about 03:00 left (25%)'),
+        (30, ', 00:30 longer than usual'),
+    ])
+    def test_show_elapsed(self, capsys, expected, suffix):
+        start = datetime.now(tz.tzutc()) - timedelta(seconds=60)
+        WatchBuild([]).show_elapsed('ceph', start, expected)
+        out, _ = capsys.readouterr()
+        assert out == '\rceph building for 01:00' + suffix
+
+
+class TestConsoleLog(object):
+
+    def test_read(self, monkeypatch):
+        # "\xc3\xa9" is "e" with an acute accent, split across two reads.
+        console = FakeConsole([b'Building\ncaf\xc3', b'\xa9\n', b'',
+                               b'Done\n'])
+        monkeypatch.setattr('rhcephpkg.jenkins_api.JenkinsSession.'
+                            'jenkins_request',
+                            lambda self, req: console.jenkins_request(req))
+        from rhcephpkg import util
+        log = ConsoleLog(util.jenkins_connection(), 'build-package', 123)
+        text = []
+        while log.more:
+            text.append(log.read())
+        assert text == [u'Building\ncaf', u'\xe9\n', u'', u'Done\n']
+        assert console.starts == [0, 13, 15, 15]
+
+    def test_watch_log(self, monkeypatch, fake_jenkins, capsys):
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
+        console = FakeConsole([b'step 1\n', b'step 2\n'])
+        monkeypatch.setattr('rhcephpkg.jenkins_api.JenkinsSession.'
+                            'jenkins_request',
+                            lambda self, req: console.jenkins_request(req))
+        watch_build = WatchBuild(['watch-build', '--log', '123'])
+        watch_build.main()
+        out, _ = capsys.readouterr()
+        assert out.startswith('step 1\nstep 2\n')
+
+
+class TestFailFast(object):
+
+    @pytest.fixture
+    def console(self, monkeypatch, fake_jenkins):
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', lambda s: None)
+        monkeypatch.setattr(BUILD_STATUS, fake_jenkins.build_status)
+        console = FakeConsole([b'Compiling\nsrc/osd/OSD.cc:12:3: err',
+                               b'or: boom\n', b'more\n'])
+        monkeypatch.setattr('rhcephpkg.jenkins_api.JenkinsSession.'
+                            'jenkins_request',
+                            lambda self, req: console.jenkins_request(req))
+        return console
+
+    def test_fail_fast(self, console, monkeypatch):
+        stopped = []
+        monkeypatch.setattr('jenkins.Jenkins.stop_build',
+                            lambda self, name, number: stopped.append(number))
+        watch_build = WatchBuild(['watch-build', '--fail-fast', '123'])
+        with pytest.raises(SystemExit) as e:
+            watch_build.main()
+        assert str(e.value) == 'build #123 is failing: compiler error'
+        # We stopped reading once we saw the error.
+        assert console.chunks == [b'more\n']
+        assert stopped == []
+        # The build is still running, so we can resume watching it.
+        assert [state.builds for state in WatchState.interrupted()] == [[123]]
+
+    def test_abort(self, console, monkeypatch):
+        stopped = []
+        monkeypatch.setattr('jenkins.Jenkins.stop_build',
+                            lambda self, name, number: stopped.append(number))
+        watch_build = WatchBuild(['watch-build', '--fail-fast', '--abort',
+                                  '123'])
+        with pytest.raises(SystemExit):
+            watch_build.main()
+        assert stopped == [123]
+        assert WatchState.interrupted() == []
+
+    def test_log_alerts(self, console, capsys, caplog):
+        # Without --fail-fast, we only point out the error.
+        watch_build = WatchBuild(['watch-build', '--log', '123'])
+        watch_build.main()
+        out, _ = capsys.readouterr()
+        assert 'more\n' in out
+        assert 'build #123 hit a compiler error: src/osd/OSD.cc' in \
+            caplog.text
+
+    def test_abort_alone(self):
+        watch_build = WatchBuild(['watch-build', '--abort', '123'])
+        with pytest.raises(SystemExit) as e:
+            watch_build.main()
+        assert str(e.value) == '--abort only works with --fail-fast'
+
+
+class FakeClock(object):
+    """ A clock that only moves when we sleep. """
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ManyBuildsJenkins(object):
+    """ Several fake builds that finish after some number of polls. """
+
+    def __init__(self, builds):
+        # build number -> [polls until done, final result]
+        self.builds = builds
+        self.queried = []
+
+    def build_status(self, job, number):
+        self.queried.append(number)
+        polls, result = self.builds[number]
+        self.builds[number][0] -= 1
+        return {
+            'actions': [{'_class': 'hudson.model.ParametersAction',
+                         'parameters': [{'name': 'PKG_NAME',
+                                         'value': 'pkg%d' % number}]}],
+            'building': polls > 0,
+            'timestamp': 0,
+            'duration': 60000,
+            'result': None if polls > 0 else result,
+        }
+
+    def get_whoami(self):
+        return {'id': 'kdreyer'}
+
+    def job_builds(self, name):
+        def started_by(user):
+            return [{'causes': [{'userId': user}]}]
+        return [
+            {'number': 3, 'building': True, 'actions': started_by('other')},
+            {'number': 2, 'building': True, 'actions': started_by('kdreyer')},
+            {'number': 1, 'building': False, 'actions': started_by('kdreyer')},
+        ]
+
+
+class TestWatchMany(object):
+
+    @pytest.fixture(autouse=True)
+    def clock(self, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr('rhcephpkg.watch_build.time', clock.time)
+        monkeypatch.setattr('rhcephpkg.watch_build.sleep', clock.sleep)
+        return clock
+
+    def patch(self, monkeypatch, fake):
+        for method in ('build_status', 'get_whoami', 'job_builds'):
+            monkeypatch.setattr(
+                'rhcephpkg.jenkins_api.JenkinsSession.%s' % method,
+                getattr(fake, method))
+
+    def test_all_succeed(self, monkeypatch, capsys):
+        fake = ManyBuildsJenkins({10: [2, 'SUCCESS'], 11: [5, 'SUCCESS']})
+        self.patch(monkeypatch, fake)
+        watch_build = WatchBuild(['watch-build', '10', '11'])
+        watch_build.main()
+        out, _ = capsys.readouterr()
+        assert out.splitlines() == [
+            '#10     pkg10                SUCCESS   01:00',
+            '#11     pkg11                SUCCESS   01:00',
+        ]
+        # Build 10 finished first, so we stopped polling it.
+        assert fake.queried.count(10) == 3
+        assert fake.queried.count(11) == 6
+        # We recorded both builds in our history.
+        history = BuildHistory()
+        assert [b[0] for b in history.builds()] == ['pkg10', 'pkg11']
+        history.close()
+
+    def test_one_fails(self, monkeypatch):
+        fake = ManyBuildsJenkins({10: [1, 'FAILURE'], 11: [1, 'SUCCESS']})
+        self.patch(monkeypatch, fake)
+        watch_build = WatchBuild(['watch-build', '10', '11'])
+        with pytest.raises(SystemExit) as e:
+            watch_build.main()
+        assert str(e.value) == '1 of 2 builds did not succeed: 10'
+
+    def test_mine(self, monkeypatch):
+        fake = ManyBuildsJenkins({2: [1, 'SUCCESS']})
+        self.patch(monkeypatch, fake)
+        recorder = []
+        monkeypatch.setattr(WatchBuild, 'watch',
+                            lambda self, number, **kw: recorder.append(
+                                number))
+        watch_build = WatchBuild(['watch-build', '--mine'])
+        watch_build.main()
+        assert recorder == [2]
+
+    def test_log_many(self, monkeypatch):
+        watch_build = WatchBuild(['watch-build', '--log', '10', '11'])
+        with pytest.raises(SystemExit) as e:
+            watch_build.main()
+        assert str(e.value) == '--log can only follow one build'
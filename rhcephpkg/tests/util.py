@@ -1,12 +1,11 @@
-import errno
-from io import StringIO
+from io import BytesIO
+import hashlib
 import os
 import subprocess
 import six
 from six.moves.urllib.parse import urlparse
-from six.moves.http_client import HTTPMessage
-from six.moves.urllib.error import HTTPError
-from six.moves.urllib.request import urlopen
+from requests import Response
+from requests.adapters import BaseAdapter
 
 TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
 FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
@@ -25,36 +24,64 @@ class CallRecorder(object):
             self.args = args
 
 
-def fake_urlopen(req, **kw):
+class FakeChacraAdapter(BaseAdapter):
     """
-    Behave like six.moves.urllib.request.urlopen().
+    A requests transport adapter that behaves like a chacra server.
 
     Return the contents of local fixture files on disk instead.
+    Mount this in place of requests' HTTPAdapter, eg:
+
+      monkeypatch.setattr('rhcephpkg.chacra.HTTPAdapter', FakeChacraAdapter)
     """
-    o = urlparse(req.get_full_url())
-    localfile = os.path.join(FIXTURES_DIR, o.netloc, o.path[1:])
-    # Try reading the file, and handle some special cases if we get an error.
-    try:
-        with open(localfile):
-            pass
-    except IOError as e:
-        # Raise HTTP 404 errors for non-existent files.
-        if e.errno == errno.ENOENT:
-            url = req.get_full_url()
-            headers = HTTPMessage(StringIO(u''))
-            raise HTTPError(url, 404, 'Not Found', headers, None)
+    def __init__(self, *args, **kwargs):
+        super(FakeChacraAdapter, self).__init__()
+
+    def localfile(self, url):
+        """ Find the fixture file for a URL, or None. """
+        o = urlparse(url)
+        localfile = os.path.join(FIXTURES_DIR, o.netloc, o.path[1:])
         # If URL looked like a directory ("/"), open the file instead.
-        elif e.errno == errno.ENOTDIR:
-            localfile = localfile.rstrip('/')
-        # If localfile's a directory, look for a matching ".body" file instead.
-        elif e.errno == errno.EISDIR:
-            localfile = localfile.rstrip('/') + '.body'
-        else:
-            raise
+        localfile = localfile.rstrip('/')
+        # If localfile's a directory, look for a matching ".body" file
+        # instead.
+        if os.path.isdir(localfile):
+            localfile += '.body'
+        if not os.path.isfile(localfile):
+            return None
+        return localfile
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        localfile = self.localfile(request.url)
+        if localfile is None:
+            return self.respond(response, 404, b'Not Found')
+        with open(localfile, 'rb') as fp:
+            data = fp.read()
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        response.headers['ETag'] = etag
+        if request.headers.get('If-None-Match') == etag:
+            return self.respond(response, 304, b'')
+        byte_range = request.headers.get('Range')
+        if byte_range:
+            # We only handle the "bytes=N-" form that rhcephpkg sends.
+            start = int(byte_range.split('=', 1)[1].split('-', 1)[0])
+            if start >= len(data):
+                return self.respond(response, 416, b'')
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                start, len(data) - 1, len(data))
+            return self.respond(response, 206, data[start:])
+        return self.respond(response, 200, data)
 
-    response = urlopen('file://' + localfile)
+    def respond(self, response, status_code, data):
+        response.status_code = status_code
+        response.headers['Content-Length'] = str(len(data))
+        response.raw = BytesIO(data)
+        return response
 
-    return response
+    def close(self):
+        pass
 
 
 def git(*args):
@@ -0,0 +1,132 @@
+"""
+Move bytes between file-like objects with as little per-byte work in Python
+as we can.
+
+Each thread reads into one large, reusable buffer with readinto(), and we
+hash and write memoryview slices of that buffer, so a multi-GB transfer
+costs a few thousand loop iterations and no per-chunk allocations.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import threading
+
+BUFFER_SIZE = 1024 * 1024
+
+# From <linux/falloc.h>: reserve the space without changing the file size.
+FALLOC_FL_KEEP_SIZE = 0x01
+
+_local = threading.local()
+
+
+def _libc_fallocate():
+    """ Return Linux's fallocate(2) from libc, or None if we lack it. """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # fallocate64 takes a 64-bit off_t on 32-bit platforms too.
+        fallocate = getattr(libc, 'fallocate64', None) or libc.fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64,
+                          ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _libc_fallocate()
+
+
+class Stopped(Exception):
+    """ copy() saw that its stop flag was set. """
+
+
+def buffer():
+    """ Return this thread's reusable transfer buffer, a ``memoryview``. """
+    view = getattr(_local, 'view', None)
+    if view is None:
+        view = _local.view = memoryview(bytearray(BUFFER_SIZE))
+    return view
+
+
+def copy(src, dest=None, hasher=None, stop=None):
+    """
+    Read everything from src, feeding it to hasher and writing it to dest.
+
+    :param src: a file-like object with a readinto() method, eg. a file
+                opened in binary mode or a urllib3 response's "raw" stream.
+    :param dest: a file-like object opened for binary writing, or None.
+    :param hasher: a ``hashlib`` object, or None.
+    :param stop: a ``threading.Event``, or None. If another thread sets it,
+                 we raise Stopped before reading the next chunk.
+    :returns: ``int``, the number of bytes we read.
+    """
+    view = buffer()
+    total = 0
+    while True:
+        if stop is not None and stop.is_set():
+            raise Stopped()
+        count = src.readinto(view)
+        if not count:
+            return total
+        chunk = view[:count]
+        if hasher is not None:
+            hasher.update(chunk)
+        if dest is not None:
+            dest.write(chunk)
+        total += count
+
+
+def preallocate(fp, offset, length):
+    """
+    Ask the filesystem to reserve length bytes of fp, starting at offset.
+
+    This lets the filesystem lay out a large file in a few contiguous
+    extents and makes us fail early (ENOSPC) when the disk is too small.
+
+    We use fallocate(2) with FALLOC_FL_KEEP_SIZE, so the file's size only
+    ever counts the bytes that we wrote, even if we crash before we can
+    truncate it. (A resumable .part file must never look larger than what
+    we received.) posix_fallocate() would extend the file, so on platforms
+    without fallocate(2) we do not preallocate at all.
+
+    :returns: True if we reserved the space, False if this platform or
+              filesystem cannot.
+    """
+    if length <= 0 or _fallocate is None:
+        return False
+    if _fallocate(fp.fileno(), FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        if err in (errno.EINVAL, errno.EOPNOTSUPP, errno.ENOSYS):
+            return False
+        raise OSError(err, os.strerror(err))
+    return True
+
+
+def fsync_all(paths):
+    """
+    Flush these files, and the directories that contain them, to disk.
+
+    Calling this once at the end of a batch of downloads lets the kernel
+    write everything back together, rather than stalling each transfer on
+    its own fsync().
+    """
+    directories = set()
+    for path in paths:
+        _fsync(path)
+        directories.add(os.path.dirname(os.path.abspath(path)))
+    for directory in sorted(directories):
+        try:
+            _fsync(directory)
+        except OSError as e:
+            # Some platforms and filesystems cannot fsync a directory.
+            if e.errno not in (errno.EINVAL, errno.EBADF, errno.EACCES):
+                raise
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
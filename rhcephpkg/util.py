@@ -1,20 +1,25 @@
+import errno
+import json
 import os
 import subprocess
 import pwd
 from textwrap import TextWrapper
+import threading
 import time
 import six
 from six.moves import configparser
-from jenkins import Jenkins
+from rhcephpkg.jenkins_api import JenkinsSession
 try:
     from subprocess import DEVNULL  # py3
 except ImportError:
     DEVNULL = open(os.devnull, 'wb')
 
 
-def current_branch():
+def current_branch(path=None):
     """ Ensure we're on a git branch, and returns the current branch's name.
 
+    :param path: ``str``, the Git repo to look in (default: the current
+                 working directory)
     :raises: subprocess.CalledProcessError if this is not a Git repo, or if
              HEAD is not a valid ref.
     """
@@ -22,12 +27,38 @@ def current_branch():
     # invalid ref, so we use "git rev-parse" instead to build in that
     # additional check here.
     cmd = ['git', 'rev-parse', '--abbrev-ref', 'HEAD']
-    output = subprocess.check_output(cmd).rstrip()
+    output = subprocess.check_output(cmd, cwd=path).rstrip()
     if six.PY3:
         return output.decode('utf-8')
     return output
 
 
+def current_revision(path=None, ref='HEAD'):
+    """ Return the sha1 of the current Git HEAD, or of another ref.
+
+    :param path: ``str``, the Git repo to look in (default: the current
+                 working directory)
+    :param ref: ``str``, eg. "origin/ceph-3.0-xenial"
+    """
+    cmd = ['git', 'rev-parse', '--verify', '%s^{commit}' % ref]
+    output = subprocess.check_output(cmd, cwd=path).rstrip()
+    if six.PY3:
+        return output.decode('utf-8')
+    return output
+
+
+def fetch_branch(branch, path=None):
+    """ Update our origin/<branch> ref from the "origin" remote.
+
+    :param path: ``str``, the Git repo to fetch into (default: the current
+                 working directory)
+    :raises: subprocess.CalledProcessError if we could not fetch
+    """
+    refspec = '+refs/heads/%s:refs/remotes/origin/%s' % (branch, branch)
+    cmd = ['git', 'fetch', '-q', 'origin', refspec]
+    subprocess.check_call(cmd, cwd=path)
+
+
 def current_patch_queue_branch():
     """ Get our patch-queue branch's name, based on the current branch """
     current = current_branch()
@@ -74,7 +105,82 @@ def config():
     return configp
 
 
+def cache_dir():
+    """ Return the path to rhcephpkg's per-user cache directory. """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'rhcephpkg')
+
+
+def makedirs(path):
+    """ Create a directory and its parents, if it does not exist yet. """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        # Another thread or process may have just created it.
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def write_json(path, data, **kwargs):
+    """
+    Write data to a JSON file atomically, creating its directory if needed.
+
+    Readers only ever see the old file or the new one, never a partial
+    write. Extra keyword arguments go to json.dump().
+    """
+    makedirs(os.path.dirname(os.path.abspath(path)))
+    tmp = '%s.%d.%d' % (path, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp, 'w') as fp:
+            json.dump(data, fp, **kwargs)
+        os.rename(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def positive_int(parser, option):
+    """ Return the value of a Transport option as a positive integer.
+
+    :raises: SystemExit if the value is not a positive integer
+    """
+    try:
+        value = int(parser.get(option))
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise SystemExit('Specify a positive number to %s' % option)
+    return value
+
+
+def format_table(rows):
+    """ Format rows of strings into aligned columns. """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width)
+                               for (cell, width) in zip(row, widths)).rstrip()
+                     for row in rows)
+
+
+# Our process-wide Jenkins session. See jenkins_connection().
+_jenkins = None
+_jenkins_lock = threading.Lock()
+
+
 def jenkins_connection():
+    """ Return our process-wide, initialized python-jenkins object.
+
+    Every command in this process shares this one object, so they share its
+    keep-alive HTTP connections, its resolved authentication, its CSRF
+    crumb, and its cached whoami lookup, and we only parse
+    ~/.rhcephpkg.conf once. """
+    global _jenkins
+    with _jenkins_lock:
+        if _jenkins is None:
+            _jenkins = _new_jenkins_connection()
+        return _jenkins
+
+
+def _new_jenkins_connection():
         """ Return an initialized python-jenkins object. """
         configp = config()
         try:
@@ -84,7 +190,7 @@ def jenkins_connection():
         except configparser.Error as err:
             raise SystemExit('Problem parsing .rhcephpkg.conf: %s',
                              err.message)
-        jenkins = Jenkins(url, username=user, password=token)
+        jenkins = JenkinsSession(url, username=user, password=token)
         # These "password" and "url" attributes are not formally part of
         # python-jenkins' API, but they are nice to make available to consumers
         # (for logging/debugging, for example.)
@@ -93,6 +199,39 @@ def jenkins_connection():
         return jenkins
 
 
+def format_bytes(num):
+    """ Return a human-readable string for a number of bytes, eg "1.5 MiB" """
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(num) < 1024:
+            break
+        num /= 1024.0
+    else:
+        unit = 'TiB'
+    if unit == 'B':
+        return '%d %s' % (num, unit)
+    return '%.1f %s' % (num, unit)
+
+
+def format_seconds(seconds):
+    """ Return a number of seconds as "mm:ss", eg "05:30" """
+    (minutes, seconds) = divmod(int(round(seconds)), 60)
+    return '%02d:%02d' % (minutes, seconds)
+
+
+def parse_size(size):
+    """
+    Parse a human-readable size like "500M" or "10G" (powers of 1024) into a
+    number of bytes.
+
+    :raises: ``ValueError`` if size is not a valid size.
+    """
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    size = size.strip().upper().rstrip('B').rstrip('I')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
 def package_name():
     """ Get the name of this dist-git package
         (just our current working directory) """
@@ -165,10 +304,26 @@ def format_changelog(changes):
     return clog
 
 
-def get_deb_version():
-    """ Get the current version from a /debian/changelog. """
-    with open('debian/changelog') as fh:
-        first_header = fh.readline()
+def get_deb_version(path=None, revision=None):
+    """ Get the current version from a /debian/changelog.
+
+    :param path: ``str``, the package directory to look in (default: the
+                 current working directory)
+    :param revision: ``str``, read the changelog from this Git commit
+                     rather than from the working tree
+    """
+    if revision is not None:
+        cmd = ['git', 'show', '%s:debian/changelog' % revision]
+        output = subprocess.check_output(cmd, cwd=path)
+        if six.PY3:
+            output = output.decode('utf-8')
+        first_header = output.split('\n', 1)[0]
+    else:
+        changelog = os.path.join('debian', 'changelog')
+        if path is not None:
+            changelog = os.path.join(path, changelog)
+        with open(changelog) as fh:
+            first_header = fh.readline()
     # first_header is like "ceph (10.2.0-4redhat1) stable; urgency=medium"
     vstr = first_header.split(' ', 2)[1][1:-1]
     return DebVersion(vstr)
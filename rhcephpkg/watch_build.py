@@ -1,48 +1,330 @@
+import codecs
+import json
+import os
 import sys
 from datetime import datetime
 from dateutil import tz
-from time import sleep
+from time import sleep, time
 from tambo import Transport
 import posixpath
 import rhcephpkg.log as log
 import rhcephpkg.util as util
+from rhcephpkg.failures import FailureScanner
+from rhcephpkg.history import expected_duration, record_build
+from rhcephpkg.jenkins_api import OUTAGE_ERRORS
+from rhcephpkg.poll import CircuitBreaker, PollScheduler
+import requests
 import requests.exceptions
 
+PARAMETERS_ACTION = 'hudson.model.ParametersAction'
+
+# Jenkins' API for fetching a build's console output from a byte offset.
+PROGRESSIVE_TEXT = ('job/%(name)s/%(number)d/logText/progressiveText'
+                    '?start=%(start)d')
+
+
+class ConsoleLog(object):
+    """
+    Tail a build's console output with Jenkins' progressiveText API.
+
+    Each read() fetches only the bytes after our last offset. Jenkins tells
+    us the next offset in the X-Text-Size header, and sets X-More-Data
+    while the build can still write more.
+    """
+
+    def __init__(self, jenkins, job, number):
+        self.jenkins = jenkins
+        self.job = job
+        self.number = number
+        self.offset = 0
+        self.more = True
+        # A multi-byte character may straddle two responses.
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def read(self):
+        """ Return the text that the build has written since our last read.
+        """
+        url = self.jenkins._build_url(PROGRESSIVE_TEXT, {
+            'name': self.job, 'number': self.number, 'start': self.offset})
+        response = self.jenkins.jenkins_request(requests.Request('GET', url))
+        data = response.content
+        size = response.headers.get('X-Text-Size')
+        self.offset = int(size) if size else self.offset + len(data)
+        self.more = response.headers.get('X-More-Data') == 'true'
+        return self.decoder.decode(data, final=not self.more)
+
+
+def expect(scheduler, build_info, expected=None):
+    """
+    Tell a PollScheduler when we expect this build to finish.
+
+    :param expected: ``float``, how many seconds we predict that the build
+                     will take. If None, use Jenkins' estimate, which is
+                     based on the job's recent builds of any package.
+    """
+    start = build_info['timestamp'] / 1000.0
+    if expected is not None:
+        scheduler.expect(start + expected)
+        return
+    estimate = build_info.get('estimatedDuration', -1)
+    if estimate > 0:
+        scheduler.expect(start + estimate / 1000.0)
+
+
+def state_dir():
+    """ Return the directory where we keep each WatchState. """
+    return os.path.join(util.cache_dir(), 'watch-build')
+
+
+class WatchState(object):
+    """
+    The builds that one watch-build is watching, saved in
+    ~/.cache/rhcephpkg/watch-build/ so that "watch-build --resume" can pick
+    up where an interrupted watch-build left off.
+
+    Each set of builds has its own file, so several watch-builds (eg. one
+    per terminal) do not overwrite each other's state. "offset" is how much
+    of the console log we have already printed with --log.
+    """
+
+    def __init__(self, builds):
+        self.builds = list(builds)
+        name = '-'.join(str(number) for number in self.builds)
+        self.path = os.path.join(state_dir(), '%s.json' % name)
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (IOError, ValueError):
+            data = {}
+        self.log = data.get('log', False)
+        self.offset = data.get('offset', 0)
+        # Whether this process wrote the file, and so may remove it.
+        self.saved = False
+
+    @classmethod
+    def interrupted(cls):
+        """
+        Return the state of each watch-build that did not finish, most
+        recently saved first.
+
+        :returns: ``list`` of ``WatchState``s
+        """
+        try:
+            names = os.listdir(state_dir())
+        except OSError:
+            return []
+        paths = [os.path.join(state_dir(), name) for name in names
+                 if name.endswith('.json')]
+        states = []
+        for path in sorted(paths, key=os.path.getmtime, reverse=True):
+            try:
+                with open(path) as fp:
+                    states.append(cls(json.load(fp)['builds']))
+            except (IOError, ValueError, KeyError):
+                continue
+        return states
+
+    def save(self):
+        """ Write the state to disk atomically. """
+        data = {'builds': self.builds, 'log': self.log,
+                'offset': self.offset}
+        util.write_json(self.path, data, sort_keys=True)
+        self.saved = True
+
+    def clear(self):
+        """
+        Forget these builds once we have finished watching them. We only
+        remove the file if this process saved it.
+        """
+        if not self.saved:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.saved = False
+
+
+class WatchedBuild(object):
+    """ One build that watch_many() is monitoring. """
+
+    def __init__(self, number, info, pkg_name, expected=None):
+        self.number = number
+        self.info = info
+        self.pkg_name = pkg_name
+        self.scheduler = PollScheduler()
+        expect(self.scheduler, info, expected)
+        self.due = time() + self.scheduler.next(info['building'])
+
+    def status(self, now):
+        """ Return a one-line summary of this build. """
+        if self.info['building']:
+            state = 'BUILDING'
+            elapsed = now - self.info['timestamp'] / 1000.0
+        else:
+            state = self.info['result']
+            elapsed = self.info['duration'] / 1000.0
+        (minutes, seconds) = divmod(max(elapsed, 0), 60)
+        return '#%-6d %-20s %-9s %02d:%02d' % (
+            self.number, self.pkg_name, state, minutes, seconds)
+
 
 class WatchBuild(object):
     help_menu = 'watch a build-package job in Jenkins'
     _help = """
-Watch a particular build-package job in Jenkins.
+Watch build-package jobs in Jenkins.
+
+Options:
+--log     Print the build's console output as it runs (for one build only)
+--mine    Watch all the running builds that you started
+--resume  Continue an interrupted watch-build
+--fail-fast  Scan the build's console output for fatal errors (see
+             below), and exit as soon as one appears
+--abort      With --fail-fast, also abort the build in Jenkins, to free
+             its executor
 
 Positional Arguments:
 
-[id]  The build-package job ID to watch
+[id...]  The build-package job IDs to watch
+
+For example: "rhcephpkg watch-build 328", or "rhcephpkg watch-build 328 329"
 
-For example: "rhcephpkg watch-build 328"
+When watching several builds, we show a table of their states, and exit
+with an error if any of them did not succeed.
+
+If Jenkins goes down while we are watching, we keep retrying with
+exponential backoff, up to outage_interval seconds apart (see the
+[rhcephpkg.poll] settings). If you interrupt watch-build, "rhcephpkg
+watch-build --resume" continues watching the same builds.
+
+--log and --fail-fast recognize fatal compiler, linker, make and dpkg
+errors. Add your own patterns (Python regexes, matched against each line)
+in the [rhcephpkg.failures] section of ~/.rhcephpkg.conf, eg.
+"oom = Killed signal terminated program", or disable one of ours with an
+empty value, eg. "linker =".
 """
     name = 'watch-build'
 
     def __init__(self, argv):
         self.argv = argv
         self.options = []
+        # Set by main(). Commands like "build" that call watch() directly
+        # do not save any state.
+        self.state = None
+        # An interrupted WatchState that ours takes over from.
+        self.replaces = None
+        self.scanner = None
+        self.fail_fast = False
+        self.abort = False
 
     def main(self):
         self.parser = Transport(self.argv, options=self.options)
         self.parser.catch_help = self.help()
         self.parser.parse_args()
+        args = [arg for arg in self.parser.unknown_commands
+                if arg not in ('--log', '--mine', '--resume', '--fail-fast',
+                               '--abort')]
         try:
-            build_number = int(self.parser.unknown_commands[0])
-        except (IndexError, ValueError):
+            build_numbers = [int(arg) for arg in args]
+        except ValueError:
+            return self.parser.print_help()
+        follow_log = self.parser.has('--log')
+        offset = 0
+        resumed = None
+        if self.parser.has('--resume'):
+            resumed = self.resumable(build_numbers)
+            build_numbers += [n for n in resumed.builds
+                              if n not in build_numbers]
+            follow_log = follow_log or resumed.log
+            offset = resumed.offset
+        if self.parser.has('--mine'):
+            jenkins = util.jenkins_connection()
+            mine = self.my_running_builds(jenkins)
+            if not mine:
+                log.info('you have no running builds')
+                return
+            build_numbers += [n for n in mine if n not in build_numbers]
+        if not build_numbers:
             return self.parser.print_help()
-        self.watch(build_number)
+        if len(build_numbers) > 1 and follow_log:
+            raise SystemExit('--log can only follow one build')
+        fail_fast = self.parser.has('--fail-fast')
+        abort = self.parser.has('--abort')
+        if abort and not fail_fast:
+            raise SystemExit('--abort only works with --fail-fast')
+        if len(build_numbers) > 1 and fail_fast:
+            raise SystemExit('--fail-fast can only scan one build')
+        # We save this state once we know that the builds exist.
+        self.state = WatchState(build_numbers)
+        self.state.log = follow_log
+        self.state.offset = offset
+        if resumed is not None and resumed.path != self.state.path:
+            self.replaces = resumed
+        if len(build_numbers) == 1:
+            return self.watch(build_numbers[0], follow_log=follow_log,
+                              offset=offset, fail_fast=fail_fast,
+                              abort=abort)
+        self.watch_many(build_numbers)
 
     def help(self):
         return self._help
 
-    def watch(self, build_number):
+    def resumable(self, build_numbers):
+        """
+        Find the interrupted watch-build to resume: the most recent one, or
+        the most recent one that watched any of these builds.
+
+        :returns: ``WatchState``
+        """
+        states = WatchState.interrupted()
+        if build_numbers:
+            states = [state for state in states
+                      if set(state.builds) & set(build_numbers)]
+        if not states:
+            raise SystemExit('there is no watch-build to resume')
+        if len(states) > 1:
+            others = ', '.join(' '.join(str(n) for n in state.builds)
+                               for state in states[1:])
+            log.info('also interrupted: %s (resume with `rhcephpkg '
+                     'watch-build --resume <id>`)' % others)
+        return states[0]
+
+    def save_state(self):
+        """
+        Save our WatchState, so that --resume can pick up after an
+        interruption.
+        """
+        if self.state is None:
+            return
+        self.state.save()
+        if self.replaces is not None:
+            # We are now watching these builds under a new name.
+            self.replaces.saved = True
+            self.replaces.clear()
+            self.replaces = None
+
+    def watch(self, build_number, follow_log=False, offset=0, queued=None,
+              fail_fast=False, abort=False):
+        """
+        Watch one build until it finishes, and record it in our history.
+
+        :param follow_log: ``bool``, print the build's console output
+        :param offset: ``int``, the number of bytes of the console output
+                       that we already printed
+        :param queued: ``float``, when the job entered Jenkins' queue
+                       (seconds since the epoch), if we know
+        :param fail_fast: ``bool``, exit as soon as the console output shows
+                          a fatal error
+        :param abort: ``bool``, with fail_fast, also abort the build
+        """
         jenkins = util.jenkins_connection()
+        self.fail_fast = fail_fast
+        self.abort = abort
+        if follow_log or fail_fast:
+            self.scanner = FailureScanner()
 
-        build_info = jenkins.get_build_info('build-package', build_number)
+        build_info = jenkins.build_status('build-package', build_number)
+        self.save_state()
 
         job_url = posixpath.join(jenkins.url, 'job', 'build-package',
                                  str(build_number))
@@ -58,26 +340,46 @@ For example: "rhcephpkg watch-build 328"
         # start = start.astimezone(tz.tzlocal())
         log.info('Started %s' % start.strftime("%F %r %z"))
 
+        if follow_log and build_info['building']:
+            self.follow(jenkins, build_number, offset)
+            build_info = jenkins.build_status('build-package', build_number)
+
+        # Predict when the build will finish from this package's recent
+        # successful builds, and poll Jenkins around then.
+        expected = None
+        if build_info['building']:
+            expected = expected_duration(jenkins, pkg_name)
+        scheduler = PollScheduler()
+        expect(scheduler, build_info, expected)
+
+        # With --log, follow() has already scanned the whole console.
+        console = None
+        if fail_fast and not follow_log:
+            console = ConsoleLog(jenkins, 'build-package', build_number)
+
+        breaker = CircuitBreaker()
         was_building = build_info['building']
+        delay = scheduler.next(build_info['building'])
         while build_info['building']:
             try:
-                elapsed = datetime.now(jenkins_tz) - start
-                # TODO: Xenial has python-humanize (humanize.naturaldelta()
-                # here)
-                (minutes, seconds) = divmod(elapsed.total_seconds(), 60)
-                # Clear the previous line:
-                msg = '\r%s building for %02d:%02d' % \
-                    (pkg_name, minutes, seconds)
-                sys.stdout.write(msg)
-                sys.stdout.flush()
-                sleep(10)
-                build_info = jenkins.get_build_info('build-package',
-                                                    build_number)
-            except requests.exceptions.ConnectionError as e:
-                print('')
-                log.error('connection error: %s' % e)
-                log.info('Re-try watching with `rhcephpkg watch-build %s`' %
-                         build_number)
+                # Keep the elapsed time display ticking between polls.
+                for _ in range(int(delay)):
+                    self.show_elapsed(pkg_name, start, expected)
+                    sleep(1)
+                self.show_elapsed(pkg_name, start, expected)
+                sleep(delay - int(delay))
+                build_info = jenkins.build_status('build-package',
+                                                  build_number)
+                if console is not None and console.more:
+                    self.check_failures(jenkins, build_number,
+                                        console.read())
+                breaker.success()
+                delay = scheduler.next(build_info['building'])
+            except OUTAGE_ERRORS as e:
+                if not breaker.open:
+                    # End the elapsed time line before we log.
+                    print('')
+                delay = breaker.failure(e)
             except KeyboardInterrupt:
                 print('')
                 log.info('continue watching with `rhcephpkg watch-build %s`' %
@@ -92,6 +394,11 @@ For example: "rhcephpkg watch-build 328"
         end = datetime.fromtimestamp(end_seconds, jenkins_tz)
         log.info('Ended %s' % end.strftime("%F %r %z"))
 
+        if self.state is not None:
+            self.state.clear()
+        record_build(build_number, build_info, queued)
+        self.report_transfer(jenkins)
+
         # Show the final build result.
         if build_info['result'] == 'SUCCESS':
             log.info('result is SUCCESS')
@@ -99,15 +406,206 @@ For example: "rhcephpkg watch-build 328"
             log.error(build_info['result'])
             raise SystemExit(1)
 
+    def my_running_builds(self, jenkins):
+        """
+        Find the running build-package builds that we started.
+
+        :returns: ``list`` of build numbers
+        """
+        user = jenkins.get_whoami()['id']
+        numbers = []
+        for build in jenkins.job_builds('build-package'):
+            if not build.get('building'):
+                continue
+            for action in build.get('actions', []):
+                causes = action.get('causes', [])
+                if any(cause.get('userId') == user for cause in causes):
+                    numbers.append(build['number'])
+                    break
+        return sorted(numbers)
+
+    def watch_many(self, build_numbers):
+        """
+        Watch several builds at once, over one Jenkins connection.
+
+        Each build has its own PollScheduler. We always poll the build whose
+        next poll is due soonest, and redraw a status table in between.
+        """
+        jenkins = util.jenkins_connection()
+        builds = []
+        for number in build_numbers:
+            info = jenkins.build_status('build-package', number)
+            pkg_name = self.pkg_name(info)
+            expected = None
+            if info['building']:
+                expected = expected_duration(jenkins, pkg_name)
+            builds.append(WatchedBuild(number, info, pkg_name, expected))
+        self.save_state()
+        log.info('Watching %d builds at %s' %
+                 (len(builds), posixpath.join(jenkins.url, 'job',
+                                              'build-package')))
+        breaker = CircuitBreaker()
+        tty = sys.stdout.isatty()
+        drawn = 0
+        reported = set()
+        while True:
+            now = time()
+            if tty:
+                # Move back up over the previous table, and redraw it.
+                if drawn:
+                    sys.stdout.write('\x1b[%dA' % drawn)
+                for build in builds:
+                    sys.stdout.write('\x1b[K%s\n' % build.status(now))
+                drawn = len(builds)
+            else:
+                # Only print each build's final state.
+                for build in builds:
+                    if not build.info['building'] and \
+                            build.number not in reported:
+                        print(build.status(now))
+                        reported.add(build.number)
+            sys.stdout.flush()
+            running = [build for build in builds if build.info['building']]
+            if not running:
+                break
+            build = min(running, key=lambda b: b.due)
+            try:
+                if build.due > now:
+                    # Wake up at least once a second to tick the table.
+                    sleep(min(build.due - now, 1))
+                    continue
+                build.info = jenkins.build_status('build-package',
+                                                  build.number)
+                breaker.success()
+            except OUTAGE_ERRORS as e:
+                # Jenkins is down for every build, not just this one.
+                delay = breaker.failure(e)
+                for other in running:
+                    other.due = time() + delay
+                continue
+            except KeyboardInterrupt:
+                print('')
+                numbers = ' '.join(str(b.number) for b in running)
+                log.info('continue watching with `rhcephpkg watch-build %s`'
+                         % numbers)
+                raise SystemExit(1)
+            build.due = time() + build.scheduler.next(build.info['building'])
+
+        if self.state is not None:
+            self.state.clear()
+        for build in builds:
+            record_build(build.number, build.info)
+        self.report_transfer(jenkins)
+        failed = [b for b in builds if b.info['result'] != 'SUCCESS']
+        if failed:
+            raise SystemExit('%d of %d builds did not succeed: %s' %
+                             (len(failed), len(builds),
+                              ', '.join(str(b.number) for b in failed)))
+        log.info('all %d builds succeeded' % len(builds))
+
+    def follow(self, jenkins, build_number, offset=0):
+        """
+        Print a build's console output as it arrives, until the build stops
+        writing to it.
+
+        We poll quickly while the build is writing output, and back off
+        while it is quiet.
+
+        :param offset: ``int``, the number of bytes of the log that we
+                       already printed
+        """
+        console = ConsoleLog(jenkins, 'build-package', build_number)
+        console.offset = offset
+        scheduler = PollScheduler()
+        breaker = CircuitBreaker()
+        while console.more:
+            try:
+                text = console.read()
+                breaker.success()
+                if text:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                    if self.state is not None:
+                        self.state.offset = console.offset
+                        self.state.save()
+                    self.check_failures(jenkins, build_number, text)
+                if console.more:
+                    sleep(scheduler.next(console.offset))
+            except OUTAGE_ERRORS as e:
+                sleep(breaker.failure(e))
+            except KeyboardInterrupt:
+                print('')
+                log.info('continue watching with `rhcephpkg watch-build '
+                         '--log %s`' % build_number)
+                raise SystemExit(1)
+
+    def check_failures(self, jenkins, build_number, text):
+        """
+        Scan the next piece of a build's console output for fatal errors.
+
+        We log each kind of error the first time it appears. With
+        --fail-fast, we exit instead (and with --abort, we abort the build
+        first).
+        """
+        if self.scanner is None:
+            return
+        for (name, line) in self.scanner.feed(text):
+            # End any elapsed time line before we log.
+            print('')
+            log.error('build #%d hit a %s error: %s' %
+                      (build_number, name, line))
+            if not self.fail_fast:
+                continue
+            if self.abort:
+                jenkins.stop_build('build-package', build_number)
+                log.info('aborted build #%d' % build_number)
+                if self.state is not None:
+                    self.state.clear()
+            else:
+                log.info('the build is still running, continue watching '
+                         'with `rhcephpkg watch-build %s`' % build_number)
+            raise SystemExit('build #%d is failing: %s error' %
+                             (build_number, name))
+
+    def report_transfer(self, jenkins):
+        """ Log how much we downloaded from the Jenkins API. """
+        log.info('transferred %s in %d Jenkins API requests' %
+                 (util.format_bytes(jenkins.transferred), jenkins.requests))
+
+    def show_elapsed(self, pkg_name, start, expected=None):
+        """
+        Overwrite the current line with the time since start, and how much
+        longer we expect the build to take.
+
+        :param expected: ``float``, the number of seconds that we predict
+                         the whole build will take, or None
+        """
+        elapsed = (datetime.now(start.tzinfo) - start).total_seconds()
+        # Clear the previous line:
+        msg = '\r%s building for %s' % (pkg_name, util.format_seconds(elapsed))
+        if expected:
+            remaining = expected - elapsed
+            if remaining > 0:
+                msg += ', about %s left (%d%%)' % (
+                    util.format_seconds(remaining), 100 * elapsed / expected)
+            else:
+                msg += ', %s longer than usual' % util.format_seconds(
+                    -remaining)
+        sys.stdout.write(msg)
+        sys.stdout.flush()
+
     def pkg_name(self, build_info):
         """ Return a package name based on this build's information.
 
-        :param build_info: ``dict`` from python-jenkins' get_build_info()
+        :param build_info: ``dict`` from JenkinsSession.build_status() or
+                           python-jenkins' get_build_info()
         :returns: ``str``, for example "ceph" or "ceph-ansible".
         """
         pkg_name = None
         for action in build_info['actions']:
-            if action.get('_class', '') == 'hudson.model.ParametersAction':
+            # Jenkins may leave out "_class" when we query with "tree".
+            action_class = action.get('_class', PARAMETERS_ACTION)
+            if action_class == PARAMETERS_ACTION and 'parameters' in action:
                 for parameter in action['parameters']:
                     if parameter['name'] == 'PKG_NAME':
                         pkg_name = parameter['value']
@@ -177,6 +177,7 @@ setup(
         'gbp',
         'python-bugzilla',
         'python-jenkins>=1.0.0',
+        'requests',
         'six',
         'tambo>=0.1.0',
     ],